@@ -1,15 +1,65 @@
+import os
 from fastapi import FastAPI
-from routes.callback import router as callback_router
-from core.database import init_db
+from routes.callback import router as callback_router, pipeline, coalescer
+from routes.health import router as health_router
+from core.config import Config
+from core.database import message_writer, warm_pool_in_background
+from core.models import preload_shared, warm_up_in_background
+from core.emotion_tagger import EmotionTagger
+from utils.logger import logger
+from utils.proc import process_uptime, current_rss_mb
 
 # 啟動 FastAPI
 app = FastAPI()
 
-# 初始化 MySQL 資料庫
-init_db()
+# 資料庫結構由部署時執行的 `python -m core.migrations` 建立，import 時不連資料庫（資料庫暫時連不上也能啟動）
+
+# 共享模式：fork worker 前先載入模型，worker 以 copy-on-write 共用權重
+if Config.MODEL_SHARED_PRELOAD:
+    preload_shared()
+
+# 背景情緒標記
+emotion_tagger = EmotionTagger(
+    Config.EMOTION_TAGGER_BATCH_SIZE,
+    Config.EMOTION_TAGGER_INTERVAL,
+    lease=Config.EMOTION_TAGGER_LEASE,
+    max_attempts=Config.EMOTION_TAGGER_MAX_ATTEMPTS
+)
 
 # 掛載路由
 app.include_router(callback_router)
+app.include_router(health_router)
+if Config.METRICS_ENDPOINT:
+    from routes.metrics import router as metrics_router
+    app.include_router(metrics_router)
+if Config.BENCH_ENDPOINTS:
+    from routes.bench import router as bench_router
+    app.include_router(bench_router)
+
+@app.on_event("startup")
+async def start_pipeline():
+    """ 啟動事件處理 worker、背景寫入、情緒標記，並在背景預熱連線池與模型 """
+    if Config.DB_POOL_WARM > 0:
+        warm_pool_in_background(Config.DB_POOL_WARM)
+    if Config.WRITE_BEHIND:
+        message_writer.start()
+    await pipeline.start()
+    if Config.EMOTION_TAGGER:
+        emotion_tagger.start()
+    if Config.MODEL_WARMUP:
+        warm_up_in_background()
+    logger.info(
+        "worker 啟動完成（pid %d）：耗時 %.1f 秒，RSS %.0f MB",
+        os.getpid(), process_uptime(), current_rss_mb()
+    )
+
+@app.on_event("shutdown")
+async def stop_pipeline():
+    """ 送出等待合併的訊息、處理完佇列中的事件、寫完尚未寫入的聊天記錄再關閉 """
+    await coalescer.stop()
+    await pipeline.stop()
+    message_writer.stop()
+    emotion_tagger.stop()
 
 if __name__ == "__main__":
     import uvicorn
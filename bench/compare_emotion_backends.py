@@ -0,0 +1,99 @@
+"""
+比較情緒分類後端的準確度與延遲
+
+以 pipeline 後端為基準，把保留樣本（bench/data/emotion_samples.tsv）分別送進每個後端，回報：
+- 與基準標籤的一致率（確認快速後端不會改變結果）
+- 與人工標籤的準確率
+- 單筆與整批推論的延遲
+
+用法：
+    python -m bench.compare_emotion_backends
+    python -m bench.compare_emotion_backends --backends pipeline quantized onnx --repeat 5
+"""
+import argparse
+import os
+import statistics
+import time
+from core.emotion_backends import BACKENDS, create_backend
+from core.models import SENTIMENT_MODEL
+
+SAMPLES_PATH = os.path.join(os.path.dirname(__file__), "data", "emotion_samples.tsv")
+
+
+def load_samples(path=SAMPLES_PATH):
+    """ 讀取樣本：回傳 [(文字, 標籤)] """
+    samples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line or line.startswith("#"):
+                continue
+            text, label = line.split("\t")
+            samples.append((text, label))
+    return samples
+
+
+def normalize(label):
+    """ 模型標籤只取 positive / negative """
+    return "positive" if label.lower().startswith("positive") else "negative"
+
+
+def measure(backend, texts, repeat):
+    """ 回傳（預測標籤、單筆延遲列表、整批延遲列表），單位秒 """
+    backend.predict(texts[:1])  # 預熱
+
+    single = []
+    for _ in range(repeat):
+        for text in texts:
+            started_at = time.perf_counter()
+            backend.predict([text])
+            single.append(time.perf_counter() - started_at)
+
+    batch = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        results = backend.predict(texts)
+        batch.append(time.perf_counter() - started_at)
+
+    return [normalize(r["label"]) for r in results], single, batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比較情緒分類後端")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--repeat", type=int, default=3, help="每種量測重複次數")
+    parser.add_argument("--threads", type=int, default=0, help="推論執行緒數，0 表示預設")
+    parser.add_argument("--samples", default=SAMPLES_PATH)
+    args = parser.parse_args()
+
+    samples = load_samples(args.samples)
+    texts = [text for text, _ in samples]
+    gold = [label for _, label in samples]
+
+    # 基準一定要跑
+    names = ["pipeline"] + [name for name in args.backends if name != "pipeline"]
+    baseline = None
+
+    print(f"樣本數 {len(texts)}，模型 {SENTIMENT_MODEL}\n")
+    print(f"{'後端':<10}{'一致率':>8}{'準確率':>8}{'單筆p50':>10}{'單筆p95':>10}{'整批/筆':>10}")
+    for name in names:
+        backend = create_backend(name, SENTIMENT_MODEL, num_threads=args.threads)
+        labels, single, batch = measure(backend, texts, args.repeat)
+        if baseline is None:
+            baseline = labels
+
+        agreement = sum(a == b for a, b in zip(labels, baseline)) / len(labels)
+        accuracy = sum(a == b for a, b in zip(labels, gold)) / len(labels)
+        single_sorted = sorted(single)
+        p50 = statistics.median(single_sorted) * 1000
+        p95 = single_sorted[min(len(single_sorted) - 1, int(len(single_sorted) * 0.95))] * 1000
+        per_item = statistics.median(batch) / len(texts) * 1000
+        print(f"{name:<10}{agreement:>8.1%}{accuracy:>8.1%}{p50:>8.1f}ms{p95:>8.1f}ms{per_item:>8.1f}ms")
+
+        disagreements = [text for text, a, b in zip(texts, labels, baseline) if a != b]
+        for text in disagreements:
+            print(f"    與基準不一致：{text}")
+
+
+if __name__ == "__main__":
+    main()
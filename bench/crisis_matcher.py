@@ -0,0 +1,87 @@
+"""
+危機詞比對的效能：詞庫大小與每則訊息耗時
+
+以正式詞庫加上隨機產生的中文詞擴充到不同大小，對保留樣本（bench/data/emotion_samples.tsv）比較：
+- Aho–Corasick 自動機（core/crisis.py，實際使用的做法）：每則訊息只掃一次，耗時幾乎不隨詞庫變大
+- 逐詞 `in` 比對：耗時與詞庫大小成正比
+同時回報自動機的建立時間與節點數（只在啟動時建一次）
+
+用法：
+    python -m bench.crisis_matcher
+    python -m bench.crisis_matcher --sizes 50 1000 10000 100000 --repeat 20
+"""
+import argparse
+import os
+import random
+import time
+from core.crisis import CrisisDetector, is_exclusion, load_lexicon, normalize
+
+SAMPLES_PATH = os.path.join(os.path.dirname(__file__), "data", "emotion_samples.tsv")
+# 一定要命中的訊息（確認擴充後的詞庫仍然比得到）
+CRISIS_SAMPLES = ["我真的不想活了", "好想 自杀", "想死你了", "最近常常想傷害自己"]
+
+
+def load_messages(path=SAMPLES_PATH):
+    messages = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line and not line.startswith("#"):
+                messages.append(line.split("\t")[0])
+    return messages + CRISIS_SAMPLES
+
+
+def synthetic_lexicon(base, size, seed=0):
+    """ 正式詞庫加上隨機的 2～6 字中文詞，補到 `size` 個 """
+    rng = random.Random(seed)
+    entries = list(base)
+    while len(entries) < size:
+        phrase = "".join(chr(rng.randint(0x4E00, 0x9FA5)) for _ in range(rng.randint(2, 6)))
+        entries.append(("synthetic", phrase))
+    return entries
+
+
+def time_per_message(func, messages, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for message in messages:
+            func(message)
+    return (time.perf_counter() - started) / (repeat * len(messages)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="危機詞比對的效能")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 500, 5000, 50000])
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    messages = load_messages()
+    base = load_lexicon()
+    print(f"樣本 {len(messages)} 則，平均 {sum(map(len, messages)) / len(messages):.1f} 字\n")
+    print(f"正規化：{time_per_message(normalize, messages, args.repeat):.1f} µs/則\n")
+    print(f"{'詞庫大小':>8} {'節點數':>8} {'建立 ms':>9} {'自動機 µs/則':>13} {'逐詞比對 µs/則':>15}")
+
+    for size in args.sizes:
+        entries = synthetic_lexicon(base, size)
+        started = time.perf_counter()
+        detector = CrisisDetector(entries)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        missed = [text for text in CRISIS_SAMPLES[:2] + CRISIS_SAMPLES[3:] if detector.match(text) is None]
+        if missed or detector.match("想死你了") is not None:
+            raise SystemExit(f"詞庫 {size}：比對結果錯誤 {missed}")
+
+        phrases = [normalize(phrase) for category, phrase in entries if not is_exclusion(category)]
+
+        def naive(text):
+            normalized = normalize(text)
+            return next((phrase for phrase in phrases if phrase in normalized), None)
+
+        automaton_us = time_per_message(lambda text: detector.match(text, count=False), messages, args.repeat)
+        naive_us = time_per_message(naive, messages, max(1, args.repeat // 10))
+        print(f"{len(entries):>8} {detector.stats()['automaton_nodes']:>8} {build_ms:>9.1f} "
+              f"{automaton_us:>13.1f} {naive_us:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
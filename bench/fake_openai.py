@@ -0,0 +1,138 @@
+"""
+本機的假 OpenAI 伺服器：在不花費 API 額度的情況下測試 GPT 閘道的逾時、重試與斷路器
+
+實作 POST /v1/chat/completions（一般與 stream 回應），可設定：
+- 回應延遲與串流每段的間隔
+- 回傳 429 / 500 的比例（429 帶 Retry-After）
+- 執行中以 POST /_control 切換設定，例如模擬 OpenAI 故障後恢復
+
+用法：
+    python -m bench.fake_openai --port 8081 --latency 0.5 --error-rate 0.1
+    OPENAI_BASE_URL=http://127.0.0.1:8081/v1 OPENAI_API_KEY=test uvicorn app:app
+
+    # 模擬故障 / 恢復
+    curl -X POST localhost:8081/_control -H 'content-type: application/json' -d '{"error_rate": 1}'
+    curl -X POST localhost:8081/_control -H 'content-type: application/json' -d '{"error_rate": 0}'
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+REPLY = "我在這裡陪著你。今天發生了什麼事呢？慢慢說，我都會聽。如果覺得累了，也可以先深呼吸，讓自己休息一下。"
+
+settings = {
+    "latency": 0.3,  # 回應前等待秒數
+    "chunk_interval": 0.05,  # 串流每段間隔秒數
+    "error_rate": 0.0,  # 回傳錯誤的比例
+    "rate_limit_share": 0.5,  # 錯誤中 429 所佔比例（其餘為 500）
+    "retry_after": 1,  # 429 的 Retry-After 秒數
+}
+counters = {"requests": 0, "errors": 0, "streams": 0}
+
+app = FastAPI()
+
+
+def _count_tokens(text):
+    return max(1, len(text))
+
+
+def _error():
+    counters["errors"] += 1
+    if random.random() < settings["rate_limit_share"]:
+        return JSONResponse(
+            {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+            status_code=429,
+            headers={"retry-after": str(settings["retry_after"])}
+        )
+    return JSONResponse({"error": {"message": "The server had an error", "type": "server_error"}}, status_code=500)
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    counters["requests"] += 1
+    await asyncio.sleep(settings["latency"])
+    if random.random() < settings["error_rate"]:
+        return _error()
+
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    model = body.get("model", "gpt-4")
+    prompt_tokens = sum(_count_tokens(m.get("content") or "") for m in body.get("messages", []))
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": _count_tokens(REPLY),
+        "total_tokens": prompt_tokens + _count_tokens(REPLY),
+    }
+
+    if not body.get("stream"):
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": REPLY}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    counters["streams"] += 1
+    include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+    async def events():
+        def chunk(delta, finish_reason=None, chunk_usage=None):
+            data = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+                "usage": chunk_usage,
+            }
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+        yield chunk({"role": "assistant", "content": ""})
+        for start in range(0, len(REPLY), 4):
+            await asyncio.sleep(settings["chunk_interval"])
+            yield chunk({"content": REPLY[start:start + 4]})
+        yield chunk({}, finish_reason="stop")
+        if include_usage:
+            yield chunk(None, chunk_usage=usage)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/_control")
+async def control(request: Request):
+    """ 執行中修改設定 """
+    settings.update({key: value for key, value in (await request.json()).items() if key in settings})
+    return settings
+
+
+@app.get("/_stats")
+async def stats():
+    return {"settings": settings, "counters": counters}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本機的假 OpenAI 伺服器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=settings["latency"], help="回應前等待秒數")
+    parser.add_argument("--chunk-interval", type=float, default=settings["chunk_interval"], help="串流每段間隔秒數")
+    parser.add_argument("--error-rate", type=float, default=settings["error_rate"], help="回傳 429 / 500 的比例")
+    args = parser.parse_args()
+
+    settings.update(latency=args.latency, chunk_interval=args.chunk_interval, error_rate=args.error_rate)
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
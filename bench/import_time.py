@@ -0,0 +1,106 @@
+"""
+量測 `import app` 的時間（worker 冷啟動、自動擴充新機器時最先付出的成本）
+
+每次都在新的子行程中 import，回報：
+- 牆鐘時間的中位數與最小值
+- import 之後已載入的大型套件（torch、transformers、langchain、numpy…應該都還沒載入）
+- `-X importtime` 中累計耗時最多的頂層套件
+加上 `--eager` 會先 import 這些大型套件，模擬改為延遲載入之前的啟動成本，方便對照
+
+import app 不會連資料庫（結構由 python -m core.migrations 建立），不需要 MySQL 也能執行
+
+用法：
+    python -m bench.import_time
+    python -m bench.import_time --eager
+    python -m bench.import_time --repeat 10 --top 20
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ["torch", "transformers", "langchain", "numpy", "tiktoken", "openai", "onnxruntime"]
+
+_PROBE = """
+import importlib, json, sys, time
+for name in {preload}:
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        pass
+started = time.perf_counter()
+import app
+elapsed = time.perf_counter() - started
+print(json.dumps({{"elapsed": elapsed, "loaded": [m for m in {heavy} if m in sys.modules]}}))
+"""
+
+
+def _env():
+    env = dict(os.environ)
+    # 只量測 import，不在 master 行程預載模型
+    env.setdefault("MODEL_SHARED_PRELOAD", "0")
+    return env
+
+
+def run_once(eager):
+    """ 在新行程中 import app，回傳 (含預載的總秒數, import app 秒數, 已載入的大型套件) """
+    code = _PROBE.format(preload=HEAVY_MODULES if eager else [], heavy=HEAVY_MODULES)
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, env=_env(), check=True
+    )
+    total = time.perf_counter() - started
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+    return total, probe["elapsed"], probe["loaded"]
+
+
+def top_imports(eager, top):
+    """ 以 -X importtime 找出累計耗時最多的頂層套件 """
+    code = _PROBE.format(preload=HEAVY_MODULES if eager else [], heavy=HEAVY_MODULES)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, env=_env(), check=True
+    )
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative_us, raw_name = line.split(":", 1)[1].split("|")
+        try:
+            cumulative_us = int(cumulative_us)
+        except ValueError:
+            continue  # 標題行
+        # 頂層套件（縮排只有一格）的累計時間已包含子模組
+        name = raw_name.strip()
+        if len(raw_name) - len(raw_name.lstrip()) == 1 and "." not in name:
+            cumulative[name] = max(cumulative.get(name, 0), cumulative_us)
+    return sorted(cumulative.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量測 import app 的時間")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="列出累計耗時最多的幾個頂層套件")
+    parser.add_argument("--eager", action="store_true", help="先 import 大型套件（模擬延遲載入之前）")
+    args = parser.parse_args()
+
+    runs = [run_once(args.eager) for _ in range(args.repeat)]
+    totals = [total for total, _, _ in runs]
+    imports = [elapsed for _, elapsed, _ in runs]
+    loaded = runs[-1][2]
+
+    mode = "預先載入大型套件" if args.eager else "延遲載入"
+    print(f"模式：{mode}，重複 {args.repeat} 次")
+    print(f"行程啟動到 import 完成：中位數 {statistics.median(totals):.2f} 秒，最快 {min(totals):.2f} 秒")
+    print(f"import app 本身：中位數 {statistics.median(imports):.2f} 秒，最快 {min(imports):.2f} 秒")
+    print(f"已載入的大型套件：{', '.join(loaded) if loaded else '（無）'}\n")
+
+    print("累計耗時最多的頂層套件：")
+    for name, cumulative_us in top_imports(args.eager, args.top):
+        print(f"  {cumulative_us / 1000:>9.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+/callback 壓力測試：以正確簽章的假 LINE webhook 打 app，量測單一節點能承受的負載
+
+搭配本機的替身服務執行（都不會呼叫外部 API）：
+    docker run -d -p 3306:3306 -e MYSQL_ROOT_PASSWORD=bench -e MYSQL_DATABASE=lume_bench mysql:8.0
+    DB_PASSWORD=bench DB_NAME=lume_bench python -m core.migrations
+    python -m bench.fake_openai --port 8081 --latency 0.8
+    python -m bench.mock_line --port 8082
+    DB_PASSWORD=bench DB_NAME=lume_bench BENCH_ENDPOINTS=1 MODEL_WARMUP=1 \\
+        OPENAI_BASE_URL=http://127.0.0.1:8081/v1 OPENAI_API_KEY=test \\
+        LINE_API_BASE_URL=http://127.0.0.1:8082 CHANNEL_SECRET=bench CHANNEL_ACCESS_TOKEN=bench \\
+        uvicorn app:app --port 5000 --workers 1
+
+    DB_PASSWORD=bench DB_NAME=lume_bench CHANNEL_SECRET=bench \\
+        python -m bench.load_callback --users 200 --events 5000 --concurrency 100 --seed
+
+情境：
+- chat：已同意、已填完基本資料的用戶聊天（完整走過 consent → profile → persist → GPT）
+- onboarding：新用戶，依序走過同意與基本資料填寫
+
+回報：
+- 吞吐量（每秒送出 / 每秒完成回覆的事件數）
+- webhook 回應延遲與端到端延遲（送出 webhook 到 mock LINE 收到 reply）的 p50 / p95 / p99
+- 各階段（consent、profile、persist、gpt、emotion…）的延遲、每事件 CPU 時間與資料庫查詢次數
+  （來自 app 的 /_bench/stats，只涵蓋回應該請求的 worker；要精確拆解時以 --workers 1 執行）
+
+連續訊息合併（MESSAGE_COALESCE=1）時，同一用戶短時間內的多則訊息只會以最後一則的 reply token 回覆，
+沒有回覆的事件不計入端到端延遲；要量測每則訊息各自的延遲時，app 以 MESSAGE_COALESCE=0 啟動
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import random
+import time
+import uuid
+from core.config import Config
+
+CHAT_MESSAGES = [
+    "我好累", "今天工作壓力好大", "睡不著怎麼辦", "最近心情有點低落", "謝謝你陪我聊天",
+    "我跟朋友吵架了，不知道該怎麼辦", "明天要考試好緊張", "今天天氣很好，心情也不錯",
+    "覺得自己什麼都做不好", "有什麼放鬆的方法嗎？",
+]
+ONBOARDING_MESSAGES = ["同意", "小明", "1995-06-01", "爬山、看電影", "還不錯"]
+
+
+def sign(body, secret):
+    """ 與 LINE 相同的簽章：HMAC-SHA256 後 base64 """
+    return base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+
+
+def text_event(user_id, text):
+    """ 產生一個文字訊息事件，回傳 (事件, reply token) """
+    reply_token = uuid.uuid4().hex
+    event = {
+        "type": "message",
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": user_id},
+        "webhookEventId": uuid.uuid4().hex.upper()[:26],
+        "deliveryContext": {"isRedelivery": False},
+        "replyToken": reply_token,
+        "message": {"id": str(random.randint(10 ** 15, 10 ** 16)), "type": "text", "text": text},
+    }
+    return event, reply_token
+
+
+def seed_users(user_ids):
+    """ chat 情境：先把用戶設成已同意、已填完基本資料 """
+    from core.database import create_user_db, set_user_consent, set_user_profile
+
+    for user_id in user_ids:
+        create_user_db(user_id)
+        set_user_consent(user_id)
+        set_user_profile(user_id, name="壓測", birth_date="1995-06-01", interests="跑步", mood="普通")
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    ordered = sorted(values)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": ordered[-1]}
+
+
+def build_plan(args, user_ids):
+    """ 依情境產生 (user_id, 文字) 的送出順序 """
+    if args.scenario == "onboarding":
+        # 每位用戶依序走完同意與填寫流程，用戶之間交錯
+        plan = []
+        for step in range(len(ONBOARDING_MESSAGES)):
+            plan.extend((user_id, ONBOARDING_MESSAGES[step]) for user_id in user_ids)
+        return plan[:args.events]
+    return [(random.choice(user_ids), random.choice(CHAT_MESSAGES)) for _ in range(args.events)]
+
+
+async def run(args):
+    import httpx
+
+    prefix = f"Ubench{uuid.uuid4().hex[:8]}"
+    user_ids = [f"{prefix}{i:05d}" for i in range(args.users)]
+    if args.seed and args.scenario == "chat":
+        print(f"建立 {len(user_ids)} 位測試用戶…")
+        await asyncio.to_thread(seed_users, user_ids)
+
+    plan = build_plan(args, user_ids)
+    # 同一用戶的訊息依序送出（與真實使用情況相同），不同用戶之間並行
+    per_user = {}
+    for user_id, text in plan:
+        per_user.setdefault(user_id, []).append(text)
+
+    sent_at = {}  # reply token -> 送出時間
+    ack_latencies = []
+    failures = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    interval = 1 / args.rate if args.rate else 0
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=30) as client:
+        await client.post("/_bench/reset")
+        await client.post(f"{args.mock_line}/_reset")
+        stats_before = (await client.get("/_bench/stats")).json()
+
+        async def send(user_id, text):
+            event, reply_token = text_event(user_id, text)
+            body = json.dumps({"destination": "Ubench", "events": [event]}, ensure_ascii=False).encode()
+            headers = {"X-Line-Signature": sign(body, args.secret), "Content-Type": "application/json"}
+            async with semaphore:
+                started = time.time()
+                try:
+                    response = await client.post("/callback", content=body, headers=headers)
+                    status = response.status_code
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                ack_latencies.append(time.time() - started)
+            if status == 200:
+                sent_at[reply_token] = started
+            else:
+                failures[status] = failures.get(status, 0) + 1
+
+        async def user_session(user_id, texts):
+            for text in texts:
+                await send(user_id, text)
+                if args.think_time:
+                    await asyncio.sleep(random.uniform(0, args.think_time * 2))
+
+        started = time.time()
+        if interval:
+            # 固定送出速率：依序排程每個用戶的第一則，之後依各自的節奏
+            tasks = []
+            for user_id, texts in per_user.items():
+                tasks.append(asyncio.create_task(user_session(user_id, texts)))
+                await asyncio.sleep(interval * len(texts))
+            await asyncio.gather(*tasks)
+        else:
+            await asyncio.gather(*(user_session(user_id, texts) for user_id, texts in per_user.items()))
+        send_seconds = time.time() - started
+
+        # 等 app 處理完（mock LINE 不再收到新的 reply）
+        print("等待處理完成…")
+        last_count, stable_since = -1, time.time()
+        while time.time() - stable_since < args.drain_idle and time.time() - started < send_seconds + args.drain_timeout:
+            counters = (await client.get(f"{args.mock_line}/_stats")).json()["counters"]
+            if counters["reply"] != last_count:
+                last_count, stable_since = counters["reply"], time.time()
+            await asyncio.sleep(0.5)
+
+        replies = (await client.get(f"{args.mock_line}/_messages", params={"type": "reply", "limit": 10 ** 6})).json()
+        stats_after = (await client.get("/_bench/stats")).json()
+
+    e2e = [m["at"] - sent_at[m["to"]] for m in replies if m["to"] in sent_at]
+    completed_seconds = max((m["at"] for m in replies), default=started) - started
+    report(args, len(plan), send_seconds, completed_seconds, ack_latencies, e2e, failures, stats_before, stats_after)
+
+
+def report(args, total, send_seconds, completed_seconds, ack_latencies, e2e, failures, before, after):
+    accepted = len(ack_latencies) - sum(failures.values())
+    ack = percentiles(ack_latencies)
+    end_to_end = percentiles(e2e)
+    stages = after["stages"]
+    events = stages.get("event", {}).get("count", 0)
+    cpu = after["cpu_seconds"] - before["cpu_seconds"] if after["pid"] == before["pid"] else None
+
+    print()
+    print(f"情境 {args.scenario}：{total} 則，{args.users} 位用戶，並行 {args.concurrency}")
+    print(f"送出：{send_seconds:.1f} 秒，{accepted / send_seconds:.1f} 則/秒（失敗 {failures or 0}）")
+    print(f"完成回覆：{len(e2e)} 則，{len(e2e) / max(completed_seconds, 1e-9):.1f} 則/秒")
+    print("webhook 回應延遲 ms：" + "  ".join(f"{k} {v * 1000:.0f}" for k, v in ack.items()))
+    print("端到端延遲 ms：     " + "  ".join(f"{k} {v * 1000:.0f}" for k, v in end_to_end.items()))
+    if events:
+        event_stage = stages["event"]
+        flush_queries = stages.get("persist_flush", {}).get("queries", 0)
+        print(f"每事件資料庫查詢：{(event_stage['queries'] + flush_queries) / events:.2f}（含背景批次寫入）")
+        if cpu is not None:
+            print(f"每事件 CPU：{cpu / events * 1000:.1f} ms（worker pid {after['pid']}，含背景執行緒）")
+
+    print()
+    print(f"{'階段':<14}{'次數':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'CPU ms':>10}{'查詢':>8}")
+    for name in ("event", "consent", "profile", "persist", "gpt", "emotion", "persist_flush"):
+        item = stages.get(name)
+        if item is None:
+            continue
+        print(
+            f"{name:<14}{item['count']:>8}{item['p50_ms']:>10.1f}{item['p95_ms']:>10.1f}{item['p99_ms']:>10.1f}"
+            f"{item['cpu_ms_avg']:>10.2f}{item['queries_avg']:>8.2f}"
+        )
+
+    print()
+    print(f"GPT：{json.dumps({k: after['gpt'][k] for k in ('calls', 'retries', 'fallbacks', 'breaker')})}")
+    print(f"DB 連線池：{json.dumps({k: after['db_pool'][k] for k in ('checkouts', 'waits', 'timeouts', 'wait_time_avg_ms')})}")
+    print(f"事件佇列：{json.dumps(after['pipeline'], ensure_ascii=False)}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "scenario": args.scenario, "events": total, "users": args.users, "concurrency": args.concurrency,
+                "send_seconds": send_seconds, "accepted": accepted, "failures": failures,
+                "completed": len(e2e), "completed_seconds": completed_seconds,
+                "ack_latency": ack, "e2e_latency": end_to_end,
+                "cpu_seconds": cpu, "stats_before": before, "stats_after": after,
+            }, f, ensure_ascii=False, indent=2, default=str)
+        print(f"結果已寫入 {args.json}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/callback 壓力測試")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="app 的網址")
+    parser.add_argument("--mock-line", default="http://127.0.0.1:8082", help="bench/mock_line.py 的網址")
+    parser.add_argument("--secret", default=Config.CHANNEL_SECRET, help="簽章用的 channel secret")
+    parser.add_argument("--scenario", choices=["chat", "onboarding"], default="chat")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50, help="同時進行的 webhook 請求數")
+    parser.add_argument("--rate", type=float, default=0, help="每秒送出的事件數，0 表示盡快送出")
+    parser.add_argument("--think-time", type=float, default=0, help="同一用戶兩則訊息之間的平均間隔秒數")
+    parser.add_argument("--seed", action="store_true", help="chat 情境先在資料庫建立已完成設定的用戶")
+    parser.add_argument("--drain-idle", type=float, default=5, help="幾秒沒有新的回覆就視為處理完成")
+    parser.add_argument("--drain-timeout", type=float, default=300, help="最多等待處理的秒數")
+    parser.add_argument("--json", help="把完整結果寫入 JSON 檔（用於比較不同版本）")
+    args = parser.parse_args()
+
+    if not args.secret:
+        parser.error("需要 --secret 或 CHANNEL_SECRET")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
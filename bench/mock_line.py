@@ -0,0 +1,156 @@
+"""
+本機的假 LINE Messaging API：在不真的發送訊息的情況下測試 LINE 用戶端的合併、multicast、速率控制與重試
+
+實作 reply / push / multicast，並照 LINE 的規則檢查：
+- 每個請求最多 5 則訊息、multicast 最多 500 人
+- reply token 只能使用一次
+- 同一個 X-Line-Retry-Key 已被接受時回傳 409
+- 每秒請求數超過 `--rate-limit` 時回傳 429，另可設定 5xx 比例與延遲
+
+用法：
+    python -m bench.mock_line --port 8082 --rate-limit 2000 --error-rate 0.05
+    LINE_API_BASE_URL=http://127.0.0.1:8082 uvicorn app:app
+    curl localhost:8082/_stats
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import deque
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+settings = {
+    "latency": 0.02,  # 回應前等待秒數
+    "error_rate": 0.0,  # 回傳 500 的比例
+    "rate_limit": 2000,  # 每秒請求上限
+}
+counters = {"reply": 0, "push": 0, "multicast": 0, "messages": 0, "rate_limited": 0, "errors": 0, "conflicts": 0}
+used_reply_tokens = set()
+accepted_retry_keys = set()
+recent_requests = deque()
+# 最近送出的訊息（測試時檢查內容、計算端到端延遲）
+sent = deque(maxlen=100000)
+
+app = FastAPI()
+
+
+def _error(status_code, message):
+    return JSONResponse({"message": message}, status_code=status_code)
+
+
+async def _check(request, body):
+    """ 共用檢查：速率、隨機錯誤、訊息數量、retry key；通過時回傳 None """
+    now = time.monotonic()
+    while recent_requests and now - recent_requests[0] > 1:
+        recent_requests.popleft()
+    if len(recent_requests) >= settings["rate_limit"]:
+        counters["rate_limited"] += 1
+        return _error(429, "The API rate limit has been exceeded. Try again later.")
+    recent_requests.append(now)
+
+    await asyncio.sleep(settings["latency"])
+    if random.random() < settings["error_rate"]:
+        counters["errors"] += 1
+        return _error(500, "Internal server error")
+
+    messages = body.get("messages", [])
+    if not 1 <= len(messages) <= 5:
+        return _error(400, "Size must be between 1 and 5")
+
+    retry_key = request.headers.get("x-line-retry-key")
+    if retry_key:
+        if retry_key in accepted_retry_keys:
+            counters["conflicts"] += 1
+            return _error(409, "The retry key is already accepted")
+        accepted_retry_keys.add(retry_key)
+    return None
+
+
+@app.post("/v2/bot/message/reply")
+async def reply(request: Request):
+    body = await request.json()
+    error = await _check(request, body)
+    if error is not None:
+        return error
+    if body.get("replyToken") in used_reply_tokens:
+        return _error(400, "Invalid reply token")
+    used_reply_tokens.add(body.get("replyToken"))
+    counters["reply"] += 1
+    counters["messages"] += len(body["messages"])
+    sent.append({"type": "reply", "to": body.get("replyToken"), "messages": body["messages"], "at": time.time()})
+    return {}
+
+
+@app.post("/v2/bot/message/push")
+async def push(request: Request):
+    body = await request.json()
+    error = await _check(request, body)
+    if error is not None:
+        return error
+    counters["push"] += 1
+    counters["messages"] += len(body["messages"])
+    sent.append({"type": "push", "to": body.get("to"), "messages": body["messages"], "at": time.time()})
+    return {}
+
+
+@app.post("/v2/bot/message/multicast")
+async def multicast(request: Request):
+    body = await request.json()
+    if not 1 <= len(body.get("to", [])) <= 500:
+        return _error(400, "Size must be between 1 and 500")
+    error = await _check(request, body)
+    if error is not None:
+        return error
+    counters["multicast"] += 1
+    counters["messages"] += len(body["messages"]) * len(body["to"])
+    sent.append({"type": "multicast", "to": body["to"], "messages": body["messages"], "at": time.time()})
+    return {}
+
+
+@app.post("/_control")
+async def control(request: Request):
+    """ 執行中修改設定 """
+    settings.update({key: value for key, value in (await request.json()).items() if key in settings})
+    return settings
+
+
+@app.get("/_stats")
+async def stats():
+    return {"settings": settings, "counters": counters}
+
+
+@app.get("/_messages")
+async def messages(limit: int = 20, type: str = None):
+    items = [m for m in sent if type is None or m["type"] == type]
+    return items[-limit:]
+
+
+@app.post("/_reset")
+async def reset():
+    """ 清除記錄與計數（壓力測試每輪開始前呼叫） """
+    sent.clear()
+    used_reply_tokens.clear()
+    accepted_retry_keys.clear()
+    for key in counters:
+        counters[key] = 0
+    return counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本機的假 LINE Messaging API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--latency", type=float, default=settings["latency"], help="回應前等待秒數")
+    parser.add_argument("--error-rate", type=float, default=settings["error_rate"], help="回傳 500 的比例")
+    parser.add_argument("--rate-limit", type=int, default=settings["rate_limit"], help="每秒請求上限")
+    args = parser.parse_args()
+
+    settings.update(latency=args.latency, error_rate=args.error_rate, rate_limit=args.rate_limit)
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+"""
+聊天記錄封存：把超過保存期限的訊息搬出 MySQL，讓 messages 表（與 buffer pool）只留最近的熱資料
+
+- 每位用戶一個目錄：append-only 的 zstd 區段檔（segment）與一個小索引（index.jsonl）
+  - 每批訊息壓成一個 zstd frame 接在目前的區段檔後面，區段檔超過上限就換新檔
+  - 索引每批一行：區段檔、位移、長度、筆數、id 與時間範圍，讀取時可以只解壓需要的 frame
+- 每批的順序：寫 PENDING 標記 → 寫 frame 並 fsync → 寫索引並 fsync → 刪除資料庫中這批訊息 → 移除標記
+  中斷後重跑時依 PENDING 標記收尾：frame 已寫進索引就補刪資料庫；寫到一半就截掉殘缺的 frame
+- 串流讀取：匯出或還原一位用戶的完整歷史時一次只解壓一個 frame，不會整個載入記憶體
+
+用法：
+    python -m core.archive                           # 封存所有用戶超過 ARCHIVE_AFTER_DAYS 天的訊息
+    python -m core.archive --days 90 --user <ID>     # 指定天數 / 只封存某位用戶
+    python -m core.archive --export <ID> --include-live > history.jsonl   # 匯出完整歷史（封存 + 資料庫）
+    python -m core.archive --restore <ID>            # 把封存的訊息寫回資料庫並移除封存檔
+"""
+import argparse
+import codecs
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import datetime, timedelta
+from core.config import Config
+from core.database import get_db_connection
+from utils.logger import logger
+
+LOCK_NAME = "lume_message_archive"
+INDEX_FILE = "index.jsonl"
+PENDING_FILE = "PENDING"
+COLUMNS = ("id", "sender", "message", "emotion", "emotion_score", "timestamp")
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _encode_row(row):
+    record = dict(zip(COLUMNS, row))
+    record["timestamp"] = record["timestamp"].isoformat() if record["timestamp"] else None
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def _decode_row(line):
+    record = json.loads(line)
+    record["timestamp"] = datetime.fromisoformat(record["timestamp"]) if record["timestamp"] else None
+    return record
+
+
+class UserArchive:
+    """ 一位用戶的封存目錄（同一時間只能有一個封存工作寫入，由 GET_LOCK 保證） """
+
+    def __init__(self, root, user_id, segment_max_bytes=64 * 1024 * 1024, level=10):
+        # 依 user_id 雜湊分散到 256 個子目錄，避免單一目錄下檔案過多
+        shard = hashlib.sha1(user_id.encode()).hexdigest()[:2]
+        self.path = os.path.join(root, shard, user_id)
+        self.user_id = user_id
+        self.segment_max_bytes = segment_max_bytes
+        self.level = level
+        self._last_entry = None  # 索引的最後一項，第一次需要時才讀索引，之後隨 append 更新
+        self._last_loaded = False
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, INDEX_FILE))
+
+    def entries(self):
+        """ 索引中的每一批（依封存順序，也就是時間順序） """
+        try:
+            with open(os.path.join(self.path, INDEX_FILE), encoding="utf-8") as f:
+                for line in f:
+                    # 沒有換行結尾的是正在寫入的最後一行
+                    if line.endswith("\n") and line.strip():
+                        yield json.loads(line)
+        except FileNotFoundError:
+            return
+
+    def _last(self):
+        """ 索引的最後一項（沒有時為 None） """
+        if not self._last_loaded:
+            for entry in self.entries():
+                self._last_entry = entry
+            self._last_loaded = True
+        return self._last_entry
+
+    def _current_segment(self):
+        """ 目前要接著寫的區段檔名；超過大小上限時換下一個 """
+        last = self._last()
+        if last is None:
+            return "seg-000001.zst"
+        last = last["segment"]
+        if os.path.getsize(os.path.join(self.path, last)) >= self.segment_max_bytes:
+            number = int(last[4:10]) + 1
+            return f"seg-{number:06d}.zst"
+        return last
+
+    def append(self, rows):
+        """
+        把一批訊息（依時間排序的 [(id, sender, message, emotion, emotion_score, timestamp)]）寫成一個 frame
+        回傳索引項目；呼叫端刪除資料庫中這批訊息後要呼叫 commit()
+        """
+        import zstandard
+
+        os.makedirs(self.path, exist_ok=True)
+        segment = self._current_segment()
+        segment_path = os.path.join(self.path, segment)
+        offset = os.path.getsize(segment_path) if os.path.exists(segment_path) else 0
+
+        with open(os.path.join(self.path, PENDING_FILE), "w", encoding="utf-8") as f:
+            json.dump({"segment": segment, "offset": offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        compressor = zstandard.ZstdCompressor(level=self.level, write_checksum=True)
+        with open(segment_path, "ab") as f:
+            with compressor.stream_writer(f, closefd=False) as writer:
+                for row in rows:
+                    writer.write(_encode_row(row).encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+            length = f.tell() - offset
+
+        entry = {
+            "segment": segment,
+            "offset": offset,
+            "length": length,
+            "rows": len(rows),
+            "first_id": rows[0][0],
+            "last_id": rows[-1][0],
+            "first_ts": rows[0][5].isoformat(),
+            "last_ts": rows[-1][5].isoformat(),
+        }
+        with open(os.path.join(self.path, INDEX_FILE), "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        _fsync_dir(self.path)
+        self._last_entry = entry
+        return entry
+
+    def commit(self):
+        """ 這批訊息已從資料庫刪除 """
+        os.remove(os.path.join(self.path, PENDING_FILE))
+
+    def recover(self, delete_ids):
+        """
+        上次中斷時的收尾：frame 已寫進索引就以 `delete_ids(ids)` 補刪資料庫，否則截掉殘缺的 frame
+        """
+        pending_path = os.path.join(self.path, PENDING_FILE)
+        try:
+            with open(pending_path, encoding="utf-8") as f:
+                pending = json.load(f)
+        except FileNotFoundError:
+            return
+
+        last = self._last()
+        if last is not None and (last["segment"], last["offset"]) == (pending["segment"], pending["offset"]):
+            ids = [record["id"] for record in self._read_frame(last)]
+            delete_ids(ids)
+            logger.info("封存收尾（%s）：補刪 %d 筆已封存的訊息", self.user_id, len(ids))
+        else:
+            segment_path = os.path.join(self.path, pending["segment"])
+            if os.path.exists(segment_path):
+                with open(segment_path, "r+b") as f:
+                    f.truncate(pending["offset"])
+            logger.info("封存收尾（%s）：移除寫到一半的區段資料", self.user_id)
+        os.remove(pending_path)
+
+    def _read_frame(self, entry, chunk_size=64 * 1024):
+        """
+        串流解壓一個 frame，逐筆產生訊息
+        只讀索引記錄的 `length` 個位元組（同一區段檔後面還有其他 frame，不能讓解壓器讀過頭）
+        """
+        import zstandard
+
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        pending = ""
+        with open(os.path.join(self.path, entry["segment"]), "rb") as f:
+            f.seek(entry["offset"])
+            remaining = entry["length"]
+            while remaining > 0:
+                data = f.read(min(chunk_size, remaining))
+                if not data:
+                    raise ValueError(f"區段檔 {entry['segment']} 在位移 {entry['offset']} 的 frame 不完整")
+                remaining -= len(data)
+                pending += decoder.decode(decompressor.decompress(data))
+                *lines, pending = pending.split("\n")
+                for line in lines:
+                    yield _decode_row(line)
+        pending += decoder.decode(b"", final=True)
+        if pending:
+            yield _decode_row(pending)
+
+    def iter_rows(self, since=None, until=None):
+        """ 依時間順序逐筆產生封存的訊息；有給時間範圍時，只解壓範圍內的 frame """
+        for entry in self.entries():
+            if since is not None and datetime.fromisoformat(entry["last_ts"]) < since:
+                continue
+            if until is not None and datetime.fromisoformat(entry["first_ts"]) >= until:
+                continue
+            for record in self._read_frame(entry):
+                if (since is None or record["timestamp"] >= since) and (until is None or record["timestamp"] < until):
+                    yield record
+
+    def remove(self):
+        shutil.rmtree(self.path)
+        self._last_entry = None
+        self._last_loaded = False
+
+
+def _user_archive(user_id):
+    return UserArchive(
+        Config.ARCHIVE_DIR, user_id,
+        segment_max_bytes=Config.ARCHIVE_SEGMENT_MAX_MB * 1024 * 1024,
+        level=Config.ARCHIVE_ZSTD_LEVEL
+    )
+
+
+def _acquire_lock(conn, timeout=0):
+    """ 取得封存鎖（封存、還原、含資料庫訊息的匯出互斥；鎖綁在這條連線上） """
+    cursor = conn.cursor()
+    cursor.execute("SELECT GET_LOCK(%s, %s)", (LOCK_NAME, timeout))
+    if cursor.fetchone()[0] != 1:
+        raise RuntimeError("另一個封存工作正在執行")
+
+
+def _release_lock(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+    cursor.fetchone()
+
+
+def _delete_ids(conn, user_id, ids):
+    cursor = conn.cursor()
+    placeholders = ", ".join(["%s"] * len(ids))
+    cursor.execute(f"DELETE FROM messages WHERE user_id = %s AND id IN ({placeholders})", (user_id, *ids))
+    conn.commit()
+
+
+def archive_user(conn, user_id, cutoff, batch_size=1000, sleep=0.0):
+    """ 封存一位用戶在 `cutoff` 之前的訊息，回傳 (筆數, 壓縮後位元組數) """
+    archive = _user_archive(user_id)
+    archive.recover(lambda ids: _delete_ids(conn, user_id, ids) if ids else None)
+
+    cursor = conn.cursor()
+    rows_total = bytes_total = 0
+    while True:
+        # idx_user_time (user_id, timestamp, id) 讓這個查詢只掃該用戶最舊的一段
+        cursor.execute("""
+            SELECT id, sender, message, emotion, emotion_score, timestamp FROM messages
+            WHERE user_id = %s AND timestamp < %s
+            ORDER BY timestamp, id
+            LIMIT %s
+        """, (user_id, cutoff, batch_size))
+        rows = cursor.fetchall()
+        conn.commit()  # 結束讀取的交易，避免長時間持有快照
+        if not rows:
+            break
+
+        entry = archive.append(rows)
+        _delete_ids(conn, user_id, [row[0] for row in rows])
+        archive.commit()
+
+        rows_total += len(rows)
+        bytes_total += entry["length"]
+        if len(rows) < batch_size:
+            break
+        if sleep:
+            time.sleep(sleep)
+    return rows_total, bytes_total
+
+
+def _iter_user_ids(conn, user_id=None, page_size=500):
+    if user_id is not None:
+        yield user_id
+        return
+    cursor = conn.cursor()
+    last = ""
+    while True:
+        cursor.execute("SELECT user_id FROM users WHERE user_id > %s ORDER BY user_id LIMIT %s", (last, page_size))
+        user_ids = [row[0] for row in cursor.fetchall()]
+        conn.commit()
+        if not user_ids:
+            return
+        yield from user_ids
+        last = user_ids[-1]
+
+
+def archive_all(days, user_id=None, batch_size=1000, sleep=0.0):
+    """ 封存所有（或指定）用戶超過 `days` 天的訊息，回傳 (用戶數, 筆數, 壓縮後位元組數) """
+    cutoff = datetime.now().replace(microsecond=0) - timedelta(days=days)
+    conn = get_db_connection()
+    try:
+        _acquire_lock(conn)
+        try:
+            users = rows = size = 0
+            for current in _iter_user_ids(conn, user_id):
+                archived, archived_bytes = archive_user(conn, current, cutoff, batch_size, sleep)
+                if archived:
+                    users += 1
+                    rows += archived
+                    size += archived_bytes
+                    logger.info("已封存 %s：%d 筆，%d KB", current, archived, archived_bytes // 1024)
+            return users, rows, size
+        finally:
+            _release_lock(conn)
+    finally:
+        conn.close()
+
+
+def iter_live_rows(conn, user_id, batch_size=1000):
+    """ 依 id 分批讀出資料庫中該用戶的訊息（不會一次全部載入） """
+    cursor = conn.cursor()
+    last_id = 0
+    while True:
+        cursor.execute("""
+            SELECT id, sender, message, emotion, emotion_score, timestamp FROM messages
+            WHERE user_id = %s AND id > %s
+            ORDER BY id
+            LIMIT %s
+        """, (user_id, last_id, batch_size))
+        rows = cursor.fetchall()
+        conn.commit()
+        if not rows:
+            return
+        for row in rows:
+            yield dict(zip(COLUMNS, row))
+        last_id = rows[-1][0]
+
+
+def _write_records(output, records):
+    count = 0
+    for record in records:
+        timestamp = record["timestamp"].isoformat() if record["timestamp"] else None
+        output.write(json.dumps({**record, "timestamp": timestamp}, ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+
+def export_user(user_id, output, include_live=False, lock_timeout=60):
+    """
+    以 JSON Lines 匯出封存（與資料庫中）的訊息，回傳筆數
+    含資料庫訊息時持有封存鎖，避免匯出期間有訊息從資料庫搬進封存檔（漏掉或重複）
+    """
+    archive = _user_archive(user_id)
+    if not include_live:
+        return _write_records(output, archive.iter_rows())
+
+    conn = get_db_connection()
+    try:
+        _acquire_lock(conn, lock_timeout)
+        try:
+            count = _write_records(output, archive.iter_rows())
+            return count + _write_records(output, iter_live_rows(conn, user_id))
+        finally:
+            _release_lock(conn)
+    finally:
+        conn.close()
+
+
+def restore_user(user_id, batch_size=1000, lock_timeout=60):
+    """
+    把封存的訊息（保留原本的 id）分批寫回資料庫，完成後移除封存檔，回傳筆數
+    持有封存鎖：封存工作不會同時刪除這些訊息，也不會寫入即將移除的封存檔
+    """
+    archive = _user_archive(user_id)
+    conn = get_db_connection()
+    try:
+        _acquire_lock(conn, lock_timeout)
+        try:
+            if not archive.exists():
+                return 0
+            # 先完成上次中斷的封存，避免同一筆同時留在資料庫與封存檔
+            archive.recover(lambda ids: _delete_ids(conn, user_id, ids) if ids else None)
+            cursor = conn.cursor()
+            batch = []
+            count = 0
+            for record in archive.iter_rows():
+                batch.append((record["id"], user_id, record["sender"], record["message"],
+                              record["emotion"], record["emotion_score"], record["timestamp"]))
+                if len(batch) >= batch_size:
+                    count += _insert_restored(cursor, conn, batch)
+                    batch = []
+            if batch:
+                count += _insert_restored(cursor, conn, batch)
+            archive.remove()
+            return count
+        finally:
+            _release_lock(conn)
+    finally:
+        conn.close()
+
+
+def _insert_restored(cursor, conn, batch):
+    cursor.executemany("""
+        INSERT IGNORE INTO messages (id, user_id, sender, message, emotion, emotion_score, timestamp)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """, batch)
+    conn.commit()
+    return len(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="封存 / 匯出 / 還原聊天記錄")
+    parser.add_argument("--days", type=int, default=Config.ARCHIVE_AFTER_DAYS, help="封存超過幾天的訊息")
+    parser.add_argument("--user", help="只封存指定的 user_id")
+    parser.add_argument("--batch-size", type=int, default=Config.ARCHIVE_BATCH_SIZE, help="每批封存 / 刪除筆數")
+    parser.add_argument("--sleep", type=float, default=0.0, help="每批之間暫停秒數")
+    parser.add_argument("--export", metavar="USER_ID", help="以 JSON Lines 匯出該用戶封存的訊息")
+    parser.add_argument("--include-live", action="store_true", help="匯出時一併輸出資料庫中的訊息")
+    parser.add_argument("--output", help="匯出檔案路徑（預設輸出到 stdout）")
+    parser.add_argument("--restore", metavar="USER_ID", help="把該用戶封存的訊息寫回資料庫")
+    args = parser.parse_args()
+
+    if args.export:
+        output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+        try:
+            count = export_user(args.export, output, include_live=args.include_live)
+        finally:
+            if args.output:
+                output.close()
+        print(f"📦 已匯出 {count} 筆", file=sys.stderr)
+        return
+
+    if args.restore:
+        count = restore_user(args.restore, batch_size=args.batch_size)
+        print(f"♻️ 已還原 {count} 筆")
+        return
+
+    users, rows, size = archive_all(args.days, args.user, batch_size=args.batch_size, sleep=args.sleep)
+    print(f"🎉 封存完成：{users} 位用戶，{rows} 筆，壓縮後 {size / 1024 / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
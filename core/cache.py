@@ -0,0 +1,155 @@
+"""
+讀取快取（read-through）：熱路徑上幾乎不變的資料（使用者同意狀態、基本資料）不必每則訊息都查 MySQL
+
+- 第一層：行程內 LRU + TTL
+- 第二層（選用）：多個 worker 共用的快取後端，由 Config.CACHE_SHARED_BACKEND 選擇
+  共用後端需提供 get(key) -> (found, value)、set(key, value, ttl)、delete(key)
+- 資料變更時呼叫 invalidate() 明確清除；其他 worker 的第一層最多在 TTL 內過期
+"""
+import threading
+import time
+from collections import OrderedDict
+from core.config import Config
+
+
+class InMemoryBackend:
+    """ 行程內的共用後端，測試時代替真正的共用快取 """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return False, None
+            value, expires_at = item
+            if time.monotonic() > expires_at:
+                del self._data[key]
+                return False, None
+            return True, value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+# 共用後端註冊表：名稱 -> 建立函式
+SHARED_BACKENDS = {
+    "memory": InMemoryBackend,
+}
+
+_shared_backend = None
+_shared_backend_lock = threading.Lock()
+
+def register_shared_backend(name, factory):
+    """ 註冊新的共用後端（例如 Redis 等外部快取） """
+    SHARED_BACKENDS[name] = factory
+
+def get_shared_backend():
+    """ 依 Config.CACHE_SHARED_BACKEND 建立（每個行程一個）共用後端，未設定時回傳 None """
+    global _shared_backend
+    name = Config.CACHE_SHARED_BACKEND
+    if not name:
+        return None
+    with _shared_backend_lock:
+        if _shared_backend is None:
+            if name not in SHARED_BACKENDS:
+                raise ValueError(f"未知的快取後端：{name}（可用：{', '.join(SHARED_BACKENDS)}）")
+            _shared_backend = SHARED_BACKENDS[name]()
+    return _shared_backend
+
+
+class ReadThroughCache:
+    """
+    兩層讀取快取
+    get_or_load() 依序查第一層、第二層，都沒有才呼叫 loader 讀資料庫
+    """
+
+    def __init__(self, name, max_size=10000, ttl=300, shared=None):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self._shared = shared
+
+        self._local = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._shared_hits = 0
+        self._misses = 0
+
+    def _shared_key(self, key):
+        return f"{self.name}:{key}"
+
+    def get(self, key):
+        """ 回傳 (found, value) """
+        with self._lock:
+            item = self._local.get(key)
+            if item is not None:
+                value, expires_at = item
+                if time.monotonic() <= expires_at:
+                    self._local.move_to_end(key)
+                    self._hits += 1
+                    return True, value
+                del self._local[key]
+
+        if self._shared is not None:
+            found, value = self._shared.get(self._shared_key(key))
+            if found:
+                self._set_local(key, value)
+                with self._lock:
+                    self._shared_hits += 1
+                return True, value
+
+        with self._lock:
+            self._misses += 1
+        return False, None
+
+    def _set_local(self, key, value):
+        with self._lock:
+            self._local[key] = (value, time.monotonic() + self.ttl)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_size:
+                self._local.popitem(last=False)
+
+    def set(self, key, value):
+        self._set_local(key, value)
+        if self._shared is not None:
+            self._shared.set(self._shared_key(key), value, self.ttl)
+
+    def get_or_load(self, key, loader, cache_if=None):
+        """
+        快取有就直接回傳，否則呼叫 loader() 取值
+        `cache_if(value)` 回傳 False 時不快取（例如尚未填完的資料）
+        """
+        found, value = self.get(key)
+        if found:
+            return value
+        value = loader()
+        if cache_if is None or cache_if(value):
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key):
+        """ 資料變更時清除快取 """
+        with self._lock:
+            self._local.pop(key, None)
+        if self._shared is not None:
+            self._shared.delete(self._shared_key(key))
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._shared_hits + self._misses
+            return {
+                "size": len(self._local),
+                "hits": self._hits,
+                "shared_hits": self._shared_hits,
+                "misses": self._misses,
+                "hit_rate": (self._hits + self._shared_hits) / lookups if lookups else 0.0,
+            }
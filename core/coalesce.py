@@ -0,0 +1,108 @@
+"""
+同一用戶連續傳來的多則短訊息合併成一輪對話
+
+LINE 用戶常常連續傳 3～5 則短訊息，若每則各自存檔、讀歷史、呼叫一次 GPT，
+不只浪費 GPT 額度，回覆也會交錯。合併規則：
+- 同一用戶的文字訊息先放在緩衝區，`quiet_period` 秒內沒有新訊息才送進事件管線
+- 從第一則起最多等 `max_wait` 秒（reply token 有時效），或累積到 `max_messages` 則就立即送出
+- 送出的是該用戶依序的事件列表，由 handle_messages 以最後一則的 reply token 一次回覆
+- 送不進事件管線時（佇列已滿），webhook 早已回應 200、LINE 不會重送，改交給 `on_reject`
+  （存檔並回覆忙碌訊息），不會默默丟掉
+
+每則訊息至少多等 `quiet_period` 秒才開始處理，所以預設關閉（MESSAGE_COALESCE=1 才啟用）
+
+只在背景事件迴圈（FastAPI 的 event loop）中使用；多個 worker 行程之間不會合併
+"""
+import asyncio
+import time
+from utils.logger import logger
+
+
+class _Buffer:
+    __slots__ = ("events", "first_at", "timer")
+
+    def __init__(self):
+        self.events = []
+        self.first_at = time.monotonic()
+        self.timer = None
+
+
+class MessageCoalescer:
+    """ 以用戶為單位的防抖（debounce）緩衝區 """
+
+    def __init__(self, submit, on_reject, quiet_period=1.0, max_wait=3.0, max_messages=5):
+        self._submit = submit  # async (key, events)
+        self._on_reject = on_reject  # async (key, events)，送不進管線時的備援處理
+        self.quiet_period = quiet_period
+        self.max_wait = max_wait
+        self.max_messages = max_messages
+        self._buffers = {}
+
+        self._messages = 0
+        self._turns = 0
+        self._turn_messages = 0
+        self._merged_turns = 0
+        self._rejected = 0
+        self._dropped = 0
+
+    async def add(self, key, event):
+        """ 放入緩衝區；累積到上限時立即送出 """
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = self._buffers[key] = _Buffer()
+        buffer.events.append(event)
+        self._messages += 1
+
+        if buffer.timer is not None:
+            buffer.timer.cancel()
+        if len(buffer.events) >= self.max_messages:
+            await self.flush(key)
+            return
+
+        # 安靜期從最後一則起算，但不超過第一則之後的 max_wait
+        delay = min(self.quiet_period, buffer.first_at + self.max_wait - time.monotonic())
+        buffer.timer = asyncio.get_running_loop().call_later(
+            max(0.0, delay), lambda: asyncio.ensure_future(self.flush(key))
+        )
+
+    async def flush(self, key):
+        """ 立即送出該用戶緩衝中的訊息（例如同一用戶的其他事件要先處理） """
+        buffer = self._buffers.pop(key, None)
+        if buffer is None:
+            return
+        if buffer.timer is not None:
+            buffer.timer.cancel()
+
+        self._turns += 1
+        self._turn_messages += len(buffer.events)
+        self._merged_turns += len(buffer.events) > 1
+        try:
+            await self._submit(key, buffer.events)
+            return
+        except Exception as e:
+            # webhook 已經回應 200，LINE 不會重送，改走備援處理
+            self._rejected += len(buffer.events)
+            logger.warning("合併的訊息無法送進事件管線，改為存檔並回覆忙碌訊息（%s，%d 則）：%s",
+                           key, len(buffer.events), e)
+        try:
+            await self._on_reject(key, buffer.events)
+        except Exception:
+            self._dropped += len(buffer.events)
+            logger.exception("合併訊息的備援處理失敗（%s，%d 則）", key, len(buffer.events))
+
+    async def stop(self):
+        """ 關閉前送出所有緩衝中的訊息 """
+        for key in list(self._buffers):
+            await self.flush(key)
+
+    def stats(self):
+        return {
+            "queued_messages": sum(len(buffer.events) for buffer in self._buffers.values()),
+            "queued_users": len(self._buffers),
+            "messages": self._messages,
+            "turns": self._turns,
+            "merged_turns": self._merged_turns,
+            "merge_ratio": self._turn_messages / self._turns if self._turns else 0.0,
+            "rejected": self._rejected,
+            "dropped": self._dropped,
+        }
@@ -7,13 +7,152 @@ load_dotenv()
 class Config:
     # OpenAI API Key
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "")  # 空字串表示官方 API；測試時指向 bench/fake_openai.py
     
     # LINE API
     CHANNEL_ACCESS_TOKEN = os.getenv("CHANNEL_ACCESS_TOKEN")
     CHANNEL_SECRET = os.getenv("CHANNEL_SECRET")
+    LINE_API_BASE_URL = os.getenv("LINE_API_BASE_URL", "https://api.line.me")  # 測試時指向 bench/mock_line.py
+    LINE_MAX_CONNECTIONS = int(os.getenv("LINE_MAX_CONNECTIONS", "100"))  # keep-alive 連線池大小
+    LINE_TIMEOUT = float(os.getenv("LINE_TIMEOUT", "10"))  # 每個請求的逾時秒數
+    LINE_RATE_LIMIT = float(os.getenv("LINE_RATE_LIMIT", "1000"))  # 每個行程 reply / push 每秒請求上限（LINE 限制整個頻道 2,000）
+    LINE_MULTICAST_RATE_LIMIT = float(os.getenv("LINE_MULTICAST_RATE_LIMIT", "100"))  # 每個行程 multicast 每秒請求上限（LINE 限制整個頻道 200）
+    LINE_MAX_RETRIES = int(os.getenv("LINE_MAX_RETRIES", "3"))  # 429 / 5xx / 連線錯誤的重試次數
 
     # MySQL 連線設定
     DB_HOST = os.getenv("DB_HOST", "localhost")
     DB_USER = os.getenv("DB_USER", "root")
     DB_PASSWORD = os.getenv("DB_PASSWORD", "")
     DB_NAME = os.getenv("DB_NAME", "lume_db")
+
+    # MySQL 連線池設定
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))  # 取得連線最多等待幾秒
+    DB_POOL_PING_INTERVAL = float(os.getenv("DB_POOL_PING_INTERVAL", "30"))  # 閒置超過幾秒，取用前先 ping
+    DB_POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))  # 閒置超過幾秒直接重建
+    DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "3600"))  # 連線最長存活秒數
+    DB_POOL_WARM = int(os.getenv("DB_POOL_WARM", "2"))  # 啟動後在背景預先建立的連線數（0 表示不預熱）
+
+    # Webhook 事件處理管線
+    EVENT_WORKERS = int(os.getenv("EVENT_WORKERS", "8"))  # 同時處理事件的 worker 數
+    EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "1000"))  # 佇列總容量
+    EVENT_ENQUEUE_TIMEOUT = float(os.getenv("EVENT_ENQUEUE_TIMEOUT", "2"))  # 佇列滿時最多等待秒數
+    PIPELINE_STATS_INTERVAL = float(os.getenv("PIPELINE_STATS_INTERVAL", "60"))  # 定期記錄佇列狀態，0 表示關閉
+
+    # webhook 重送去重
+    IDEMPOTENCY_RING_SIZE = int(os.getenv("IDEMPOTENCY_RING_SIZE", "100000"))  # 行程內最多記住幾個事件
+    IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "3600"))  # 事件記住幾秒（LINE 的重送在這之內）
+    IDEMPOTENCY_DB = os.getenv("IDEMPOTENCY_DB", "0") == "1"  # 多個 worker 共用 webhook_events 表去重
+
+    # 情緒分析微批次
+    EMOTION_BATCH_SIZE = int(os.getenv("EMOTION_BATCH_SIZE", "32"))  # 每批最多幾筆
+    EMOTION_BATCH_WAIT_MS = float(os.getenv("EMOTION_BATCH_WAIT_MS", "10"))  # 湊批次最多等待毫秒數
+    EMOTION_NUM_THREADS = int(os.getenv("EMOTION_NUM_THREADS", "0"))  # torch 推論執行緒數，0 表示使用預設
+    EMOTION_TIMEOUT = float(os.getenv("EMOTION_TIMEOUT", "10"))  # 等待結果最多幾秒
+
+    # 模型載入
+    MODEL_WARMUP = os.getenv("MODEL_WARMUP", "1") == "1"  # 啟動後在背景預熱模型
+    MODEL_SHARED_PRELOAD = os.getenv("MODEL_SHARED_PRELOAD", "0") == "1"  # fork 前載入模型，worker 共用權重
+    EMOTION_BACKEND = os.getenv("EMOTION_BACKEND", "pipeline")  # pipeline / quantized / onnx
+    EMOTION_ONNX_PATH = os.getenv("EMOTION_ONNX_PATH", "models/emotion.onnx")  # onnx 後端的模型檔，不存在時自動匯出
+
+    # 每位用戶的對話記憶
+    MEMORY_MAX_USERS = int(os.getenv("MEMORY_MAX_USERS", "10000"))  # 記憶中最多保留幾位用戶
+    MEMORY_TTL = float(os.getenv("MEMORY_TTL", "1800"))  # 幾秒沒有互動就從記憶淘汰
+    MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "1500"))  # 每位用戶的對話歷史 token 上限
+    MEMORY_LOAD_LIMIT = int(os.getenv("MEMORY_LOAD_LIMIT", "20"))  # 從資料庫讀回的對話筆數
+    MEMORY_SUMMARIZE = os.getenv("MEMORY_SUMMARIZE", "0") == "1"  # 滑出視窗的舊對話是否整理成摘要
+    MEMORY_REVALIDATE = os.getenv("MEMORY_REVALIDATE", "1") == "1"  # 使用記憶前確認資料庫沒有其他 worker 寫入的新對話
+    MEMORY_REVALIDATE_INTERVAL = float(os.getenv("MEMORY_REVALIDATE_INTERVAL", "1"))  # 同一用戶幾秒內不重複確認（一輪對話只查一次）
+
+    # Prompt 大小
+    PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))  # 整個 prompt 的 token 上限（模板 + 用戶資訊 + 歷史 + 輸入）
+    PROMPT_INPUT_MAX_TOKENS = int(os.getenv("PROMPT_INPUT_MAX_TOKENS", "1000"))  # 用戶單則輸入最多幾個 token，超過就截斷
+    PROMPT_STATS_EVERY = int(os.getenv("PROMPT_STATS_EVERY", "100"))  # 每幾次 prompt 寫一次 token 統計，0 表示不寫
+
+    # GPT 呼叫閘道
+    GPT_MODEL = os.getenv("GPT_MODEL", "gpt-4")
+    GPT_MAX_CONCURRENCY = int(os.getenv("GPT_MAX_CONCURRENCY", "32"))  # 每個行程同時進行的 GPT 呼叫上限
+    GPT_PER_USER_CONCURRENCY = int(os.getenv("GPT_PER_USER_CONCURRENCY", "1"))  # 每位用戶同時進行的 GPT 呼叫上限
+    GPT_DEADLINE = float(os.getenv("GPT_DEADLINE", "60"))  # 每次呼叫的截止秒數（含排隊與重試）
+    GPT_MAX_RETRIES = int(os.getenv("GPT_MAX_RETRIES", "3"))  # 429 / 5xx / 逾時的重試次數
+    GPT_BREAKER_FAILURES = int(os.getenv("GPT_BREAKER_FAILURES", "5"))  # 連續失敗幾次打開斷路器
+    GPT_BREAKER_COOLDOWN = float(os.getenv("GPT_BREAKER_COOLDOWN", "30"))  # 斷路器打開幾秒後試探
+    GPT_FALLBACK_REPLY = os.getenv(
+        "GPT_FALLBACK_REPLY", "抱歉，我現在有點忙不過來，請稍後再跟我說一次好嗎？🙏"
+    )  # GPT 無法使用時的預設回覆
+    GPT_INTERRUPTED_REPLY = os.getenv(
+        "GPT_INTERRUPTED_REPLY", "（抱歉，回覆到一半中斷了，請再跟我說一次 🙏）"
+    )  # 串流回覆中途失敗時，接在已送出的部分後面
+
+    # 常見問題的回覆快取
+    RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "0") == "1"  # 相似的短訊息直接使用快取的 GPT 回覆
+    RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.92"))  # cosine 相似度門檻
+    RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))  # 每筆回覆保留秒數
+    RESPONSE_CACHE_MAX_SIZE = int(os.getenv("RESPONSE_CACHE_MAX_SIZE", "5000"))  # 最多快取幾筆
+    RESPONSE_CACHE_MAX_CHARS = int(os.getenv("RESPONSE_CACHE_MAX_CHARS", "30"))  # 超過幾個字的訊息不快取
+    RESPONSE_CACHE_DISABLED_INTENTS = [
+        intent.strip() for intent in os.getenv("RESPONSE_CACHE_DISABLED_INTENTS", "crisis").split(",") if intent.strip()
+    ]  # 不使用快取的意圖（crisis / sleep / tired / stress / sad / greeting / other）
+    RESPONSE_CACHE_INTENTS_FILE = os.getenv("RESPONSE_CACHE_INTENTS_FILE", "")  # 停用意圖清單檔（逗號或換行分隔），修改後不必重啟即生效
+    RESPONSE_CACHE_RELOAD_INTERVAL = float(os.getenv("RESPONSE_CACHE_RELOAD_INTERVAL", "5"))  # 每隔幾秒檢查清單檔是否修改
+
+    # 串流回覆
+    STREAM_REPLY = os.getenv("STREAM_REPLY", "1") == "1"  # 邊生成邊回覆
+    REPLY_LATENCY_BUDGET = float(os.getenv("REPLY_LATENCY_BUDGET", "20"))  # 超過幾秒才有第一段就改用 push
+    STREAM_FIRST_MIN_CHARS = int(os.getenv("STREAM_FIRST_MIN_CHARS", "15"))  # 第一則訊息至少幾個字
+    STREAM_SEGMENT_MIN_CHARS = int(os.getenv("STREAM_SEGMENT_MIN_CHARS", "80"))  # 之後每則 push 訊息至少幾個字
+
+    # users / user_profile 讀取快取
+    CACHE_TTL = float(os.getenv("CACHE_TTL", "300"))  # 快取秒數
+    CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "10000"))  # 每個行程最多快取幾位用戶
+    CACHE_SHARED_BACKEND = os.getenv("CACHE_SHARED_BACKEND", "")  # 多 worker 共用的快取後端，空字串表示不使用
+
+    # 基本資料填寫進度
+    SESSION_BACKEND = os.getenv("SESSION_BACKEND", "mysql")  # memory / mysql / shared
+    SESSION_TTL = float(os.getenv("SESSION_TTL", "86400"))  # 幾秒沒有繼續填寫就重新開始
+
+    # 聊天記錄背景批次寫入
+    WRITE_BEHIND = os.getenv("WRITE_BEHIND", "1") == "1"  # 關閉時每則訊息直接寫入資料庫
+    WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "100"))  # 每次 INSERT 最多幾筆
+    WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.5"))  # 最多累積幾秒就寫入
+    WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))  # 佇列上限
+    WRITE_BEHIND_JOURNAL_DIR = os.getenv("WRITE_BEHIND_JOURNAL_DIR", "var/journal")  # 本機日誌目錄
+    WRITE_BEHIND_FSYNC = os.getenv("WRITE_BEHIND_FSYNC", "0") == "1"  # 每筆日誌都 fsync（較慢，但斷電也不遺失）
+    WRITE_BEHIND_STOP_TIMEOUT = float(os.getenv("WRITE_BEHIND_STOP_TIMEOUT", "30"))  # 關閉時最多等幾秒寫完（其餘留在日誌）
+
+    # 背景情緒標記
+    EMOTION_TAGGER = os.getenv("EMOTION_TAGGER", "1") == "1"  # 在 app 內執行背景情緒標記
+    EMOTION_TAGGER_BATCH_SIZE = int(os.getenv("EMOTION_TAGGER_BATCH_SIZE", "64"))  # 每批標記筆數
+    EMOTION_TAGGER_INTERVAL = float(os.getenv("EMOTION_TAGGER_INTERVAL", "2"))  # 沒有待處理訊息時的輪詢秒數
+    EMOTION_TAGGER_LEASE = int(os.getenv("EMOTION_TAGGER_LEASE", "300"))  # 認領的訊息幾秒內沒有標完就讓其他 worker 接手
+    EMOTION_TAGGER_MAX_ATTEMPTS = int(os.getenv("EMOTION_TAGGER_MAX_ATTEMPTS", "3"))  # 分析失敗幾次後略過該訊息
+
+    # 危機訊號偵測（命中詞庫時跳過其他處理，立即回覆求助資源）
+    CRISIS_DETECTION = os.getenv("CRISIS_DETECTION", "1") == "1"
+    CRISIS_LEXICON = os.getenv("CRISIS_LEXICON", "")  # 詞庫檔案路徑，空字串使用 core/crisis_lexicon.txt
+
+    # 連續訊息合併（同一用戶短時間內的多則訊息合成一輪對話）
+    MESSAGE_COALESCE = os.getenv("MESSAGE_COALESCE", "0") == "1"  # 每則訊息至少多等安靜期才處理，預設關閉
+    MESSAGE_COALESCE_QUIET = float(os.getenv("MESSAGE_COALESCE_QUIET", "1.0"))  # 幾秒內沒有新訊息才回覆
+    MESSAGE_COALESCE_MAX_WAIT = float(os.getenv("MESSAGE_COALESCE_MAX_WAIT", "3.0"))  # 從第一則起最多等待秒數
+    MESSAGE_COALESCE_MAX_MESSAGES = int(os.getenv("MESSAGE_COALESCE_MAX_MESSAGES", "5"))  # 累積幾則就立即回覆
+
+    # 聊天記錄封存（python -m core.archive，排程執行）
+    ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "var/archive")  # 封存檔根目錄
+    ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))  # 超過幾天的訊息搬出資料庫
+    ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))  # 每批封存 / 刪除筆數
+    ARCHIVE_SEGMENT_MAX_MB = int(os.getenv("ARCHIVE_SEGMENT_MAX_MB", "64"))  # 區段檔超過幾 MB 就換新檔
+    ARCHIVE_ZSTD_LEVEL = int(os.getenv("ARCHIVE_ZSTD_LEVEL", "10"))  # zstd 壓縮等級
+
+    # 健康檢查
+    HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "2"))  # readiness 檢查資料庫最多等待秒數
+
+    # 效能觀測
+    METRICS_ENDPOINT = os.getenv("METRICS_ENDPOINT", "1") == "1"  # 掛載 Prometheus 格式的 /metrics
+    PROFILE_SLOW_EVENTS = os.getenv("PROFILE_SLOW_EVENTS", "0") == "1"  # 取樣記錄處理過慢的事件
+    PROFILE_SLOW_THRESHOLD = float(os.getenv("PROFILE_SLOW_THRESHOLD", "2"))  # 超過幾秒算慢事件
+    PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.01"))  # 取樣間隔秒數
+
+    # 壓力測試
+    BENCH_ENDPOINTS = os.getenv("BENCH_ENDPOINTS", "0") == "1"  # 掛載 /_bench/stats 與 /_bench/reset（勿在正式環境開啟）
@@ -1,22 +1,37 @@
-from services.line import send_message
-from core.database import check_user_consent, set_user_consent
+"""
+隱私政策同意流程
+
+用法（隱私政策更新時，重新發送給所有尚未同意的用戶）：
+    python -m core.consent --resend
+"""
+import argparse
+from services.line import send_message, multicast_message
+from core.database import check_user_consent, set_user_consent, fetch_pending_consent_user_ids
 
 def check_consent_and_respond(user_id, user_message):
     """
     檢查使用者是否已同意隱私政策，未同意則要求回覆「同意」
+    回傳要回覆的訊息列表（隱私條款與提示合併在同一個 reply，不另外 push），已同意時回傳 None
     """
     if not check_user_consent(user_id):  # 查詢 MySQL
         if user_message == "同意":
             set_user_consent(user_id)  # 記錄使用者已同意
-            return "感謝你的同意！你現在可以與我聊天了 😊"
+            return ["感謝你的同意！你現在可以與我聊天了 😊"]
         else:
-            send_privacy_message(user_id)
-            return "請先回覆【同意】，才能開始使用本服務。"
+            return [privacy_text(), "請先回覆【同意】，才能開始使用本服務。"]
     return None
 
 def send_privacy_message(user_id):
     """ 發送隱私條款 """
-    privacy_text = (
+    send_message(user_id, privacy_text())
+
+def send_privacy_messages(user_ids):
+    """ 以 multicast 發送隱私條款給多位用戶（每次最多 500 人） """
+    multicast_message(user_ids, privacy_text())
+
+def privacy_text():
+    """ 隱私條款內容 """
+    return (
         "🌸  歡迎使用 Lume（路梅）  🌸\n\n"
         "Lume 是您的貼心陪伴者，隨時為您提供支持與建議。\n\n"
         
@@ -45,4 +60,16 @@ def send_privacy_message(user_id):
         "✅  請輸入「同意」以繼續使用 Lume 的服務。 \n"
         "❓ 若有任何疑問，隨時聯繫我們，我們很樂意協助您！\n"
     )
-    send_message(user_id, privacy_text)
+
+def main():
+    parser = argparse.ArgumentParser(description="隱私政策同意流程")
+    parser.add_argument("--resend", action="store_true", help="重新發送隱私條款給所有尚未同意的用戶")
+    args = parser.parse_args()
+
+    if args.resend:
+        user_ids = fetch_pending_consent_user_ids()
+        send_privacy_messages(user_ids)
+        print(f"🎉 已發送隱私條款給 {len(user_ids)} 位用戶")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+危機訊號偵測：每則訊息在存檔、模型推論、呼叫 GPT 之前先比對危機詞庫，命中時立即回覆求助資源
+
+- 詞庫在 core/crisis_lexicon.txt（分類 + 詞，另有排除詞），啟動時建成一個 Aho–Corasick 自動機，
+  不論詞庫多大，每則訊息都只需從頭到尾掃過一次（每個字一次 dict 查詢）
+- 比對前正規化：全形轉半形、小寫、簡體轉繁體、移除空白與標點（「想 死」「想、死」「想死」都比得到）
+- 英文詞（全為 ASCII）不走上述正規化，改以原文的英文單字逐字比對（移除空白後 "ok ms" 會變成 "okms"，
+  短的英文詞很容易誤判）
+- 命中的危機詞完全落在排除詞範圍內時不算（「想死你了」）；分類以 `-` 開頭的是排除詞
+
+效能比較（詞庫大小與每則訊息耗時）：
+    python -m bench.crisis_matcher
+"""
+import os
+import re
+import threading
+import unicodedata
+from collections import deque
+from utils.logger import logger
+
+DEFAULT_LEXICON = os.path.join(os.path.dirname(__file__), "crisis_lexicon.txt")
+EXCLUDE = "-"
+
+# 詞庫用到的簡體字 → 繁體（不依賴 OpenCC；詞庫新增的字若有簡體寫法，在這裡補上對照）
+_SIMPLIFIED = "个伤划写寻尴击断书会楼残杀没热烧结义卧着药轨较轻农这遗开离"
+_TRADITIONAL = "個傷劃寫尋尷擊斷書會樓殘殺沒熱燒結義臥著藥軌較輕農這遺開離"
+_TO_TRADITIONAL = str.maketrans(_SIMPLIFIED, _TRADITIONAL)
+# 正規化時移除的字元：空白、標點、符號（含 emoji）、控制字元
+_NOISE_CATEGORIES = ("Z", "P", "S", "C")
+# 英文詞以單字比對
+_ASCII_WORD = re.compile(r"[a-z0-9]+")
+
+CRISIS_REPLY = (
+    "聽起來你現在真的很辛苦，謝謝你願意說出來。你不需要一個人面對這些 💛\n\n"
+    "如果你有傷害自己的念頭，請現在就聯絡可以陪你的人：\n"
+    " - 安心專線：1925（24 小時，免付費）\n"
+    " - 生命線：1995\n"
+    " - 張老師專線：1980\n"
+    " - 有立即危險時請撥打 119 或 110\n\n"
+    "我會一直在這裡陪你聊，你願意告訴我現在發生了什麼事嗎？"
+)
+
+
+def normalize(text):
+    """ 全形轉半形、小寫、簡體轉繁體，移除空白與標點符號 """
+    text = unicodedata.normalize("NFKC", text).lower().translate(_TO_TRADITIONAL)
+    return "".join(ch for ch in text if not unicodedata.category(ch).startswith(_NOISE_CATEGORIES))
+
+
+def ascii_words(text):
+    """ 全形轉半形、小寫後的英文單字與數字（不移除空白，保留單字邊界） """
+    return _ASCII_WORD.findall(unicodedata.normalize("NFKC", text).lower())
+
+
+def is_exclusion(category):
+    return category.startswith(EXCLUDE)
+
+
+def load_lexicon(path=DEFAULT_LEXICON):
+    """ 讀取詞庫，回傳 [(分類, 詞)] """
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            category, sep, phrase = line.partition("\t")
+            if not sep or not phrase.strip():
+                logger.warning("危機詞庫第 %d 行格式錯誤，略過：%r", line_no, line)
+                continue
+            entries.append((category.strip(), phrase.strip()))
+    return entries
+
+
+class AhoCorasick:
+    """ 多字串比對自動機（建好之後唯讀，可跨執行緒共用） """
+
+    def __init__(self, patterns):
+        """ `patterns`：[(詞, 附帶資料)]，詞應已正規化 """
+        self._goto = [{}]
+        self._fail = [0]
+        self._outputs = [()]  # 節點 -> ((詞長, 附帶資料), ...)，含沿 fail 鏈的輸出
+
+        for pattern, value in patterns:
+            if not pattern:
+                continue
+            node = 0
+            for ch in pattern:
+                next_node = self._goto[node].get(ch)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][ch] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._outputs.append(())
+                node = next_node
+            self._outputs[node] += ((len(pattern), value),)
+
+        # 以 BFS 建立 fail 連結，並把 fail 節點的輸出併入（比對時不必再走 fail 鏈收集輸出）
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                self._outputs[child] += self._outputs[self._fail[child]]
+
+    def __len__(self):
+        return len(self._goto)
+
+    def iter_matches(self, text):
+        """ 產生 (起點, 終點, 附帶資料)，終點不含 """
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        node = 0
+        for index, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for length, value in outputs[node]:
+                yield index + 1 - length, index + 1, value
+
+
+class CrisisMatch:
+    """ 一次偵測的結果 """
+
+    __slots__ = ("category", "phrase")
+
+    def __init__(self, category, phrase):
+        self.category = category
+        self.phrase = phrase
+
+    def __repr__(self):
+        return f"CrisisMatch({self.category!r}, {self.phrase!r})"
+
+
+class CrisisDetector:
+    """ 以詞庫建好的自動機偵測危機訊號，並統計各分類的命中次數 """
+
+    def __init__(self, entries):
+        patterns = []
+        self._word_phrases = {}  # (單字, ...) -> [(分類, 詞)]
+        for category, phrase in entries:
+            if phrase.isascii():
+                words = tuple(ascii_words(phrase))
+                if words:
+                    self._word_phrases.setdefault(words, []).append((category, phrase))
+                continue
+            normalized = normalize(phrase)
+            if normalized:
+                patterns.append((normalized, (category, phrase)))
+        self._automaton = AhoCorasick(patterns)
+        self._word_lengths = sorted({len(words) for words in self._word_phrases})
+        self.size = len(patterns) + sum(map(len, self._word_phrases.values()))
+        self._lock = threading.Lock()
+        self._checks = 0
+        self._hits = {}
+
+    @classmethod
+    def from_file(cls, path=None):
+        return cls(load_lexicon(path or DEFAULT_LEXICON))
+
+    def match(self, text, count=True):
+        """
+        回傳第一個不在排除詞範圍內的危機詞（CrisisMatch），沒有時回傳 None
+        `count=False` 時不計入統計（同一則訊息在別處已經或將會再檢查一次）
+        """
+        result = self._first_match(self._automaton.iter_matches(normalize(text)))
+        if result is None and self._word_phrases:
+            result = self._first_match(self._iter_word_matches(text))
+
+        if not count:
+            return result
+        with self._lock:
+            self._checks += 1
+            if result is not None:
+                self._hits[result.category] = self._hits.get(result.category, 0) + 1
+        return result
+
+    def _iter_word_matches(self, text):
+        """ 英文詞的比對：產生 (起點, 終點, (分類, 詞))，位置以單字計 """
+        words = ascii_words(text)
+        for start in range(len(words)):
+            for length in self._word_lengths:
+                for value in self._word_phrases.get(tuple(words[start:start + length]), ()):
+                    yield start, start + length, value
+
+    @staticmethod
+    def _first_match(matches):
+        """ 第一個不在排除詞範圍內的危機詞 """
+        matches = list(matches)
+        excluded = [(start, end) for start, end, (category, _) in matches if is_exclusion(category)]
+        for start, end, (category, phrase) in matches:
+            if is_exclusion(category):
+                continue
+            if any(ex_start <= start and end <= ex_end for ex_start, ex_end in excluded):
+                continue
+            return CrisisMatch(category, phrase)
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "lexicon_size": self.size,
+                "automaton_nodes": len(self._automaton),
+                "checks": self._checks,
+                "hits": sum(self._hits.values()),
+                "hits_by_category": dict(self._hits),
+            }
@@ -1,210 +1,358 @@
+import threading
+import time
 import mysql.connector
 from core.config import Config
+from core.db_pool import ConnectionPool, PoolTimeoutError
+from core.cache import ReadThroughCache, get_shared_backend
+from core.write_behind import MessageWriter
 from datetime import datetime
-from core.emotion import analyze_emotion  # 更新導入
+from utils.logger import logger
+
+# 所有資料庫函式共用的連線池（連線在第一次使用時才建立）
+pool = ConnectionPool(
+    size=Config.DB_POOL_SIZE,
+    timeout=Config.DB_POOL_TIMEOUT,
+    ping_interval=Config.DB_POOL_PING_INTERVAL,
+    idle_timeout=Config.DB_POOL_IDLE_TIMEOUT,
+    max_lifetime=Config.DB_POOL_MAX_LIFETIME,
+    host=Config.DB_HOST,
+    user=Config.DB_USER,
+    password=Config.DB_PASSWORD,
+    database=Config.DB_NAME
+)
+
+# users 表的讀取快取：user_id -> 是否已同意隱私政策（有快取代表用戶已存在）
+user_cache = ReadThroughCache(
+    "users", max_size=Config.CACHE_MAX_SIZE, ttl=Config.CACHE_TTL, shared=get_shared_backend()
+)
+
+# user_profile 表的讀取快取：只快取已填完的資料，填寫中的資料每次都讀資料庫
+profile_cache = ReadThroughCache(
+    "user_profile", max_size=Config.CACHE_MAX_SIZE, ttl=Config.CACHE_TTL, shared=get_shared_backend()
+)
+
+_pool_warm = threading.Event()
+
+def warm_pool_in_background(count, max_delay=30):
+    """
+    在背景建立連線池的連線；資料庫暫時連不上時以指數退避重試，不阻擋服務啟動
+    成功後 is_pool_warm() 回傳 True（readiness 檢查使用）
+    """
+    def run():
+        delay = 0.5
+        while True:
+            try:
+                pool.warm(count)
+                _pool_warm.set()
+                return
+            except Exception as e:
+                logger.warning("MySQL 連線池預熱失敗，%.1f 秒後重試：%s", delay, e)
+                time.sleep(delay)
+                delay = min(max_delay, delay * 2)
+
+    threading.Thread(target=run, name="db-pool-warmup", daemon=True).start()
+
+def is_pool_warm():
+    return _pool_warm.is_set()
 
 def get_db_connection():
-    """ 取得 MySQL 連線 """
-    return mysql.connector.connect(
-        host=Config.DB_HOST,
-        user=Config.DB_USER,
-        password=Config.DB_PASSWORD,
-        database=Config.DB_NAME
-    )
+    """ 從連線池取得 MySQL 連線，用完呼叫 close() 歸還 """
+    return pool.acquire()
 
-def init_db():
-    """ 初始化 users 表 """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id VARCHAR(50) PRIMARY KEY,
-            consent TINYINT(1) DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
+def get_pool_stats():
+    """ 取得連線池監控數據（使用中連線數、等待時間、每秒新建連線數） """
+    return pool.stats()
+
+def get_cache_stats():
+    """ 取得讀取快取的命中率 """
+    return {"users": user_cache.stats(), "user_profile": profile_cache.stats()}
+
+def legacy_table_name(user_id):
+    """ 舊版每位用戶專屬的聊天歷史表名（MySQL 表名不能有 "-"） """
+    return f"messages_{user_id.replace('-', '_')}"
 
 def create_user_db(user_id):
     """ 
-    1. 檢查用戶是否已經存在於 users 表
-    2. 如果是新用戶，則建立一個專屬的聊天歷史表
+    檢查用戶是否已經存在於 users 表，新用戶則新增一筆
+    （聊天記錄統一存在 messages 表，不再為每位用戶建表）
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # 檢查 users 表是否存在
-    cursor.execute("SELECT COUNT(*) FROM users WHERE user_id = %s", (user_id,))
-    result = cursor.fetchone()
-
-    if result[0] == 0:
-        # 新增用戶至 users 表
-        cursor.execute("INSERT INTO users (user_id) VALUES (%s)", (user_id,))
-        conn.commit()
+    # 已知的用戶不必再查資料庫
+    found, _ = user_cache.get(user_id)
+    if found:
+        return
 
-        # 為該用戶建立專屬的聊天歷史表
-        table_name = f"messages_{user_id.replace('-', '_')}"  # MySQL 表名不能有 "-"
-        create_table_query = f"""
-            CREATE TABLE IF NOT EXISTS {table_name} (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                sender VARCHAR(10),  /* 'user' or 'bot' */
-                message TEXT,
-                emotion VARCHAR(50) DEFAULT NULL,  /* 新增情緒欄位 */
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """
-
-        cursor.execute(create_table_query)
-        conn.commit()
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+
+        # 檢查用戶是否存在（順便取得同意狀態放進快取）
+        cursor.execute("SELECT consent FROM users WHERE user_id = %s", (user_id,))
+        result = cursor.fetchone()
+
+        if result is None:
+            # 新增用戶至 users 表
+            cursor.execute("INSERT IGNORE INTO users (user_id) VALUES (%s)", (user_id,))
+            conn.commit()
+            consent = False
+        else:
+            consent = result[0] == 1
+    finally:
+        conn.close()
 
-    conn.close()
+    user_cache.set(user_id, consent)
 
 def check_user_consent(user_id):
     """ 檢查用戶是否已同意隱私政策 """
+    # 只相信快取中「已同意」的結果；未同意的狀態可能剛被其他 worker 更新，要查資料庫確認
+    found, consent = user_cache.get(user_id)
+    if found and consent:
+        return True
+
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT consent FROM users WHERE user_id = %s", (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None and result[0] == 1
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT consent FROM users WHERE user_id = %s", (user_id,))
+        result = cursor.fetchone()
+    finally:
+        conn.close()
+
+    if result is None:
+        return False
+    consent = result[0] == 1
+    user_cache.set(user_id, consent)
+    return consent
 
 def set_user_consent(user_id):
     """ 設定使用者已同意隱私政策 """
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO users (user_id, consent) 
-        VALUES (%s, 1) 
-        ON DUPLICATE KEY UPDATE consent=1
-    ''', (user_id,))
-    conn.commit()
-    conn.close()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO users (user_id, consent) 
+            VALUES (%s, 1) 
+            ON DUPLICATE KEY UPDATE consent=1
+        ''', (user_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+    user_cache.invalidate(user_id)
+
+def fetch_pending_consent_user_ids():
+    """ 取得尚未同意隱私政策的用戶 """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT user_id FROM users WHERE consent = 0")
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
 
 def save_message(user_id, sender, message):
     """
-    儲存聊天記錄到 `messages_<user_id>` 表
+    儲存聊天記錄到 `messages` 表
     """
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    # 轉換表名（確保 `user_id` 無非法字符）
-    table_name = f"messages_{user_id.replace('-', '_')}"
-
     try:
         # 插入對話
-        insert_query = f"INSERT INTO {table_name} (sender, message) VALUES (%s, %s)"
-        cursor.execute(insert_query, (sender, message))
+        insert_query = "INSERT INTO messages (user_id, sender, message) VALUES (%s, %s, %s)"
+        cursor.execute(insert_query, (user_id, sender, message))
         conn.commit()
 
-        # Debug 訊息
-        print(f"✅ 成功插入訊息到 {table_name}：{sender} - {message}")
+        # 不記錄訊息內容（每則訊息都會經過，且內容屬於個資）
+        logger.debug("成功插入訊息到 messages：%s %s", user_id, sender)
 
     except mysql.connector.Error as e:
-        print(f"❌ MySQL 插入錯誤：{e}")
+        logger.error("MySQL 插入錯誤：%s", e)
 
     finally:
         conn.close()
 
-def fetch_chat_history(user_id, limit=10):
+def fetch_chat_rows(user_id, limit=10):
     """
-    取得最近的聊天記錄，讓 GPT-4 可以記住對話上下文
+    取得最近的聊天記錄，回傳 [(sender, message)]，最舊的在前
     """
     conn = get_db_connection()
-    cursor = conn.cursor()
+    try:
+        cursor = conn.cursor()
+
+        # 取得最近的對話記錄
+        cursor.execute("""
+            SELECT sender, message, timestamp FROM messages
+            WHERE user_id = %s
+            ORDER BY timestamp DESC, id DESC
+            LIMIT %s
+        """, (user_id, limit))
+        messages = cursor.fetchall()
+
+        # 搬移期間，尚未搬完的舊表記錄也要一起讀
+        watermark = _legacy_watermark(cursor, user_id)
+        if watermark is not None:
+            cursor.execute(f"""
+                SELECT sender, message, timestamp FROM {legacy_table_name(user_id)}
+                WHERE id > %s
+                ORDER BY timestamp DESC, id DESC
+                LIMIT %s
+            """, (watermark, limit))
+            messages = sorted(messages + cursor.fetchall(), key=lambda row: row[2], reverse=True)[:limit]
+    finally:
+        conn.close()
 
-    table_name = f"messages_{user_id.replace('-', '_')}"
+    # 反轉順序，讓最舊的記錄在前
+    return [(sender, message) for sender, message, _ in reversed(messages)]
 
-    # 取得最近的對話記錄
-    query = f"""
-        SELECT sender, message FROM {table_name} 
-        ORDER BY timestamp DESC 
-        LIMIT %s
+def latest_message_version(user_id, since=None):
+    """
+    對話記憶用來確認是否有新對話，回傳 (該用戶最新一筆訊息的 id, id 大於 `since` 的訊息筆數)
+    沒有給 `since` 時只查最新的 id（沒有訊息時為 0），筆數為 0
+    主鍵 (user_id, id) 讓查詢只掃描新寫入的幾筆
     """
-    cursor.execute(query, (limit,))
-    messages = cursor.fetchall()
-    conn.close()
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        if since is None:
+            cursor.execute("SELECT MAX(id) FROM messages WHERE user_id = %s", (user_id,))
+            return cursor.fetchone()[0] or 0, 0
+        cursor.execute("SELECT MAX(id), COUNT(*) FROM messages WHERE user_id = %s AND id > %s", (user_id, since))
+        latest, added = cursor.fetchone()
+        return latest or since, added
+    finally:
+        conn.close()
 
+def fetch_chat_history(user_id, limit=10):
+    """
+    取得最近的聊天記錄，讓 GPT-4 可以記住對話上下文
+    """
     # 格式化對話內容
     history = []
-    for sender, message in reversed(messages):  # 反轉順序，讓最舊的記錄在前
+    for sender, message in fetch_chat_rows(user_id, limit):
         role = "User" if sender == "user" else "Lume"
         history.append(f"{role}: {message}")
 
     return "\n".join(history)  # 返回對話歷史作為 GPT-4 記憶
 
+# 搬移是否還沒完成；舊表都已登記並搬完後就不必再查詢搬移進度
+_legacy_pending = True
+# 上次檢查時是否有搬到一半的舊表（每 LEGACY_RECHECK_SECONDS 秒重新檢查，搬移開始後才會讀舊表）
+_legacy_active = False
+_legacy_checked_at = 0.0
+LEGACY_RECHECK_SECONDS = 60
+
+def _legacy_watermark(cursor, user_id):
+    """
+    回傳該用戶舊表中「已搬移到 messages 的最大 id」，
+    舊表不存在或已搬完則回傳 None
+    """
+    global _legacy_pending, _legacy_active, _legacy_checked_at
+
+    if not _legacy_pending:
+        return None
+
+    now = time.monotonic()
+    if now - _legacy_checked_at > LEGACY_RECHECK_SECONDS:
+        _legacy_checked_at = now
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(done = 0), 0) FROM message_migration")
+        registered, unfinished = cursor.fetchone()
+        _legacy_active = unfinished > 0
+        if registered and not unfinished:
+            # 舊表在同一個交易中全部登記，已登記且都搬完才算完成；還沒登記（表是空的）時繼續定期檢查
+            _legacy_pending = False
+    if not _legacy_active:
+        return None
+
+    cursor.execute(
+        "SELECT last_legacy_id, done FROM message_migration WHERE user_id = %s", (user_id,)
+    )
+    result = cursor.fetchone()
+    if result is None or result[1] == 1:
+        return None
+    return result[0]
+
 def set_user_profile(user_id, name=None, birth_date=None, interests=None, mood=None):
     """
     更新或新增用戶的基本資料，手動提供正確的 `created_at`
     """
     conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # 確保 user_profile 表存在
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_profile (
-            user_id VARCHAR(50) PRIMARY KEY,
-            name VARCHAR(100) DEFAULT NULL,
-            birth_date DATE DEFAULT NULL,
-            interests TEXT DEFAULT NULL,
-            mood VARCHAR(50) DEFAULT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
+    try:
+        cursor = conn.cursor()
+
+        # 檢查用戶是否已經存在（user_profile 表由 core/migrations.py 建立）
+        cursor.execute("SELECT COUNT(*) FROM user_profile WHERE user_id = %s", (user_id,))
+        result = cursor.fetchone()
+
+        current_time = datetime.now()
+
+        if result[0] == 0:
+            # 新增用戶，手動傳遞 `created_at`
+            cursor.execute("""
+                INSERT INTO user_profile (user_id, name, birth_date, interests, mood, created_at) 
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, (user_id, name, birth_date, interests, mood, current_time))
+        else:
+            # 更新用戶資料
+            update_fields = []
+            update_values = []
+
+            if name is not None:
+                update_fields.append("name = %s")
+                update_values.append(name)
+            if birth_date is not None:
+                update_fields.append("birth_date = %s")
+                update_values.append(birth_date)
+            if interests is not None:
+                update_fields.append("interests = %s")
+                update_values.append(interests)
+            if mood is not None:
+                update_fields.append("mood = %s")
+                update_values.append(mood)
+
+            if update_fields:
+                update_query = f"UPDATE user_profile SET {', '.join(update_fields)} WHERE user_id = %s"
+                update_values.append(user_id)
+                cursor.execute(update_query, update_values)
 
-    # 檢查用戶是否已經存在
-    cursor.execute("SELECT COUNT(*) FROM user_profile WHERE user_id = %s", (user_id,))
-    result = cursor.fetchone()
+        conn.commit()
+    finally:
+        conn.close()
 
-    current_time = datetime.now()
+    profile_cache.invalidate(user_id)
 
-    if result[0] == 0:
-        # 新增用戶，手動傳遞 `created_at`
-        cursor.execute("""
-            INSERT INTO user_profile (user_id, name, birth_date, interests, mood, created_at) 
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """, (user_id, name, birth_date, interests, mood, current_time))
-    else:
-        # 更新用戶資料
-        update_fields = []
-        update_values = []
-
-        if name is not None:
-            update_fields.append("name = %s")
-            update_values.append(name)
-        if birth_date is not None:
-            update_fields.append("birth_date = %s")
-            update_values.append(birth_date)
-        if interests is not None:
-            update_fields.append("interests = %s")
-            update_values.append(interests)
-        if mood is not None:
-            update_fields.append("mood = %s")
-            update_values.append(mood)
-
-        if update_fields:
-            update_query = f"UPDATE user_profile SET {', '.join(update_fields)} WHERE user_id = %s"
-            update_values.append(user_id)
-            cursor.execute(update_query, update_values)
-
-    conn.commit()
-    conn.close()
 
 
+def is_profile_complete(user_profile):
+    """ 基本資料是否已全部填寫 """
+    return bool(
+        user_profile
+        and user_profile.get("name")
+        and user_profile.get("birth_date")
+        and user_profile.get("interests")
+        and user_profile.get("mood")
+    )
 
 def get_user_profile(user_id):
     """
-    取得用戶的基本資料
+    取得用戶的基本資料（已填完的資料會被快取）
+    """
+    return profile_cache.get_or_load(
+        user_id, lambda: _load_user_profile(user_id), cache_if=is_profile_complete
+    )
+
+def _load_user_profile(user_id):
+    """
+    從資料庫讀取用戶的基本資料
     """
     conn = get_db_connection()
-    cursor = conn.cursor()
+    try:
+        cursor = conn.cursor()
 
-    cursor.execute("""
-        SELECT name, birth_date, interests, mood FROM user_profile WHERE user_id = %s
-    """, (user_id,))
-    result = cursor.fetchone()
-    
-    conn.close()
+        cursor.execute("""
+            SELECT name, birth_date, interests, mood FROM user_profile WHERE user_id = %s
+        """, (user_id,))
+        result = cursor.fetchone()
+    finally:
+        conn.close()
 
     if result:
         return {
@@ -215,30 +363,93 @@ def get_user_profile(user_id):
         }
     return None
 
-def save_message_with_emotion(user_id, sender, message):
+def insert_messages(rows):
     """
-    儲存聊天記錄到 `messages_<user_id>` 表，並記錄情緒
+    以一個多筆 INSERT 寫入聊天記錄：[(user_id, sender, message, emotion, timestamp)]
     """
     conn = get_db_connection()
-    cursor = conn.cursor()
+    try:
+        cursor = conn.cursor()
+        placeholders = ", ".join(["(%s, %s, %s, %s, %s)"] * len(rows))
+        values = [value for row in rows for value in row]
+        cursor.execute(
+            f"INSERT INTO messages (user_id, sender, message, emotion, timestamp) VALUES {placeholders}",
+            values
+        )
+        conn.commit()
+    finally:
+        conn.close()
 
-    # 表名轉換
-    table_name = f"messages_{user_id.replace('-', '_')}"
+# 暫時性的資料庫錯誤：太多連線、伺服器關閉中、鎖等待逾時、死結、連不上、連線中斷
+_TRANSIENT_DB_ERRORS = {1040, 1053, 1205, 1213, 2003, 2006, 2013, 2055}
+
+def is_transient_db_error(error):
+    """ 重試可能成功的錯誤；資料錯誤（欄位過長、編碼錯誤）重試也不會成功 """
+    if isinstance(error, PoolTimeoutError):
+        return True
+    if isinstance(error, mysql.connector.Error):
+        if error.errno is None:
+            # 沒有 errno 時，只有用戶端的連線錯誤（InterfaceError）值得重試，型別轉換錯誤不是
+            return isinstance(error, mysql.connector.errors.InterfaceError)
+        return error.errno in _TRANSIENT_DB_ERRORS
+    return isinstance(error, OSError)
+
+# 聊天記錄的背景批次寫入（由 app 啟動時 start()、關閉時 stop()）
+message_writer = MessageWriter(
+    insert_messages,
+    journal_dir=Config.WRITE_BEHIND_JOURNAL_DIR,
+    batch_size=Config.WRITE_BEHIND_BATCH_SIZE,
+    flush_interval=Config.WRITE_BEHIND_FLUSH_INTERVAL,
+    max_pending=Config.WRITE_BEHIND_MAX_PENDING,
+    fsync=Config.WRITE_BEHIND_FSYNC,
+    is_transient=is_transient_db_error,
+    stop_timeout=Config.WRITE_BEHIND_STOP_TIMEOUT
+)
 
-    # 分析情緒
-    emotion = analyze_emotion(message) if sender == "user" else None
+def save_message_with_emotion(user_id, sender, message):
+    """
+    儲存聊天記錄到 `messages` 表
+    情緒先留空，由背景的情緒標記（core/emotion_tagger.py）批次分析後補上標籤與分數
+    背景寫入啟動時只放進寫入佇列，不等資料庫提交
+    """
+    if message_writer.running():
+        try:
+            message_writer.submit(user_id, sender, message)
+        except mysql.connector.Error as e:
+            logger.error("MySQL 插入錯誤：%s", e)
+        return
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
 
     try:
         # 插入對話
-        insert_query = f"INSERT INTO {table_name} (sender, message, emotion) VALUES (%s, %s, %s)"
-        cursor.execute(insert_query, (sender, message, emotion))
+        insert_query = "INSERT INTO messages (user_id, sender, message) VALUES (%s, %s, %s)"
+        cursor.execute(insert_query, (user_id, sender, message))
         conn.commit()
 
-        # Debug 訊息
-        print(f"✅ 成功插入訊息到 {table_name}：{sender} - {message} - {emotion}")
+        # 不記錄訊息內容（每則訊息都會經過，且內容屬於個資）
+        logger.debug("成功插入訊息到 messages：%s %s", user_id, sender)
 
     except mysql.connector.Error as e:
-        print(f"❌ MySQL 插入錯誤：{e}")
+        logger.error("MySQL 插入錯誤：%s", e)
 
     finally:
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+def save_messages_with_emotion(user_id, sender, messages):
+    """
+    一次儲存同一用戶的多則聊天記錄（合併成一輪對話的連續訊息），情緒同樣由背景的情緒標記批次補上
+    背景寫入未啟動時以一個多筆 INSERT 寫入
+    """
+    if message_writer.running():
+        for message in messages:
+            save_message_with_emotion(user_id, sender, message)
+        return
+
+    now = datetime.now().replace(microsecond=0)
+    try:
+        insert_messages([(user_id, sender, message, None, now) for message in messages])
+        logger.debug("成功插入 %d 則訊息到 messages：%s %s", len(messages), user_id, sender)
+    except mysql.connector.Error as e:
+        logger.error("MySQL 插入錯誤：%s", e)
@@ -0,0 +1,264 @@
+import os
+import threading
+import time
+from collections import deque
+import mysql.connector
+
+
+class PoolTimeoutError(Exception):
+    """ 在等待時間內取不到可用的 MySQL 連線 """
+
+
+# 每個執行緒各自累計的 SQL 執行次數（用來統計每個處理階段查了幾次資料庫）
+_query_counts = threading.local()
+
+def thread_query_count():
+    """ 目前執行緒至今執行過的 SQL 次數 """
+    return getattr(_query_counts, "value", 0)
+
+
+class _CountingCursor:
+    """ 包裝 cursor，計算 execute 次數 """
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def execute(self, *args, **kwargs):
+        _query_counts.value = thread_query_count() + 1
+        return self._raw.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        _query_counts.value = thread_query_count() + 1
+        return self._raw.executemany(*args, **kwargs)
+
+
+class PooledConnection:
+    """
+    包裝實際的 MySQL 連線，呼叫 close() 時把連線歸還連線池，而不是真的斷線
+    """
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def cursor(self, *args, **kwargs):
+        return _CountingCursor(self._raw.cursor(*args, **kwargs))
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self._raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """
+    執行緒安全的 MySQL 連線池
+    - 最多同時開 `size` 條連線，超過就等待，最長等 `timeout` 秒
+    - 閒置超過 `ping_interval` 秒的連線，取用前先 ping 確認仍可用
+    - 閒置超過 `idle_timeout` 秒或存活超過 `max_lifetime` 秒的連線直接重建
+    """
+
+    def __init__(self, size, timeout, ping_interval, idle_timeout, max_lifetime, **connect_args):
+        self.size = size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self._connect_args = connect_args
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, created_at, released_at)
+        self._created_at = {}  # id(conn) -> 建立時間
+        self._total = 0  # 已開啟（含使用中與閒置）的連線數
+        self._in_use = 0
+
+        # 監控數據
+        self._started_at = time.monotonic()
+        self._connects = 0
+        self._recent_connects = deque(maxlen=1000)
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+        self._discarded = 0
+
+        # fork 出的子行程不能沿用父行程的 socket
+        os.register_at_fork(after_in_child=self._forget_connections)
+
+    def _connect(self):
+        conn = mysql.connector.connect(**self._connect_args)
+        now = time.monotonic()
+        with self._cond:
+            self._connects += 1
+            self._recent_connects.append(now)
+            self._created_at[id(conn)] = now
+        return conn
+
+    def _discard(self, conn):
+        """ 關閉連線並從計數中移除（呼叫端需持有鎖） """
+        self._created_at.pop(id(conn), None)
+        self._total -= 1
+        self._discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_usable(self, conn, created_at, released_at, now):
+        if now - created_at > self.max_lifetime or now - released_at > self.idle_timeout:
+            return False
+        if now - released_at > self.ping_interval:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    def acquire(self, timeout=None):
+        """ 從連線池取出一條連線，回傳的物件呼叫 close() 即歸還 """
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        waited = False
+
+        while True:
+            candidate = None
+            with self._cond:
+                while True:
+                    if self._idle:
+                        candidate = self._idle.pop()
+                        break
+                    if self._total < self.size:
+                        self._total += 1
+                        break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            f"等待 MySQL 連線超過 {timeout} 秒（連線池大小 {self.size}）"
+                        )
+                    waited = True
+                    self._cond.wait(remaining)
+
+            if candidate is None:
+                break
+
+            # 在鎖外做健康檢查，ping 等網路時不會卡住其他執行緒
+            conn, created_at, released_at = candidate
+            if self._is_usable(conn, created_at, released_at, time.monotonic()):
+                with self._cond:
+                    self._checkout(start, waited)
+                return PooledConnection(self, conn)
+            with self._cond:
+                self._discard(conn)
+                self._cond.notify()
+
+        # 在鎖外建立新連線，避免握手時間卡住其他執行緒
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._total -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._checkout(start, waited)
+        return PooledConnection(self, conn)
+
+    def _checkout(self, start, waited):
+        """ 記錄一次取用（呼叫端需持有鎖） """
+        wait_time = time.monotonic() - start
+        self._in_use += 1
+        self._checkouts += 1
+        if waited:
+            self._waits += 1
+        self._wait_time_total += wait_time
+        self._wait_time_max = max(self._wait_time_max, wait_time)
+
+    def release(self, conn):
+        """ 歸還連線；有未提交的交易（或未讀完的結果）時先 rollback，失敗的連線直接丟棄 """
+        try:
+            # 已提交的連線不必再多一次往返
+            if conn.in_transaction or conn.unread_result:
+                conn.rollback()
+            healthy = True
+        except Exception:
+            healthy = False
+
+        with self._cond:
+            self._in_use -= 1
+            if healthy:
+                created_at = self._created_at.get(id(conn), time.monotonic())
+                self._idle.append((conn, created_at, time.monotonic()))
+            else:
+                self._discard(conn)
+            self._cond.notify()
+
+    def _forget_connections(self):
+        """
+        fork 後在子行程呼叫：直接丟掉繼承來的連線而不 close()，
+        否則送出的 COM_QUIT 會關掉父行程仍在使用的連線
+        """
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._created_at = {}
+        self._total = 0
+        self._in_use = 0
+
+    def warm(self, count):
+        """ 預先建立 `count` 條連線放進閒置佇列（不超過連線池大小），讓第一批請求不必等握手 """
+        conns = []
+        try:
+            for _ in range(min(count, self.size)):
+                conns.append(self.acquire())
+        finally:
+            for conn in conns:
+                conn.close()
+
+    def close_all(self):
+        """ 關閉所有閒置連線 """
+        with self._cond:
+            while self._idle:
+                conn, _, _ = self._idle.pop()
+                self._discard(conn)
+
+    def stats(self):
+        """ 連線池監控數據，用來在負載下調整連線池大小 """
+        with self._cond:
+            now = time.monotonic()
+            uptime = max(now - self._started_at, 1e-9)
+            recent = sum(1 for t in self._recent_connects if now - t <= 60)
+            return {
+                "size": self.size,
+                "open": self._total,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "wait_time_avg_ms": self._wait_time_total / self._checkouts * 1000 if self._checkouts else 0.0,
+                "wait_time_max_ms": self._wait_time_max * 1000,
+                "connects": self._connects,
+                "connects_per_sec": self._connects / uptime,
+                "connects_per_sec_1m": recent / 60,
+                "discarded": self._discarded,
+            }
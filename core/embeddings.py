@@ -0,0 +1,29 @@
+"""
+句子向量：transformers 模型的 token 向量做 mean pooling，再正規化成單位向量
+（兩個向量的內積就是 cosine 相似度）
+"""
+
+
+class SentenceEncoder:
+    """ 把句子轉成 float32 單位向量 """
+
+    def __init__(self, model_name, num_threads=0):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).eval()
+        self.dim = self.model.config.hidden_size
+
+    def encode(self, texts):
+        import torch
+
+        encoded = self.tokenizer(texts, padding=True, truncation=True, max_length=128, return_tensors="pt")
+        with torch.inference_mode():
+            hidden = self.model(**encoded).last_hidden_state
+        mask = encoded["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+        pooled = torch.nn.functional.normalize(pooled, dim=-1)
+        return pooled.numpy().astype("float32")
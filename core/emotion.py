@@ -1,24 +1,38 @@
-from transformers import pipeline
+from core.config import Config
+from core.emotion_batcher import EmotionBatcher
+from core.models import get_emotion_classifier
 
-# 使用中文情緒分析模型
-sentiment_analyzer = pipeline(
-    "sentiment-analysis",
-    model="uer/roberta-base-finetuned-jd-binary-chinese"
+def _classify_batch(messages):
+    """ 一整批訊息一起推論，較短的訊息會 padding 成同長度 """
+    # 使用共用的中文情緒分類器（第一次呼叫時才載入，後端由設定決定）
+    return get_emotion_classifier().predict(messages)
+
+# 微批次推論服務：同時進來的訊息合併成一批送進模型
+batcher = EmotionBatcher(
+    _classify_batch,
+    max_batch_size=Config.EMOTION_BATCH_SIZE,
+    max_wait_ms=Config.EMOTION_BATCH_WAIT_MS,
+    num_threads=Config.EMOTION_NUM_THREADS
 )
 
-def analyze_emotion(message):
+def _to_label(result):
+    """
+    模型標籤轉成中文
+    （此模型的標籤是 "positive (stars 4 and 5)" / "negative (stars 1, 2 and 3)"，只比對開頭）
+    """
+    label = result['label'].lower()
+    if label.startswith("positive"):
+        return "正面"
+    elif label.startswith("negative"):
+        return "負面"
+    else:
+        return "中性"
+
+def classify_emotions(messages):
     """
-    分析消息的情緒
+    一次分析多則消息，回傳 [(中文標籤, 置信分數)]，與輸入順序相同
+    任一筆失敗時拋出例外，由呼叫端決定是否重試
     """
-    try:
-        result = sentiment_analyzer(message)[0]
-        label = result['label']  # 標籤：POSITIVE、NEGATIVE
-        if label == "POSITIVE":
-            return "正面"
-        elif label == "NEGATIVE":
-            return "負面"
-        else:
-            return "中性"
-    except Exception as e:
-        print(f"情緒分析錯誤：{e}")
-        return "未知"
+    futures = [batcher.submit(message) for message in messages]
+    results = [future.result(timeout=Config.EMOTION_TIMEOUT) for future in futures]
+    return [(_to_label(result), result['score']) for result in results]
@@ -0,0 +1,148 @@
+"""
+情緒分類器的推論後端，由 Config.EMOTION_BACKEND 選擇
+
+- pipeline：transformers pipeline，全精度（原本的做法，也是比對基準）
+- quantized：Linear 層動態量化成 int8 的 torch 模型
+- onnx：匯出成 ONNX 後以 ONNX Runtime 執行
+
+每個後端都提供 predict(texts)，回傳與 pipeline 相同格式的 [{"label": ..., "score": ...}]
+"""
+import os
+from utils.logger import logger
+
+
+class PipelineBackend:
+    """ 原本的 transformers pipeline """
+
+    name = "pipeline"
+
+    def __init__(self, model_name, num_threads=0):
+        from transformers import pipeline
+
+        self.pipeline = pipeline("sentiment-analysis", model=model_name)
+        self.model = self.pipeline.model
+
+    def predict(self, texts):
+        return self.pipeline(texts, batch_size=len(texts), truncation=True)
+
+
+class _TokenizedBackend:
+    """ 自行斷詞並把 logits 轉成 pipeline 格式的共用部分 """
+
+    def __init__(self, model_name):
+        from transformers import AutoConfig, AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.id2label = AutoConfig.from_pretrained(model_name).id2label
+
+    def _encode(self, texts, return_tensors):
+        return self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=min(self.tokenizer.model_max_length, 512),
+            return_tensors=return_tensors
+        )
+
+    def _to_results(self, probabilities):
+        results = []
+        for row in probabilities:
+            index = max(range(len(row)), key=lambda i: row[i])
+            results.append({"label": self.id2label[index], "score": float(row[index])})
+        return results
+
+
+class QuantizedTorchBackend(_TokenizedBackend):
+    """ Linear 層動態量化成 int8，CPU 上推論較快、模型較小 """
+
+    name = "quantized"
+
+    def __init__(self, model_name, num_threads=0):
+        import torch
+        from transformers import AutoModelForSequenceClassification
+
+        super().__init__(model_name)
+        model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+        self.model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def predict(self, texts):
+        import torch
+
+        encoded = self._encode(texts, return_tensors="pt")
+        with torch.inference_mode():
+            logits = self.model(**encoded).logits
+        return self._to_results(torch.softmax(logits, dim=-1).tolist())
+
+
+class OnnxBackend(_TokenizedBackend):
+    """ ONNX Runtime 推論；模型檔不存在時先從 transformers 模型匯出 """
+
+    name = "onnx"
+
+    def __init__(self, model_name, num_threads=0, onnx_path=None):
+        import onnxruntime
+        from core.config import Config
+
+        super().__init__(model_name)
+        onnx_path = onnx_path or Config.EMOTION_ONNX_PATH
+        if not os.path.exists(onnx_path):
+            export_onnx(model_name, onnx_path)
+
+        options = onnxruntime.SessionOptions()
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            onnx_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.model = None
+
+    def predict(self, texts):
+        import numpy as np
+
+        encoded = self._encode(texts, return_tensors="np")
+        feeds = {name: value.astype(np.int64) for name, value in encoded.items() if name in self.input_names}
+        logits = self.session.run(None, feeds)[0]
+        exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        return self._to_results((exp / exp.sum(axis=-1, keepdims=True)).tolist())
+
+
+def export_onnx(model_name, onnx_path):
+    """ 把 transformers 分類模型匯出成 ONNX（batch 與序列長度皆為動態） """
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    logger.info("匯出 ONNX 模型：%s -> %s", model_name, onnx_path)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+    sample = tokenizer(["匯出用的範例句子"], return_tensors="pt")
+    # 輸入名稱依 forward() 參數順序排列，與 trace 出的圖一致
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["logits"] = {0: "batch"}
+
+    os.makedirs(os.path.dirname(onnx_path) or ".", exist_ok=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (dict(sample),),  # 最後一個元素是 dict 時以具名參數傳入
+            onnx_path,
+            input_names=input_names,
+            output_names=["logits"],
+            dynamic_axes=dynamic_axes,
+            opset_version=17
+        )
+
+
+BACKENDS = {
+    PipelineBackend.name: PipelineBackend,
+    QuantizedTorchBackend.name: QuantizedTorchBackend,
+    OnnxBackend.name: OnnxBackend,
+}
+
+
+def create_backend(name, model_name, num_threads=0):
+    """ 依名稱建立後端 """
+    if name not in BACKENDS:
+        raise ValueError(f"未知的情緒分析後端：{name}（可用：{', '.join(BACKENDS)}）")
+    return BACKENDS[name](model_name, num_threads=num_threads)
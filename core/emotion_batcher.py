@@ -0,0 +1,123 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from utils.logger import logger
+from utils.stats import LatencyWindow
+
+
+class EmotionBatcher:
+    """
+    情緒分析微批次服務
+    - 呼叫端 submit() 文字後立即拿到 Future
+    - 背景執行緒收集請求：等到 `max_batch_size` 筆或第一筆進來後過了 `max_wait_ms` 就送出
+    - 一整批一起跑模型（padding 成同長度），在 torch.inference_mode 下執行
+    """
+
+    def __init__(self, classify, max_batch_size=32, max_wait_ms=10, num_threads=0):
+        self._classify = classify  # list[str] -> list[dict]
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.num_threads = num_threads
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        self._started_at = None
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+        self._latency = LatencyWindow()  # 每筆從送出到拿到結果的時間
+        self._inference = LatencyWindow()  # 每批模型推論時間
+
+    def start(self):
+        """ 啟動背景執行緒（重複呼叫無副作用） """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._started_at = time.monotonic()
+            self._thread = threading.Thread(target=self._run, name="emotion-batcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """ 處理完已送出的請求後停止 """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def submit(self, text):
+        """ 送出一筆文字，回傳會得到模型結果（dict）的 Future """
+        if self._thread is None:
+            self.start()
+        future = Future()
+        self._queue.put((text, future, time.monotonic()))
+        return future
+
+    def _collect(self, first):
+        """ 以第一筆為起點，在時間窗口內盡量湊滿一批 """
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # 停止訊號放回佇列，這一批處理完再結束
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        # torch 很大，等背景執行緒第一次啟動時才載入，不拖慢 app 的 import
+        import torch
+
+        if self.num_threads > 0:
+            torch.set_num_threads(self.num_threads)
+
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            texts = [text for text, _, _ in batch]
+
+            started_at = time.monotonic()
+            try:
+                with torch.inference_mode():
+                    results = self._classify(texts)
+            except Exception as e:
+                self._errors += 1
+                logger.exception("情緒分析批次失敗（%d 筆）", len(batch))
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            finished_at = time.monotonic()
+            self._inference.add(finished_at - started_at)
+            self._batches += 1
+            self._items += len(batch)
+            for (_, future, submitted_at), result in zip(batch, results):
+                self._latency.add(finished_at - submitted_at)
+                future.set_result(result)
+
+    def stats(self):
+        """ 吞吐量與延遲統計 """
+        uptime = time.monotonic() - self._started_at if self._started_at else 0.0
+        return {
+            "batches": self._batches,
+            "items": self._items,
+            "errors": self._errors,
+            "pending": self._queue.qsize(),
+            "avg_batch_size": self._items / self._batches if self._batches else 0.0,
+            "items_per_sec": self._items / uptime if uptime else 0.0,
+            "latency": self._latency.summary(),
+            "inference": self._inference.summary(),
+        }
@@ -0,0 +1,210 @@
+"""
+背景情緒標記：訊息先以空的情緒存入，這裡再批次分析並補上標籤與置信分數
+
+- 找出 emotion_score 為 NULL 的用戶訊息（含分數欄位加入前的舊資料），整批分析後一次 UPDATE
+- 以 SELECT ... FOR UPDATE SKIP LOCKED 認領一批（寫入認領期限）後立即提交，
+  分析期間不持有資料列鎖與連線；多個 worker 同時執行也不會重複處理，worker 中途當掉時期限過後由其他 worker 接手
+- 整批分析失敗時改為逐筆分析，找出分析不了的訊息；同一則失敗 `max_attempts` 次後略過，不會卡住後面的訊息
+
+用法：
+    python -m core.emotion_tagger --backfill   # 把所有歷史訊息補標完再結束
+"""
+import argparse
+import threading
+import time
+from core.config import Config
+from core.database import get_db_connection
+from core.emotion import classify_emotions
+from core.stages import stage
+from utils.logger import logger
+
+
+def _key_values(rows):
+    """ [(user_id, id, ...)] -> (`(user_id, id) IN (...)` 的 placeholder, 參數) """
+    placeholders = ", ".join(["(%s, %s)"] * len(rows))
+    return placeholders, [value for row in rows for value in row[:2]]
+
+
+def _claim(batch_size, lease, max_attempts):
+    """ 認領一批尚未分析的訊息並立即提交，回傳 [(user_id, id, message)] """
+    now = int(time.time())
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT user_id, id, message FROM messages
+            WHERE sender = 'user' AND emotion_score IS NULL
+              AND emotion_attempts < %s
+              AND (emotion_claimed_until IS NULL OR emotion_claimed_until < %s)
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (max_attempts, now, batch_size))
+        rows = cursor.fetchall()
+        if rows:
+            placeholders, values = _key_values(rows)
+            cursor.execute(f"""
+                UPDATE messages SET emotion_claimed_until = %s, emotion_attempts = emotion_attempts + 1
+                WHERE (user_id, id) IN ({placeholders})
+            """, [now + lease, *values])
+        conn.commit()
+        return rows
+    finally:
+        conn.close()
+
+
+def _save(tagged):
+    """ 寫入分析結果：[((user_id, id, message), (label, score))]；已被其他 worker 標記的略過 """
+    # 以衍生表 JOIN 一次更新整批
+    derived = " UNION ALL ".join(
+        ["SELECT %s AS user_id, %s AS id, %s AS emotion, %s AS score"] * len(tagged)
+    )
+    values = []
+    for (user_id, message_id, _), (label, score) in tagged:
+        values.extend([user_id, message_id, label, score])
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            UPDATE messages m
+            JOIN ({derived}) t ON m.user_id = t.user_id AND m.id = t.id
+            SET m.emotion = t.emotion, m.emotion_score = t.score, m.emotion_claimed_until = NULL
+            WHERE m.emotion_score IS NULL
+        """, values)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _release(rows, count_attempt=True):
+    """ 放棄認領，讓下一輪重新分析（不是訊息本身的問題時，這次不算一次嘗試） """
+    placeholders, values = _key_values(rows)
+    attempts = "emotion_attempts" if count_attempt else "GREATEST(emotion_attempts, 1) - 1"
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            UPDATE messages SET emotion_claimed_until = NULL, emotion_attempts = {attempts}
+            WHERE (user_id, id) IN ({placeholders}) AND emotion_score IS NULL
+        """, values)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _classify_each(rows):
+    """ 逐筆分析，回傳與 rows 對應的結果（失敗的為 None） """
+    results = []
+    for _, _, message in rows:
+        try:
+            results.append(classify_emotions([message or ""])[0])
+        except Exception:
+            results.append(None)
+    return results
+
+
+def tag_pending(batch_size, lease=300, max_attempts=3):
+    """ 標記一批尚未分析的訊息，回傳認領的筆數（含分析失敗、留待下一輪的訊息） """
+    rows = _claim(batch_size, lease, max_attempts)
+    if not rows:
+        return 0
+
+    with stage("emotion"):
+        try:
+            results = classify_emotions([message or "" for _, _, message in rows])
+        except Exception:
+            logger.exception("整批情緒分析失敗（%d 筆），改為逐筆分析", len(rows))
+            results = _classify_each(rows)
+
+    tagged = [(row, result) for row, result in zip(rows, results) if result is not None]
+    failed = [row for row, result in zip(rows, results) if result is None]
+    if not tagged:
+        # 多筆都失敗，多半是模型暫時無法使用，不算在訊息的嘗試次數上；
+        # 只有一筆時分不出是模型還是這則訊息的問題，照常計數，壞掉的訊息才不會一直被重試
+        _release(rows, count_attempt=len(rows) == 1)
+        raise RuntimeError(f"情緒分析無法使用（{len(rows)} 筆）")
+    _save(tagged)
+    if failed:
+        _release(failed)
+        logger.warning("%d 筆訊息情緒分析失敗，稍後重試（最多 %d 次）", len(failed), max_attempts)
+    return len(rows)
+
+
+class EmotionTagger:
+    """ 定期標記新訊息的背景執行緒 """
+
+    def __init__(self, batch_size, interval, lease=300, max_attempts=3):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._stop = threading.Event()
+        self._thread = None
+        self.tagged = 0
+        self.errors = 0
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="emotion-tagger", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                count = tag_pending(self.batch_size, self.lease, self.max_attempts)
+            except Exception:
+                self.errors += 1
+                logger.exception("情緒標記失敗")
+                count = 0
+            self.tagged += count
+            # 整批都滿代表還有待處理的訊息，立即繼續；否則等下一輪
+            if count < self.batch_size:
+                self._stop.wait(self.interval)
+
+    def stats(self):
+        return {"tagged": self.tagged, "errors": self.errors}
+
+
+def backfill(batch_size, lease=300, max_attempts=3):
+    """ 把所有尚未分析的訊息標記完（失敗超過 `max_attempts` 次的略過） """
+    total = 0
+    started_at = time.monotonic()
+    while True:
+        count = tag_pending(batch_size, lease, max_attempts)
+        if count == 0:
+            break
+        total += count
+        logger.info("已標記 %d 筆（%.0f 筆/秒）", total, total / (time.monotonic() - started_at))
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批次標記訊息情緒")
+    parser.add_argument("--backfill", action="store_true", help="標記所有歷史訊息後結束")
+    parser.add_argument("--batch-size", type=int, default=Config.EMOTION_TAGGER_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if args.backfill:
+        total = backfill(args.batch_size, Config.EMOTION_TAGGER_LEASE, Config.EMOTION_TAGGER_MAX_ATTEMPTS)
+        print(f"🎉 補標完成，共 {total} 筆")
+        return
+
+    tagger = EmotionTagger(
+        args.batch_size, Config.EMOTION_TAGGER_INTERVAL, Config.EMOTION_TAGGER_LEASE, Config.EMOTION_TAGGER_MAX_ATTEMPTS
+    )
+    tagger.start()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        tagger.stop()
+
+
+if __name__ == "__main__":
+    main()
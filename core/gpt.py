@@ -1,26 +1,58 @@
-from core.database import get_user_profile, fetch_chat_history
-from datetime import datetime
-from langchain.chat_models import ChatOpenAI
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import LLMChain
-from langchain.prompts import PromptTemplate
+from core.database import get_user_profile, fetch_chat_rows, latest_message_version
+from core.memory import ConversationMemoryStore
+from core.prompt import PromptBuilder
+from core.models import EMBEDDING_DIM, get_sentence_encoder
+import os
+import threading
+import time
+from core.llm_gateway import CircuitBreaker, LLMGateway, StreamInterruptedError
 from core.config import Config
-from transformers import pipeline
+from utils.logger import logger
+from utils.loop import iterate_sync, run_sync
 
-# 初始化情緒分析模型
-sentiment_analyzer = pipeline("sentiment-analysis")
+def _create_openai_client():
+    """ 建立 async 的 OpenAI 用戶端（重試由閘道處理） """
+    from openai import AsyncOpenAI
 
-# 初始化 GPT-4
-llm = ChatOpenAI(
-    model_name="gpt-4",
+    return AsyncOpenAI(api_key=Config.OPENAI_API_KEY, base_url=Config.OPENAI_BASE_URL or None, max_retries=0)
+
+# 初始化 GPT-4（async 閘道：併發上限、截止時間、重試、斷路器）
+gateway = LLMGateway(
+    _create_openai_client,
+    model=Config.GPT_MODEL,
     temperature=0.7,
-    openai_api_key=Config.OPENAI_API_KEY
+    max_concurrency=Config.GPT_MAX_CONCURRENCY,
+    per_user_concurrency=Config.GPT_PER_USER_CONCURRENCY,
+    deadline=Config.GPT_DEADLINE,
+    max_retries=Config.GPT_MAX_RETRIES,
+    breaker=CircuitBreaker(Config.GPT_BREAKER_FAILURES, Config.GPT_BREAKER_COOLDOWN),
+    fallback_reply=Config.GPT_FALLBACK_REPLY
 )
 
-# LangChain 記憶對話
-memory = ConversationBufferMemory(
-    memory_key="chat_history",
-    return_messages=True
+def summarize_turns(summary, turns):
+    """
+    把滑出記憶視窗的舊對話併入摘要
+    """
+    dialogue = "\n".join(f"{'User' if sender == 'user' else 'Lume'}: {message}" for sender, message in turns)
+    result = run_sync(gateway.complete(
+        None,
+        "請把以下對話重點整理成 200 字以內的摘要，保留用戶的狀況、情緒與重要事件。\n\n"
+        f"先前摘要：{summary or '（無）'}\n\n新的對話：\n{dialogue}"
+    ))
+    if gateway.is_fallback(result):
+        raise RuntimeError("GPT 暫時無法使用，保留原本的摘要")
+    return result.strip()
+
+# 每位用戶各自的對話記憶（有 token 上限，不會互相混雜）
+memory_store = ConversationMemoryStore(
+    fetch_chat_rows,
+    version_loader=latest_message_version if Config.MEMORY_REVALIDATE else None,
+    revalidate_interval=Config.MEMORY_REVALIDATE_INTERVAL,
+    max_users=Config.MEMORY_MAX_USERS,
+    ttl=Config.MEMORY_TTL,
+    token_budget=Config.MEMORY_TOKEN_BUDGET,
+    load_limit=Config.MEMORY_LOAD_LIMIT,
+    summarizer=summarize_turns if Config.MEMORY_SUMMARIZE else None
 )
 
 # 設定 Prompt
@@ -30,66 +62,171 @@ template = """你是 Lume（路梅），一個溫暖的心理陪伴者。
 
 用戶: {user_input}
 Lume:"""
-prompt = PromptTemplate(
-    input_variables=["chat_history", "user_input"],
-    template=template
-)
+_prompt = None
 
-# 建立 LangChain Chain
-conversation = LLMChain(
-    llm=llm,
-    prompt=prompt,
-    memory=memory
+def get_prompt():
+    """ 第一次呼叫 GPT 時才載入 langchain 並建立 PromptTemplate（不拖慢 app 的 import） """
+    global _prompt
+    if _prompt is None:
+        from langchain.prompts import PromptTemplate
+
+        _prompt = PromptTemplate(
+            input_variables=["chat_history", "user_input"],
+            template=template
+        )
+    return _prompt
+
+# 依 token 預算組出 prompt（用戶資訊區塊依用戶快取；模板用原始字串，不必為此載入 langchain）
+prompt_builder = PromptBuilder(
+    template,
+    memory_store,
+    get_user_profile,
+    token_budget=Config.PROMPT_TOKEN_BUDGET,
+    input_max_tokens=Config.PROMPT_INPUT_MAX_TOKENS,
+    max_users=Config.MEMORY_MAX_USERS,
+    stats_every=Config.PROMPT_STATS_EVERY
 )
 
-def chat_with_gpt(user_id, user_input):
+# 可快取回合使用的通用 prompt：不含用戶資訊與對話歷史，回覆才能安全地給其他用戶使用
+generic_template = """你是 Lume（路梅），一個溫暖的心理陪伴者。
+
+用戶: {user_input}
+Lume:"""
+
+# 常見開場白的回覆快取（選用，啟用時才載入 numpy）
+if Config.RESPONSE_CACHE:
+    from core.response_cache import SemanticResponseCache
+
+response_cache = SemanticResponseCache(
+    lambda texts: get_sentence_encoder().encode(texts),
+    EMBEDDING_DIM,
+    threshold=Config.RESPONSE_CACHE_THRESHOLD,
+    ttl=Config.RESPONSE_CACHE_TTL,
+    max_size=Config.RESPONSE_CACHE_MAX_SIZE,
+    max_chars=Config.RESPONSE_CACHE_MAX_CHARS,
+    disabled_intents=Config.RESPONSE_CACHE_DISABLED_INTENTS
+) if Config.RESPONSE_CACHE else None
+
+# 停用意圖清單檔的修改時間與上次檢查時間
+_intents_file_mtime = None
+_intents_checked_at = 0.0
+_intents_lock = threading.Lock()
+
+def _reload_disabled_intents():
     """
-    透過 LangChain 記憶對話，讓 GPT-4 記住用戶過去的對話內容
+    RESPONSE_CACHE_INTENTS_FILE 修改後重新讀取停用的意圖（每個 worker 各自檢查，不必重啟就能關閉某類快取）
+    檔案中的意圖加上 RESPONSE_CACHE_DISABLED_INTENTS 一起停用；讀取失敗時保留目前的設定，下次檢查再讀
     """
-    # 取得聊天記錄
-    chat_history = fetch_chat_history(user_id)
-
-    # 取得用戶基本資料
-    user_profile = get_user_profile(user_id)
-
-    # **確保 `user_info` 變數存在**
-    if user_profile:
-        birth_date = user_profile.get("birth_date", None)
-        if birth_date:
-            # 假設 `birth_date` 是 `datetime.date` 類型，直接使用 `.year`
-            age = datetime.now().year - birth_date.year
-            user_info = f"姓名: {user_profile.get('name', '未知')}, 年齡: {age}, 興趣: {user_profile.get('interests', '未填寫')}, 心情: {user_profile.get('mood', '未填寫')}"
-        else:
-            user_info = f"姓名: {user_profile.get('name', '未知')}, 興趣: {user_profile.get('interests', '未填寫')}, 心情: {user_profile.get('mood', '未填寫')}"
-    else:
-        user_info = "尚未提供個人資料"
+    global _intents_file_mtime, _intents_checked_at
+    path = Config.RESPONSE_CACHE_INTENTS_FILE
+    if not path:
+        return
+    now = time.monotonic()
+    with _intents_lock:
+        if now - _intents_checked_at < Config.RESPONSE_CACHE_RELOAD_INTERVAL:
+            return
+        _intents_checked_at = now
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return
+        if mtime == _intents_file_mtime:
+            return
+        try:
+            with open(path, encoding="utf-8") as f:
+                content = f.read()
+        except (OSError, UnicodeDecodeError):
+            logger.exception("無法讀取停用意圖清單 %s，保留目前的設定", path)
+            return
+        intents = {intent.strip() for intent in content.replace("\n", ",").split(",") if intent.strip()}
+        _intents_file_mtime = mtime
+    response_cache.set_disabled_intents(intents | set(Config.RESPONSE_CACHE_DISABLED_INTENTS))
 
-    # **確保 `chat_history` 至少有空字串，避免 LangChain 拋錯**
-    if not chat_history:
-        chat_history = "（沒有聊天記錄）"
+def lookup_cached_reply(user_id, user_input):
+    """
+    查詢回覆快取，回傳 CacheLookup（未啟用、不適合快取或查詢失敗時回傳 None）
+    只有沒有對話脈絡的回合（記憶中沒有歷史）才使用快取，回覆不會依賴先前的對話
+    """
+    if response_cache is None:
+        return None
+    try:
+        _reload_disabled_intents()
+        if memory_store.get_history(user_id, current_input=user_input):
+            return None
+        return response_cache.lookup(user_input)
+    except Exception:
+        logger.exception("回覆快取查詢失敗")
+        return None
 
-    # **合併用戶資訊和輸入作為單一變數**
-    combined_input = f"【用戶資訊】{user_info}\n\n【用戶問題】{user_input}"
+def store_cached_reply(cached, reply):
+    """ 把 GPT 的回覆存入快取 """
+    if response_cache is None or cached is None:
+        return
+    try:
+        response_cache.store(cached, reply)
+    except Exception:
+        logger.exception("回覆快取寫入失敗")
 
-    # 呼叫 GPT-4
-    response = conversation.invoke({"user_input": combined_input})
+def _prompt_text(user_id, user_input, cached):
+    """ 可快取的回合用通用 prompt（回覆會給其他用戶使用），其餘帶入用戶資訊與對話記憶 """
+    if cached is not None:
+        return generic_template.format(user_input=user_input)
+    return get_prompt().format(**build_prompt_inputs(user_id, user_input))
 
-    return response["text"].strip()
+def build_prompt_inputs(user_id, user_input):
+    """
+    組出 Prompt 需要的變數：該用戶的對話記憶 + 用戶資訊與問題（總長度在 token 預算內）
+    """
+    return prompt_builder.build(user_id, user_input)
 
-def analyze_emotion(message):
+def chat_with_gpt(user_id, user_input):
     """
-    分析消息的情緒
+    帶入該用戶自己的對話記憶，讓 GPT-4 記住用戶過去的對話內容
     """
-    try:
-        result = sentiment_analyzer(message)[0]
-        label = result['label']  # 標籤：POSITIVE、NEGATIVE、NEUTRAL
-        score = result['score']  # 置信分數
-        if label == "POSITIVE":
-            return "正面"
-        elif label == "NEGATIVE":
-            return "負面"
-        else:
-            return "中性"
-    except Exception as e:
-        print(f"情緒分析錯誤：{e}")
-        return "未知"
\ No newline at end of file
+    cached = lookup_cached_reply(user_id, user_input)
+    if cached is not None and cached.reply is not None:
+        reply = cached.reply
+    else:
+        # 呼叫 GPT-4
+        prompt_text = _prompt_text(user_id, user_input, cached)
+        reply = run_sync(gateway.complete(user_id, prompt_text)).strip()
+        if gateway.is_fallback(reply):
+            # 預設回覆不存入快取與對話記憶
+            return reply
+        store_cached_reply(cached, reply)
+
+    # 更新對話記憶
+    memory_store.append(user_id, "user", user_input)
+    memory_store.append(user_id, "bot", reply)
+
+    return reply
+
+def stream_chat_with_gpt(user_id, user_input):
+    """
+    與 chat_with_gpt 相同，但邊生成邊回傳文字片段（generator）
+    完整讀完後才更新對話記憶；中途失敗時補上中斷提示，不完整的回覆不存入快取與對話記憶
+    """
+    cached = lookup_cached_reply(user_id, user_input)
+    if cached is not None and cached.reply is not None:
+        reply = cached.reply
+        yield reply
+    else:
+        prompt_text = _prompt_text(user_id, user_input, cached)
+
+        parts = []
+        try:
+            for delta in iterate_sync(gateway.stream(user_id, prompt_text)):
+                parts.append(delta)
+                yield delta
+        except StreamInterruptedError:
+            yield "\n" + Config.GPT_INTERRUPTED_REPLY
+            return
+        reply = "".join(parts).strip()
+        if gateway.is_fallback(reply):
+            # 預設回覆不存入快取與對話記憶
+            return
+        store_cached_reply(cached, reply)
+
+    # 更新對話記憶
+    memory_store.append(user_id, "user", user_input)
+    memory_store.append(user_id, "bot", reply)
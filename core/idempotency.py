@@ -0,0 +1,152 @@
+"""
+webhook 事件去重：處理太慢時 LINE 會重送 webhook，同一則訊息不應再存一次、再分析一次、再呼叫一次 GPT
+
+- 以 webhookEventId 為鍵，記在有時間上限的「已處理」集合中
+- 第一層：行程內的環狀緩衝（固定容量，最舊的先淘汰），收到 webhook 時立即檢查，重複的不放進佇列
+- 第二層（選用，IDEMPOTENCY_DB=1）：webhook_events 表，多個 worker 共用，
+  重送的事件被分配到其他 worker 時也擋得住（INSERT IGNORE 沒有新增就是處理過）
+- 統計收到的重送（isRedelivery）數與兩層各自攔下的重複數
+"""
+import threading
+import time
+from collections import OrderedDict
+from core.database import get_db_connection
+from utils.logger import logger
+
+
+class SeenEventRing:
+    """ 最近處理過的事件 ID（容量與保存時間都有上限） """
+
+    def __init__(self, capacity=100000, ttl=3600):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._seen = OrderedDict()  # event_id -> 首次看到的時間，依時間排序
+        self._lock = threading.Lock()
+
+    def add(self, event_id):
+        """ 記錄事件，已記錄過（且未過期）時回傳 False """
+        now = time.monotonic()
+        with self._lock:
+            # 淘汰過期與超出容量的舊事件（OrderedDict 依加入順序，最舊的在前）
+            while self._seen:
+                oldest_id, seen_at = next(iter(self._seen.items()))
+                if len(self._seen) < self.capacity and now - seen_at <= self.ttl:
+                    break
+                del self._seen[oldest_id]
+
+            if event_id in self._seen:
+                return False
+            self._seen[event_id] = now
+            return True
+
+    def discard(self, event_id):
+        with self._lock:
+            self._seen.pop(event_id, None)
+
+    def __len__(self):
+        return len(self._seen)
+
+
+class WebhookEventStore:
+    """ 多個 worker 共用的已處理事件表（webhook_events，由 core/migrations.py 建立） """
+
+    def __init__(self, ttl=86400, purge_every=1000):
+        self.ttl = int(ttl)
+        self.purge_every = purge_every
+        self._inserts = 0
+
+    def claim(self, event_id):
+        """ 記錄事件，其他 worker 已記錄過時回傳 False """
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT IGNORE INTO webhook_events (event_id, expires_at)
+                VALUES (%s, UNIX_TIMESTAMP() + %s)
+            """, (event_id, self.ttl))
+            claimed = cursor.rowcount == 1
+            conn.commit()
+
+            self._inserts += 1
+            if self._inserts % self.purge_every == 0:
+                # 定期刪除過期的事件，一次只刪一小批，避免長時間鎖表
+                cursor.execute("DELETE FROM webhook_events WHERE expires_at < UNIX_TIMESTAMP() LIMIT 5000")
+                conn.commit()
+        finally:
+            conn.close()
+        return claimed
+
+
+class WebhookDeduplicator:
+    """ 兩層去重，並統計攔下的重複事件數 """
+
+    def __init__(self, ring, store=None):
+        self.ring = ring
+        self.store = store
+        self._lock = threading.Lock()
+        self._events = 0
+        self._redeliveries = 0
+        self._local_duplicates = 0
+        self._shared_duplicates = 0
+        self._store_errors = 0
+
+    @staticmethod
+    def event_key(event):
+        """ 取得事件的 webhookEventId 與是否為重送 """
+        delivery_context = getattr(event, "delivery_context", None)
+        is_redelivery = bool(getattr(delivery_context, "is_redelivery", False))
+        return getattr(event, "webhook_event_id", None), is_redelivery
+
+    def check_local(self, event):
+        """ 收到 webhook 時呼叫（不做 I/O）：行程內已處理過的事件回傳 True """
+        event_id, is_redelivery = self.event_key(event)
+        with self._lock:
+            self._events += 1
+            self._redeliveries += is_redelivery
+        if event_id is None:
+            return False
+        if not self.ring.add(event_id):
+            with self._lock:
+                self._local_duplicates += 1
+            return True
+        return False
+
+    def forget(self, event):
+        """ 事件最後沒有被處理（例如佇列已滿回應 503），讓 LINE 重送時可以再處理 """
+        event_id, _ = self.event_key(event)
+        if event_id is not None:
+            self.ring.discard(event_id)
+
+    def check_shared(self, event):
+        """
+        在 worker 執行緒中、處理事件前呼叫：其他 worker 已處理過的事件回傳 True
+        共用表無法使用時不擋事件（寧可重複處理，也不要漏掉訊息）
+        """
+        if self.store is None:
+            return False
+        event_id, _ = self.event_key(event)
+        if event_id is None:
+            return False
+        try:
+            claimed = self.store.claim(event_id)
+        except Exception:
+            with self._lock:
+                self._store_errors += 1
+            logger.exception("webhook 去重表寫入失敗")
+            return False
+        if not claimed:
+            with self._lock:
+                self._shared_duplicates += 1
+            return True
+        return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "events": self._events,
+                "redeliveries": self._redeliveries,
+                "local_duplicates": self._local_duplicates,
+                "shared_duplicates": self._shared_duplicates,
+                "store_errors": self._store_errors,
+                "ring_size": len(self.ring),
+            }
@@ -0,0 +1,340 @@
+"""
+GPT 呼叫的 async 閘道：OpenAI 變慢或出錯時不拖垮整個 webhook 行程
+
+- 併發上限：全域 semaphore + 每位用戶各自的 semaphore
+- 每次呼叫有截止時間（deadline），包含排隊與重試的時間
+- 429 / 5xx / 逾時 / 連線錯誤以 full jitter 指數退避重試（有 Retry-After 時照辦）
+- 斷路器：連續失敗達門檻就打開，冷卻期間直接回傳預設回覆，冷卻後放一個請求試探
+- 記錄每次呼叫的延遲與 token 用量
+
+以 OPENAI_BASE_URL 指向 bench/fake_openai.py 即可在本機測試
+"""
+import asyncio
+import random
+import time
+from utils.logger import logger
+from utils.stats import LatencyWindow, ValueWindow
+
+
+class DeadlineExceededError(Exception):
+    """ 超過呼叫的截止時間 """
+
+
+class StreamInterruptedError(Exception):
+    """ 串流已回傳部分文字後失敗（回覆不完整，不能當成完整回覆使用） """
+
+
+class CircuitBreaker:
+    """
+    closed：正常呼叫；連續失敗 `failure_threshold` 次就打開
+    open：`cooldown` 秒內直接拒絕
+    half_open：冷卻後只放一個請求試探，成功就關閉，失敗再打開
+              （試探請求超過 `cooldown` 秒沒有結果時，再放一個）
+    （只在背景事件迴圈中使用，不需要加鎖）
+    """
+
+    def __init__(self, failure_threshold=5, cooldown=30):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._probe_started_at = 0.0
+        self.opened = 0
+
+    def allow(self):
+        if self.state == "closed":
+            return True
+        now = time.monotonic()
+        if self.state == "open" and now - self._opened_at >= self.cooldown:
+            self.state = "half_open"
+            self._probing = False
+        if self.state == "half_open" and (not self._probing or now - self._probe_started_at >= self.cooldown):
+            self._probing = True
+            self._probe_started_at = now
+            return True
+        return False
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info("GPT 斷路器關閉")
+        self.state = "closed"
+        self._failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self._failures += 1
+        if self.state == "half_open" or self._failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning("GPT 斷路器打開（連續失敗 %d 次），%d 秒內使用預設回覆", self._failures, self.cooldown)
+                self.opened += 1
+            self.state = "open"
+            self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class LLMGateway:
+    """
+    async 的 GPT 呼叫閘道
+    complete() 回傳完整回覆，stream() 逐段回傳；失敗或斷路時回傳 `fallback_reply`
+    （stream() 已回傳部分文字後才失敗時拋出 StreamInterruptedError）
+    回傳的回覆是否為預設回覆，可由 is_fallback() 判斷（預設回覆不應存入記憶或快取）
+    """
+
+    def __init__(self, client_factory, model, temperature=0.7, max_concurrency=32, per_user_concurrency=1,
+                 deadline=60, max_retries=3, breaker=None, fallback_reply=""):
+        self._client_factory = client_factory  # () -> openai.AsyncOpenAI，在背景迴圈中第一次使用時建立
+        self._client = None
+        self.model = model
+        self.temperature = temperature
+        self.max_concurrency = max_concurrency
+        self.per_user_concurrency = per_user_concurrency
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.breaker = breaker or CircuitBreaker()
+        self.fallback_reply = fallback_reply
+
+        self._global_semaphore = None
+        self._user_semaphores = {}  # user_id -> [semaphore, 使用中的呼叫數]
+
+        self._latency = LatencyWindow()
+        self._first_token = LatencyWindow()
+        self._prompt_tokens = ValueWindow()
+        self._completion_tokens = ValueWindow()
+        self._calls = 0
+        self._retries = 0
+        self._failures = 0
+        self._fallbacks = 0
+        self._in_flight = 0
+
+    def is_fallback(self, reply):
+        return reply == self.fallback_reply
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = self._client_factory()
+            self._global_semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    def _acquire_user(self, user_id):
+        """ 取得該用戶的 semaphore（沒有呼叫在使用時就移除，避免用戶數無限成長） """
+        item = self._user_semaphores.get(user_id)
+        if item is None:
+            item = self._user_semaphores[user_id] = [asyncio.Semaphore(self.per_user_concurrency), 0]
+        item[1] += 1
+        return item
+
+    def _release_user(self, user_id, item):
+        item[1] -= 1
+        if item[1] == 0:
+            self._user_semaphores.pop(user_id, None)
+
+    @staticmethod
+    def _is_retryable(error):
+        import openai
+
+        if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, asyncio.TimeoutError)):
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code == 429 or error.status_code >= 500
+        return False
+
+    @staticmethod
+    def _retry_after(error):
+        """ 讀取 Retry-After header（秒），沒有時回傳 None """
+        response = getattr(error, "response", None)
+        value = response.headers.get("retry-after") if response is not None else None
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
+
+    async def _with_retries(self, deadline, attempt_call):
+        """ 在截止時間內執行 `attempt_call(剩餘秒數)`，可重試的錯誤以 jitter 退避後重試 """
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceededError()
+            try:
+                return await asyncio.wait_for(attempt_call(remaining), remaining)
+            except Exception as e:
+                if attempt == self.max_retries or not self._is_retryable(e):
+                    raise
+                delay = self._retry_after(e)
+                if delay is None:
+                    delay = random.uniform(0, min(8.0, 0.5 * 2 ** attempt))
+                if time.monotonic() + delay >= deadline:
+                    raise
+                self._retries += 1
+                logger.warning("GPT 呼叫失敗（%s），%.2f 秒後重試", type(e).__name__, delay)
+                await asyncio.sleep(delay)
+
+    async def _enter(self, user_id, deadline):
+        """ 依序取得全域與用戶的併發名額，回傳用戶的 semaphore 項目 """
+        self._get_client()
+        item = self._acquire_user(user_id) if user_id is not None else None
+        try:
+            if item is not None:
+                await asyncio.wait_for(item[0].acquire(), max(0, deadline - time.monotonic()))
+            try:
+                await asyncio.wait_for(self._global_semaphore.acquire(), max(0, deadline - time.monotonic()))
+            except BaseException:
+                if item is not None:
+                    item[0].release()
+                raise
+        except asyncio.TimeoutError:
+            if item is not None:
+                self._release_user(user_id, item)
+            raise DeadlineExceededError() from None
+        except BaseException:
+            if item is not None:
+                self._release_user(user_id, item)
+            raise
+        self._in_flight += 1
+        return item
+
+    def _exit(self, user_id, item):
+        self._in_flight -= 1
+        self._global_semaphore.release()
+        if item is not None:
+            item[0].release()
+            self._release_user(user_id, item)
+
+    def _record_usage(self, usage):
+        if usage is not None:
+            self._prompt_tokens.add(usage.prompt_tokens)
+            self._completion_tokens.add(usage.completion_tokens)
+
+    def _fail(self, error, user_id):
+        self._failures += 1
+        self._fallbacks += 1
+        if isinstance(error, DeadlineExceededError) or self._is_retryable(error):
+            self.breaker.record_failure()
+        else:
+            # 其他錯誤（例如 400）代表 OpenAI 仍有回應，不打開斷路器
+            self.breaker.record_success()
+        logger.error("GPT 呼叫失敗，使用預設回覆（%s）：%r", user_id, error)
+        return self.fallback_reply
+
+    async def complete(self, user_id, prompt_text):
+        """ 取得完整回覆 """
+        self._calls += 1
+        if not self.breaker.allow():
+            self._fallbacks += 1
+            return self.fallback_reply
+
+        started_at = time.monotonic()
+        deadline = started_at + self.deadline
+        try:
+            item = await self._enter(user_id, deadline)
+        except DeadlineExceededError as e:
+            # 排隊逾時代表本行程太忙，不算 OpenAI 的失敗
+            self._fallbacks += 1
+            logger.warning("GPT 呼叫排隊逾時，使用預設回覆（%s）：%r", user_id, e)
+            return self.fallback_reply
+
+        async def attempt(remaining):
+            return await self._client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt_text}],
+                temperature=self.temperature,
+                timeout=remaining
+            )
+
+        try:
+            response = await self._with_retries(deadline, attempt)
+        except Exception as e:
+            return self._fail(e, user_id)
+        finally:
+            self._exit(user_id, item)
+
+        self.breaker.record_success()
+        self._latency.add(time.monotonic() - started_at)
+        self._record_usage(response.usage)
+        return response.choices[0].message.content or ""
+
+    async def stream(self, user_id, prompt_text):
+        """ 逐段回傳回覆；只有在還沒回傳任何文字前才會重試 """
+        self._calls += 1
+        if not self.breaker.allow():
+            self._fallbacks += 1
+            yield self.fallback_reply
+            return
+
+        started_at = time.monotonic()
+        deadline = started_at + self.deadline
+        try:
+            item = await self._enter(user_id, deadline)
+        except DeadlineExceededError as e:
+            self._fallbacks += 1
+            logger.warning("GPT 呼叫排隊逾時，使用預設回覆（%s）：%r", user_id, e)
+            yield self.fallback_reply
+            return
+
+        async def attempt(remaining):
+            # 開始串流並等到第一段文字，失敗時可整個重來
+            stream = await self._client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt_text}],
+                temperature=self.temperature,
+                stream=True,
+                stream_options={"include_usage": True},
+                timeout=remaining
+            )
+            iterator = stream.__aiter__()
+            async for chunk in iterator:
+                self._record_usage(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    return stream, iterator, chunk.choices[0].delta.content
+            return stream, iterator, ""
+
+        produced = False
+        try:
+            stream, iterator, first = await self._with_retries(deadline, attempt)
+            self._first_token.add(time.monotonic() - started_at)
+            if first:
+                produced = True
+                yield first
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise DeadlineExceededError()
+                    try:
+                        chunk = await asyncio.wait_for(iterator.__anext__(), remaining)
+                    except StopAsyncIteration:
+                        break
+                    self._record_usage(chunk.usage)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        produced = True
+                        yield chunk.choices[0].delta.content
+            finally:
+                await stream.close()
+        except Exception as e:
+            fallback = self._fail(e, user_id)
+            if produced:
+                # 已經送出部分文字，不能再補上預設回覆，交給呼叫端處理不完整的回覆
+                raise StreamInterruptedError(repr(e)) from e
+            yield fallback
+            return
+        finally:
+            self._exit(user_id, item)
+
+        self.breaker.record_success()
+        self._latency.add(time.monotonic() - started_at)
+
+    def stats(self):
+        return {
+            "calls": self._calls,
+            "in_flight": self._in_flight,
+            "retries": self._retries,
+            "failures": self._failures,
+            "fallbacks": self._fallbacks,
+            "breaker": self.breaker.state,
+            "breaker_opened": self.breaker.opened,
+            "latency": self._latency.summary(),
+            "first_token": self._first_token.summary(),
+            "prompt_tokens": self._prompt_tokens.summary(),
+            "completion_tokens": self._completion_tokens.summary(),
+        }
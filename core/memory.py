@@ -0,0 +1,226 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from core.tokens import count_tokens
+from utils.logger import logger
+
+# 每行前綴（"User: "、換行）大約佔的 token 數
+_LINE_OVERHEAD = 3
+
+
+class _UserMemory:
+    """ 單一用戶的對話記憶：最近幾輪對話 + 較舊對話的摘要 """
+
+    __slots__ = ("turns", "tokens", "summary", "summary_tokens", "touched_at", "version", "own_writes", "checked_at")
+
+    def __init__(self):
+        self.turns = deque()  # (sender, message, tokens)
+        self.tokens = 0
+        self.summary = ""
+        self.summary_tokens = 0
+        self.touched_at = time.monotonic()
+        self.version = None  # 上次比對時資料庫中該用戶最新的訊息 id
+        self.own_writes = 0  # 這個 worker 寫入、但還沒算進 `version` 的訊息筆數
+        self.checked_at = time.monotonic()
+
+
+class ConversationMemoryStore:
+    """
+    每位用戶各自的對話記憶
+    - 只保留 `token_budget` 個 token 內的最近對話（滑動視窗），prompt 大小不隨服務運行時間成長
+    - 以 LRU 保存最多 `max_users` 位用戶，超過 `ttl` 秒沒有互動就淘汰
+    - 不在記憶中的用戶，從 messages 表讀回最近的對話（`loader`）
+    - 有提供 `version_loader` 時，使用前先比對資料庫中該用戶新寫入的訊息（間隔 `revalidate_interval` 秒以上才比對），
+      有不是這個 worker 寫入的訊息（例如同一用戶的訊息由其他 worker 處理）就重新讀取，多個 worker 的記憶不會互相脫節；
+      自己寫入的訊息由 `record_writes()` 記下，不會觸發重新讀取（重新讀取時摘要會保留）
+    - 有提供 `summarizer` 時，滑出視窗的對話會在背景整理成摘要
+    """
+
+    def __init__(self, loader, max_users=10000, ttl=1800, token_budget=1500, load_limit=20, summarizer=None,
+                 version_loader=None, revalidate_interval=0):
+        self._loader = loader  # (user_id, limit) -> [(sender, message)]，最舊的在前
+        self._version_loader = version_loader  # (user_id, 上次的 id 或 None) -> (最新的訊息 id, 之後新增的筆數)
+        self.revalidate_interval = revalidate_interval
+        self._summarizer = summarizer  # (舊摘要, [(sender, message)]) -> 新摘要
+        self.max_users = max_users
+        self.ttl = ttl
+        self.token_budget = token_budget
+        self.load_limit = load_limit
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-summary") if summarizer else None
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._reloads = 0
+
+    def _get_entry(self, user_id):
+        """ 取得記憶，過期或不存在時回傳 None（呼叫端需持有鎖） """
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.touched_at > self.ttl:
+            del self._entries[user_id]
+            self._evictions += 1
+            return None
+        self._entries.move_to_end(user_id)
+        entry.touched_at = time.monotonic()
+        return entry
+
+    def _put_entry(self, user_id, entry):
+        """ 放入記憶並淘汰過期或超出數量的用戶（呼叫端需持有鎖） """
+        self._entries[user_id] = entry
+        self._entries.move_to_end(user_id)
+        now = time.monotonic()
+        while self._entries:
+            oldest_id, oldest = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_users and now - oldest.touched_at <= self.ttl:
+                break
+            del self._entries[oldest_id]
+            self._evictions += 1
+
+    def _append(self, entry, sender, message):
+        """ 加入一則對話並修剪到預算內，回傳被擠出視窗的對話（呼叫端需持有鎖） """
+        tokens = count_tokens(message)
+        entry.turns.append((sender, message, tokens))
+        entry.tokens += tokens
+
+        evicted = []
+        while entry.tokens > self.token_budget and len(entry.turns) > 1:
+            old_sender, old_message, old_tokens = entry.turns.popleft()
+            entry.tokens -= old_tokens
+            evicted.append((old_sender, old_message))
+        return evicted
+
+    def _load(self, user_id, current_input):
+        """ 從資料庫讀回最近的對話，建立記憶 """
+        rows = self._loader(user_id, self.load_limit)
+        # 目前這則訊息在呼叫 GPT 前已經存入資料庫，不要重複放進歷史
+        # （合併的多則訊息以換行連接，在資料庫中是分開的幾筆）
+        if current_input is not None:
+            tail = []
+            for index in range(len(rows) - 1, -1, -1):
+                sender, message = rows[index]
+                if sender != "user":
+                    break
+                tail.insert(0, message)
+                if "\n".join(tail) == current_input:
+                    rows = rows[:index]
+                    break
+        entry = _UserMemory()
+        for sender, message in rows:
+            self._append(entry, sender, message)
+        return entry
+
+    def get_history(self, user_id, current_input=None):
+        """ 取得用戶的對話歷史（已修剪到 token 預算內），格式化成 prompt 用的文字 """
+        return self.get_window(user_id, current_input)[0]
+
+    def get_window(self, user_id, current_input=None, max_tokens=None):
+        """
+        取得用戶的對話歷史，回傳 (prompt 用的文字, token 數)
+        有給 `max_tokens` 時只取放得進去的最近幾輪（使用記錄時算好的 token 數，不重新斷詞）
+        """
+        with self._lock:
+            entry = self._get_entry(user_id)
+            if entry is not None and (self._version_loader is None
+                                      or time.monotonic() - entry.checked_at < self.revalidate_interval):
+                self._hits += 1
+                return self._render(entry, max_tokens)
+            since = entry.version if entry is not None else None
+
+        # 在鎖外讀資料庫，不阻擋其他用戶（先取版本再讀對話，讀取期間寫入的訊息下次會再讀到）
+        version, added = self._version_loader(user_id, since) if self._version_loader is not None else (None, 0)
+        if entry is not None:
+            with self._lock:
+                if entry.version == since and added <= entry.own_writes:
+                    # 新增的訊息都是自己寫入的（記憶中已經有，或正要加入），不必重新讀取
+                    entry.version = version
+                    entry.own_writes -= added
+                    entry.checked_at = time.monotonic()
+                    self._hits += 1
+                    return self._render(entry, max_tokens)
+
+        loaded = self._load(user_id, current_input)
+        loaded.version = version
+        with self._lock:
+            current = self._get_entry(user_id)
+            if current is None or current is entry:
+                if entry is not None:
+                    # 資料庫有其他 worker 寫入的對話：以資料庫為準，保留較舊對話的摘要
+                    # （自己還在背景寫入佇列的訊息之後寫進資料庫時，會再觸發一次重新讀取補上）
+                    loaded.summary, loaded.summary_tokens = entry.summary, entry.summary_tokens
+                    self._reloads += 1
+                else:
+                    self._misses += 1
+                current = loaded
+                self._put_entry(user_id, current)
+            return self._render(current, max_tokens)
+
+    def append(self, user_id, sender, message):
+        """ 記錄一則新對話（記憶中沒有此用戶時略過，下次會從資料庫讀回） """
+        with self._lock:
+            entry = self._get_entry(user_id)
+            if entry is None:
+                return
+            evicted = self._append(entry, sender, message)
+
+        if evicted and self._summary_executor:
+            self._summary_executor.submit(self._summarize, user_id, entry, evicted)
+
+    def record_writes(self, user_id, rows=1):
+        """
+        記錄這個 worker 為該用戶存入資料庫的訊息筆數（存檔時呼叫，包括還在背景寫入佇列的訊息）
+        比對版本時，這些訊息不會被當成其他 worker 寫入的新對話
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                entry.own_writes += rows
+
+    def _summarize(self, user_id, entry, evicted):
+        """ 把擠出視窗的對話併入摘要（背景執行，不佔回覆時間） """
+        try:
+            summary = self._summarizer(entry.summary, evicted)
+        except Exception:
+            logger.exception("對話摘要失敗（%s）", user_id)
+            return
+        summary_tokens = count_tokens(summary)
+        with self._lock:
+            entry.summary = summary
+            entry.summary_tokens = summary_tokens
+
+    def _render(self, entry, max_tokens=None):
+        """ 由新到舊挑出放得進 `max_tokens` 的對話，回傳 (文字, token 數)（呼叫端需持有鎖） """
+        budget = float("inf") if max_tokens is None else max_tokens
+        used = 0
+        lines = []
+        for sender, message, tokens in reversed(entry.turns):
+            cost = tokens + _LINE_OVERHEAD
+            if used + cost > budget:
+                break
+            role = "User" if sender == "user" else "Lume"
+            lines.append(f"{role}: {message}")
+            used += cost
+        if entry.summary and used + entry.summary_tokens + _LINE_OVERHEAD <= budget:
+            lines.append(f"（先前對話摘要）{entry.summary}")
+            used += entry.summary_tokens + _LINE_OVERHEAD
+        lines.reverse()
+        return "\n".join(lines), used
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "users": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "reloads": self._reloads,
+            }
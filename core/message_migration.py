@@ -0,0 +1,163 @@
+"""
+把舊版每位用戶一張的 `messages_<user_id>` 表，分批搬到共用的 `messages` 表
+
+可以在服務運作中執行（線上搬移）：
+- 新訊息一律寫入 `messages`，舊表只剩歷史資料
+- 每批搬移與進度（message_migration.last_legacy_id）在同一個交易提交，中斷後重跑會從上次位置繼續
+- 搬移期間 fetch_chat_history 會合併讀取「舊表中尚未搬移的部分」，對話記憶不會斷
+
+用法：
+    python -m core.message_migration                # 登記所有舊表並搬移
+    python -m core.message_migration --user <ID>    # 只搬某位用戶
+    python -m core.message_migration --drop-legacy  # 刪除已搬完的舊表
+"""
+import argparse
+import time
+from core.config import Config
+from core.database import get_db_connection, legacy_table_name
+from core.migrations import migrate
+
+
+def register_legacy_tables():
+    """
+    找出所有舊表並登記到 message_migration，回傳新登記的數量
+    （舊表名由 user_id 轉換而來，用 users 表反查出原本的 user_id）
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT table_name FROM information_schema.tables
+            WHERE table_schema = %s AND table_name LIKE 'messages\\_%%'
+        """, (Config.DB_NAME,))
+        legacy_tables = {row[0] for row in cursor.fetchall()}
+
+        cursor.execute("SELECT user_id FROM users")
+        owners = {legacy_table_name(row[0]): row[0] for row in cursor.fetchall()}
+
+        registered = 0
+        for table_name in sorted(legacy_tables):
+            user_id = owners.get(table_name)
+            if user_id is None:
+                print(f"⚠️ 找不到 {table_name} 對應的用戶，略過")
+                continue
+            cursor.execute("""
+                INSERT IGNORE INTO message_migration (user_id, table_name) VALUES (%s, %s)
+            """, (user_id, table_name))
+            registered += cursor.rowcount
+        conn.commit()
+        return registered
+    finally:
+        conn.close()
+
+
+def migrate_user(user_id, table_name, batch_size=500, sleep=0.0):
+    """
+    依 id 順序分批把一張舊表搬到 messages，回傳搬移筆數
+    """
+    moved = 0
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT last_legacy_id FROM message_migration WHERE user_id = %s", (user_id,)
+        )
+        last_id = cursor.fetchone()[0]
+
+        while True:
+            cursor.execute(f"""
+                SELECT id, sender, message, emotion, timestamp FROM {table_name}
+                WHERE id > %s
+                ORDER BY id
+                LIMIT %s
+            """, (last_id, batch_size))
+            rows = cursor.fetchall()
+
+            if rows:
+                placeholders = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(rows))
+                values = []
+                for legacy_id, sender, message, emotion, timestamp in rows:
+                    values.extend([user_id, sender, message, emotion, timestamp, legacy_id])
+                # INSERT IGNORE 搭配 uq_legacy，重跑同一批也不會重複
+                cursor.execute(f"""
+                    INSERT IGNORE INTO messages (user_id, sender, message, emotion, timestamp, legacy_id)
+                    VALUES {placeholders}
+                """, values)
+                last_id = rows[-1][0]
+                moved += len(rows)
+
+            done = len(rows) < batch_size
+            cursor.execute("""
+                UPDATE message_migration SET last_legacy_id = %s, done = %s WHERE user_id = %s
+            """, (last_id, 1 if done else 0, user_id))
+            conn.commit()
+
+            if done:
+                return moved
+            if sleep:
+                time.sleep(sleep)  # 讓出資料庫資源給線上流量
+    finally:
+        conn.close()
+
+
+def migrate_all(batch_size=500, sleep=0.0, user_id=None):
+    """ 搬移所有尚未完成的舊表 """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        if user_id:
+            cursor.execute(
+                "SELECT user_id, table_name FROM message_migration WHERE done = 0 AND user_id = %s",
+                (user_id,)
+            )
+        else:
+            cursor.execute("SELECT user_id, table_name FROM message_migration WHERE done = 0")
+        pending = cursor.fetchall()
+    finally:
+        conn.close()
+
+    total = 0
+    for index, (pending_user, table_name) in enumerate(pending, start=1):
+        moved = migrate_user(pending_user, table_name, batch_size=batch_size, sleep=sleep)
+        total += moved
+        print(f"✅ [{index}/{len(pending)}] {table_name}：搬移 {moved} 筆")
+    return total
+
+
+def drop_migrated_tables():
+    """ 刪除已搬移完成的舊表 """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT table_name FROM message_migration WHERE done = 1")
+        for (table_name,) in cursor.fetchall():
+            cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+            print(f"🗑️ 已刪除 {table_name}")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="搬移 messages_<user_id> 舊表到 messages 表")
+    parser.add_argument("--batch-size", type=int, default=500, help="每批搬移筆數")
+    parser.add_argument("--sleep", type=float, default=0.0, help="每批之間暫停秒數")
+    parser.add_argument("--user", help="只搬移指定的 user_id")
+    parser.add_argument("--drop-legacy", action="store_true", help="刪除已搬移完成的舊表")
+    args = parser.parse_args()
+
+    # 確保 messages 與 message_migration 表已建立
+    migrate()
+
+    if args.drop_legacy:
+        drop_migrated_tables()
+        return
+
+    registered = register_legacy_tables()
+    print(f"📋 新登記 {registered} 張舊表")
+    total = migrate_all(batch_size=args.batch_size, sleep=args.sleep, user_id=args.user)
+    print(f"🎉 搬移完成，共 {total} 筆")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+資料庫結構的版本化遷移（部署時執行一次，app 啟動時不再建表）
+
+- 每個版本是一組 SQL，依序執行；已套用的版本記在 schema_migrations 表
+- 以 MySQL 的 GET_LOCK 確保多台機器同時部署時只有一個在跑遷移
+- 舊版 init_db 建立的資料庫也可直接升級（CREATE TABLE IF NOT EXISTS，重複的欄位、索引略過）
+- 新增結構變更時，在 MIGRATIONS 最後加一個新版本，不要修改已發布的版本
+（舊版 messages_<user_id> 表的資料搬移是另一回事，見 core/message_migration.py）
+
+用法：
+    python -m core.migrations            # 套用尚未執行的版本
+    python -m core.migrations --status   # 列出各版本是否已套用
+"""
+import argparse
+import mysql.connector
+from core.database import get_db_connection
+
+LOCK_NAME = "lume_schema_migrations"
+
+# (版本, 說明, [SQL])
+MIGRATIONS = [
+    (1, "users、messages、填寫進度、webhook 去重與搬移進度表", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id VARCHAR(50) PRIMARY KEY,
+            consent TINYINT(1) DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # 所有用戶共用一張聊天記錄表，以 (user_id, id) 為主鍵，同一用戶的訊息存在一起
+        # idx_user_time 對應 fetch_chat_history 的「最新 N 筆」查詢，不需要排序
+        # legacy_id 記錄舊 messages_<user_id> 表的 id，搬移重跑時靠 uq_legacy 去重
+        # idx_emotion_pending 讓背景情緒標記找出尚未分析（emotion_score 為 NULL）的用戶訊息
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            id BIGINT NOT NULL AUTO_INCREMENT,
+            user_id VARCHAR(50) NOT NULL,
+            sender VARCHAR(10),  /* 'user' or 'bot' */
+            message TEXT,
+            emotion VARCHAR(50) DEFAULT NULL,
+            emotion_score FLOAT DEFAULT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            legacy_id INT DEFAULT NULL,
+            PRIMARY KEY (user_id, id),
+            KEY idx_id (id),
+            KEY idx_user_time (user_id, timestamp, id),
+            KEY idx_emotion_pending (sender, emotion_score, id),
+            UNIQUE KEY uq_legacy (user_id, legacy_id)
+        )
+        PARTITION BY KEY (user_id) PARTITIONS 16
+        """,
+        # 基本資料填寫進度（見 core/session.py），step 為目前步驟，expires_at 為過期的 UNIX 時間
+        """
+        CREATE TABLE IF NOT EXISTS profile_wizard_state (
+            user_id VARCHAR(50) PRIMARY KEY,
+            step TINYINT UNSIGNED NOT NULL,
+            expires_at INT UNSIGNED NOT NULL
+        )
+        """,
+        # 已處理的 webhook 事件（見 core/idempotency.py），expires_at 為過期的 UNIX 時間
+        """
+        CREATE TABLE IF NOT EXISTS webhook_events (
+            event_id VARCHAR(64) PRIMARY KEY,
+            expires_at INT UNSIGNED NOT NULL,
+            KEY idx_expires (expires_at)
+        )
+        """,
+        # 舊表搬移進度（見 core/message_migration.py）
+        """
+        CREATE TABLE IF NOT EXISTS message_migration (
+            user_id VARCHAR(50) PRIMARY KEY,
+            table_name VARCHAR(64) NOT NULL,
+            last_legacy_id INT NOT NULL DEFAULT 0,
+            done TINYINT(1) NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (2, "較早建立的 messages 表補上情緒分數欄位與索引", [
+        "ALTER TABLE messages ADD COLUMN emotion_score FLOAT DEFAULT NULL AFTER emotion",
+        "ALTER TABLE messages ADD KEY idx_emotion_pending (sender, emotion_score, id)",
+    ]),
+    (3, "用戶基本資料表（原本在每次 set_user_profile 時建立）", [
+        """
+        CREATE TABLE IF NOT EXISTS user_profile (
+            user_id VARCHAR(50) PRIMARY KEY,
+            name VARCHAR(100) DEFAULT NULL,
+            birth_date DATE DEFAULT NULL,
+            interests TEXT DEFAULT NULL,
+            mood VARCHAR(50) DEFAULT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (4, "情緒標記的認領期限與嘗試次數（分析時不持有資料列鎖）", [
+        "ALTER TABLE messages ADD COLUMN emotion_attempts TINYINT UNSIGNED NOT NULL DEFAULT 0",
+        "ALTER TABLE messages ADD COLUMN emotion_claimed_until INT UNSIGNED DEFAULT NULL",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# 已存在的欄位 / 索引（舊版 init_db 已建立過）
+_ALREADY_APPLIED_ERRORS = (1060, 1061)
+
+
+def _ensure_version_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def _applied_versions(cursor):
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def current_version():
+    """ 資料庫目前已套用到的版本（尚未建立版本表時為 0），readiness 檢查使用 """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT MAX(version) FROM schema_migrations")
+        except mysql.connector.Error as e:
+            if e.errno == 1146:  # 表不存在
+                return 0
+            raise
+        row = cursor.fetchone()
+        return row[0] or 0
+    finally:
+        conn.close()
+
+
+def migrate(lock_timeout=60):
+    """ 依序套用尚未執行的版本，回傳本次套用的版本列表 """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (LOCK_NAME, lock_timeout))
+        if cursor.fetchone()[0] != 1:
+            raise RuntimeError(f"{lock_timeout} 秒內無法取得遷移鎖，可能有其他遷移正在執行")
+        try:
+            _ensure_version_table(cursor)
+            applied = _applied_versions(cursor)
+            newly_applied = []
+            for version, description, statements in MIGRATIONS:
+                if version in applied:
+                    continue
+                # MySQL 的 DDL 會隱式提交，無法整個版本包在一個交易裡；每句都可以安全重跑
+                for statement in statements:
+                    try:
+                        cursor.execute(statement)
+                    except mysql.connector.Error as e:
+                        if e.errno not in _ALREADY_APPLIED_ERRORS:
+                            raise
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                    (version, description)
+                )
+                conn.commit()
+                newly_applied.append(version)
+            return newly_applied
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+            cursor.fetchone()
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="套用資料庫結構遷移")
+    parser.add_argument("--status", action="store_true", help="只列出各版本是否已套用")
+    args = parser.parse_args()
+
+    if args.status:
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            _ensure_version_table(cursor)
+            applied = _applied_versions(cursor)
+        finally:
+            conn.close()
+        for version, description, _ in MIGRATIONS:
+            print(f"{'✅' if version in applied else '⏳'} {version:>3}  {description}")
+        return
+
+    applied = migrate()
+    if applied:
+        print(f"🎉 已套用版本 {', '.join(map(str, applied))}，目前版本 {LATEST_VERSION}")
+    else:
+        print(f"✅ 已是最新版本 {LATEST_VERSION}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+共用的模型註冊表：每個行程只載入一份情緒分析模型
+
+- 推論後端由 Config.EMOTION_BACKEND 選擇（見 core/emotion_backends.py）
+- 第一次使用時才載入（get_emotion_classifier），或在啟動後於背景預熱（warm_up_in_background）
+- 共享模式（MODEL_SHARED_PRELOAD=1）：在 master 行程先載入模型，
+  搭配 `gunicorn --preload -k uvicorn.workers.UvicornWorker` fork 出的 worker
+  以 copy-on-write 共用同一份權重，不會每個 worker 各佔一份記憶體
+"""
+import gc
+import os
+import threading
+import time
+from core.config import Config
+from core.emotion_backends import create_backend
+from utils.logger import logger
+from utils.proc import current_rss_mb
+
+SENTIMENT_MODEL = "uer/roberta-base-finetuned-jd-binary-chinese"
+EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+EMBEDDING_DIM = 384
+
+_lock = threading.Lock()
+_emotion_classifier = None
+_sentence_encoder = None
+_ready = threading.Event()
+
+def get_emotion_classifier():
+    """ 取得情緒分類器，尚未載入時在此載入（多執行緒同時呼叫只會載入一次） """
+    global _emotion_classifier
+    if _emotion_classifier is None:
+        with _lock:
+            if _emotion_classifier is None:
+                started_at = time.monotonic()
+                _emotion_classifier = create_backend(
+                    Config.EMOTION_BACKEND, SENTIMENT_MODEL, num_threads=Config.EMOTION_NUM_THREADS
+                )
+                logger.info(
+                    "情緒分析模型載入完成（%s，pid %d）：%.1f 秒，RSS %.0f MB",
+                    Config.EMOTION_BACKEND, os.getpid(), time.monotonic() - started_at, current_rss_mb()
+                )
+    return _emotion_classifier
+
+def get_sentence_encoder():
+    """ 取得句子向量模型（回覆快取使用），第一次呼叫時才載入 """
+    global _sentence_encoder
+    if _sentence_encoder is None:
+        with _lock:
+            if _sentence_encoder is None:
+                from core.embeddings import SentenceEncoder
+
+                started_at = time.monotonic()
+                _sentence_encoder = SentenceEncoder(EMBEDDING_MODEL, num_threads=Config.EMOTION_NUM_THREADS)
+                logger.info(
+                    "句子向量模型載入完成（pid %d）：%.1f 秒，RSS %.0f MB",
+                    os.getpid(), time.monotonic() - started_at, current_rss_mb()
+                )
+    return _sentence_encoder
+
+def is_ready():
+    """ 模型是否已載入並完成預熱 """
+    return _ready.is_set()
+
+def warm_up():
+    """ 載入模型並跑一次推論，讓第一則訊息不必等模型初始化 """
+    get_emotion_classifier().predict(["你好"])
+    _ready.set()
+
+def warm_up_in_background():
+    """ 在背景執行緒預熱模型，不阻擋服務啟動 """
+    def run():
+        try:
+            warm_up()
+        except Exception:
+            logger.exception("情緒分析模型預熱失敗")
+
+    threading.Thread(target=run, name="model-warmup", daemon=True).start()
+
+def preload_shared():
+    """
+    在 fork worker 之前載入模型（共享模式）
+    - 只載入權重、不做推論：fork 前啟動 torch 的執行緒池，子行程可能卡住
+    - gc.freeze() 把現有物件移出 GC 追蹤，避免 GC 掃描時改寫物件而觸發 copy-on-write 複製
+    """
+    classifier = get_emotion_classifier()
+    if classifier.model is not None:
+        classifier.model.eval()
+    gc.collect()
+    gc.freeze()
@@ -0,0 +1,122 @@
+import asyncio
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from utils.logger import logger
+from utils.stats import LatencyWindow
+
+
+class QueueFullError(Exception):
+    """ 事件佇列已滿，等待後仍無法放入 """
+
+
+class EventPipeline:
+    """
+    Webhook 事件處理管線
+    - 依 key（user_id）分配到固定的 worker，同一用戶的事件依序處理
+    - 每個 worker 有自己的有界佇列，佇列滿時最多等 `enqueue_timeout` 秒，之後回報 QueueFullError
+    - 事件處理函式是同步的（MySQL、模型推論、GPT），放到執行緒池執行，不會卡住 event loop
+    """
+
+    def __init__(self, handler, workers, queue_size, enqueue_timeout, stats_interval=0):
+        self._handler = handler
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size // self.workers)
+        self.enqueue_timeout = enqueue_timeout
+        self.stats_interval = stats_interval
+
+        self._queues = []
+        self._tasks = []
+        self._executor = None
+
+        self._submitted = 0
+        self._backpressured = 0
+        self._rejected = 0
+        self._failed = 0
+        self._wait = LatencyWindow()
+        self._process = LatencyWindow()
+
+    async def start(self):
+        """ 啟動 worker（需在 event loop 中呼叫） """
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="event-worker")
+        self._queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+        if self.stats_interval > 0:
+            self._tasks.append(asyncio.create_task(self._report_stats()))
+
+    async def stop(self, timeout=10):
+        """ 等待佇列中的事件處理完（最多 `timeout` 秒），再停止 worker """
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self._queues)), timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning("事件佇列在 %s 秒內未清空，剩餘 %d 筆", timeout, self.depth())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor:
+            self._executor.shutdown(wait=False)
+
+    def _shard(self, key):
+        return zlib.crc32(key.encode()) % self.workers
+
+    def full(self, key):
+        """ 對應 worker 的佇列是否已滿 """
+        return self._queues[self._shard(key or "")].full()
+
+    async def submit(self, key, event):
+        """ 把事件放入對應 worker 的佇列；佇列滿時等待，逾時拋出 QueueFullError """
+        queue = self._queues[self._shard(key or "")]
+        item = (event, time.monotonic())
+        try:
+            queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self._backpressured += 1
+            try:
+                await asyncio.wait_for(queue.put(item), self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                self._rejected += 1
+                raise QueueFullError(f"事件佇列已滿（深度 {self.depth()}）")
+        self._submitted += 1
+
+    async def _worker(self, queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            event, enqueued_at = await queue.get()
+            started_at = time.monotonic()
+            self._wait.add(started_at - enqueued_at)
+            try:
+                await loop.run_in_executor(self._executor, self._handler, event)
+            except Exception:
+                self._failed += 1
+                logger.exception("事件處理失敗")
+            finally:
+                self._process.add(time.monotonic() - started_at)
+                queue.task_done()
+
+    async def _report_stats(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            logger.info("事件管線狀態：%s", self.stats())
+
+    def running(self):
+        return bool(self._tasks)
+
+    def depth(self):
+        return sum(queue.qsize() for queue in self._queues)
+
+    def stats(self):
+        """ 佇列深度與延遲統計 """
+        return {
+            "workers": self.workers,
+            "queue_depth": self.depth(),
+            "queue_capacity": self.queue_size * self.workers,
+            "submitted": self._submitted,
+            "backpressured": self._backpressured,
+            "rejected": self._rejected,
+            "failed": self._failed,
+            "queue_wait": self._wait.summary(),
+            "processing": self._process.summary(),
+        }
@@ -0,0 +1,109 @@
+"""
+慢事件的取樣分析（PROFILE_SLOW_EVENTS=1 時啟用）
+
+    with profiler.track():
+        handle(event)
+
+- 背景執行緒每 `interval` 秒讀取一次正在處理事件的 worker 執行緒的呼叫堆疊（sys._current_frames），
+  不在 worker 執行緒中插入任何程式碼，未啟用時 track() 幾乎沒有成本
+- 事件處理超過 `threshold` 秒時，以 warning 記錄出現次數最多的幾個堆疊（flamegraph 的 collapsed 格式）
+"""
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from utils.logger import logger
+
+
+class _Tracked:
+    __slots__ = ("started_at", "samples")
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.samples = Counter()
+
+
+def _collapse(frame, max_depth=40):
+    """ 堆疊轉成 "外層;...;內層" 的單行字串 """
+    names = []
+    while frame is not None and len(names) < max_depth:
+        code = frame.f_code
+        names.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SlowEventProfiler:
+    """ 取樣記錄處理過慢的事件在哪裡花時間 """
+
+    def __init__(self, enabled=False, threshold=2.0, interval=0.01, top=5):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.interval = interval
+        self.top = top
+        self._tracked = {}  # thread ident -> _Tracked
+        self._lock = threading.Lock()
+        self._thread = None
+        self._slow_events = 0
+        self._samples = 0
+
+    def _ensure_sampler(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="slow-event-profiler", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                tracked = list(self._tracked.items())
+            if not tracked:
+                continue
+            frames = sys._current_frames()
+            for ident, record in tracked:
+                frame = frames.get(ident)
+                if frame is not None:
+                    record.samples[_collapse(frame)] += 1
+            self._samples += len(tracked)
+
+    @contextmanager
+    def track(self, label=""):
+        """ 取樣目前執行緒直到離開區塊；超過門檻時記錄最常出現的堆疊 """
+        if not self.enabled:
+            yield
+            return
+
+        self._ensure_sampler()
+        ident = threading.get_ident()
+        record = _Tracked()
+        with self._lock:
+            self._tracked[ident] = record
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._tracked.pop(ident, None)
+            elapsed = time.monotonic() - record.started_at
+            if elapsed >= self.threshold:
+                self._slow_events += 1
+                self._report(label, elapsed, record.samples)
+
+    def _report(self, label, elapsed, samples):
+        total = sum(samples.values())
+        lines = [
+            f"  {count / total:5.1%} {stack}" for stack, count in samples.most_common(self.top)
+        ] if total else ["  （沒有取樣）"]
+        logger.warning(
+            "慢事件 %s：%.2f 秒，取樣 %d 次，最常出現的堆疊：\n%s", label, elapsed, total, "\n".join(lines)
+        )
+
+    def stats(self):
+        return {
+            "enabled": int(self.enabled),
+            "threshold_seconds": self.threshold,
+            "slow_events": self._slow_events,
+            "samples": self._samples,
+        }
@@ -0,0 +1,112 @@
+"""
+組出送給 GPT 的 prompt，並把大小控制在 token 預算內
+
+- 用戶資訊區塊依用戶快取（連同 token 數），基本資料沒變就不重新組字串、不重新斷詞
+- 用戶輸入超過 `input_max_tokens` 時截斷
+- 對話歷史只取放得進剩餘預算的最近幾輪（token 數在記錄時就已算好）
+- 記錄每次 prompt 的 token 數，每 `stats_every` 次寫一次日誌
+"""
+import threading
+from datetime import datetime
+from core.cache import ReadThroughCache
+from core.tokens import count_tokens, truncate_tokens
+from utils.logger import logger
+from utils.stats import ValueWindow
+
+EMPTY_HISTORY = "（沒有聊天記錄）"
+
+
+def render_user_info(user_profile, year=None):
+    """ 把用戶基本資料組成 prompt 中的用戶資訊 """
+    if not user_profile:
+        return "尚未提供個人資料"
+    name = user_profile.get("name", "未知")
+    interests = user_profile.get("interests", "未填寫")
+    mood = user_profile.get("mood", "未填寫")
+    birth_date = user_profile.get("birth_date", None)
+    if birth_date:
+        # 假設 `birth_date` 是 `datetime.date` 類型，直接使用 `.year`
+        age = (year or datetime.now().year) - birth_date.year
+        return f"姓名: {name}, 年齡: {age}, 興趣: {interests}, 心情: {mood}"
+    return f"姓名: {name}, 興趣: {interests}, 心情: {mood}"
+
+
+class PromptBuilder:
+    """ 依 token 預算組出 prompt 的變數（chat_history / user_input） """
+
+    def __init__(self, prompt, memory_store, profile_loader, token_budget=3000, input_max_tokens=1000,
+                 max_users=10000, stats_every=100):
+        self.prompt = prompt
+        self.memory_store = memory_store
+        self._profile_loader = profile_loader  # user_id -> dict 或 None
+        self.token_budget = token_budget
+        self.input_max_tokens = input_max_tokens
+        self.stats_every = stats_every
+
+        # 模板本身（不含變數）的 token 數，第一次組 prompt 時才算（不在 import 時載入斷詞器）
+        self._template_tokens = None
+        # user_id -> (基本資料, 年份, 用戶資訊, token 數)
+        self._user_info = ReadThroughCache("user_info", max_size=max_users, ttl=float("inf"))
+
+        self._lock = threading.Lock()
+        self._prompt_tokens = ValueWindow()
+        self._history_tokens = ValueWindow()
+        self._truncated_inputs = 0
+
+    def _get_user_info(self, user_id):
+        """ 取得用戶資訊區塊與 token 數；基本資料或年份改變時才重新產生 """
+        user_profile = self._profile_loader(user_id)
+        year = datetime.now().year
+        found, cached = self._user_info.get(user_id)
+        if found and cached[0] == user_profile and cached[1] == year:
+            return cached[2], cached[3]
+
+        user_info = render_user_info(user_profile, year)
+        tokens = count_tokens(user_info)
+        # 保存一份副本比對，避免呼叫端修改到快取中的資料
+        self._user_info.set(user_id, (dict(user_profile) if user_profile else user_profile, year, user_info, tokens))
+        return user_info, tokens
+
+    def build(self, user_id, user_input):
+        """ 回傳 prompt 需要的變數：該用戶放得進預算的對話記憶 + 用戶資訊與問題 """
+        if self._template_tokens is None:
+            self._template_tokens = count_tokens(self.prompt.format(chat_history="", user_input=""))
+        user_info, info_tokens = self._get_user_info(user_id)
+
+        question, input_tokens = truncate_tokens(user_input, self.input_max_tokens)
+        truncated = question != user_input
+
+        # **合併用戶資訊和輸入作為單一變數**
+        combined_input = f"【用戶資訊】{user_info}\n\n【用戶問題】{question}"
+        combined_tokens = info_tokens + input_tokens + count_tokens("【用戶資訊】\n\n【用戶問題】")
+
+        history_budget = max(0, self.token_budget - self._template_tokens - combined_tokens)
+        chat_history, history_tokens = self.memory_store.get_window(
+            user_id, current_input=user_input, max_tokens=history_budget
+        )
+
+        # **確保 `chat_history` 至少有空字串，避免 LangChain 拋錯**
+        if not chat_history:
+            chat_history = EMPTY_HISTORY
+
+        self._record(self._template_tokens + combined_tokens + history_tokens, history_tokens, truncated)
+        return {"chat_history": chat_history, "user_input": combined_input}
+
+    def _record(self, prompt_tokens, history_tokens, truncated):
+        self._prompt_tokens.add(prompt_tokens)
+        self._history_tokens.add(history_tokens)
+        if truncated:
+            with self._lock:
+                self._truncated_inputs += 1
+        if self.stats_every > 0 and self._prompt_tokens.count % self.stats_every == 0:
+            logger.info("Prompt token 統計：%s", self.stats())
+
+    def stats(self):
+        with self._lock:
+            truncated_inputs = self._truncated_inputs
+        return {
+            "budget": self.token_budget,
+            "prompt_tokens": self._prompt_tokens.summary(),
+            "history_tokens": self._history_tokens.summary(),
+            "truncated_inputs": truncated_inputs,
+        }
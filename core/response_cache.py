@@ -0,0 +1,246 @@
+"""
+GPT 回覆的語意快取（選用，Config.RESPONSE_CACHE=1 才啟用）
+
+常見的開場白（「我好累」、「睡不著怎麼辦」）不必每次都呼叫 GPT-4：
+- 快取鍵是正規化後的輸入 + 分組（預設為意圖），不同分組不會互相命中
+- 先查完全相同的輸入（dict），再用句子向量在 NumPy 矩陣上找最相近的一筆，相似度超過門檻才算命中
+- 每筆有 TTL，滿了淘汰最久沒用到的一筆（LRU）
+- 只快取短訊息；依意圖分類，可個別關閉（RESPONSE_CACHE_DISABLED_INTENTS）；crisis 一律關閉，不能開啟
+
+快取的回覆會給同一分組的其他用戶使用，所以只能存放不依賴個人資料與對話內容的通用回覆
+（core/gpt.py 只在沒有對話脈絡的回合查詢，並以不含用戶資訊與歷史的通用 prompt 產生要快取的回覆）
+"""
+import re
+import threading
+import time
+import unicodedata
+import numpy as np
+from utils.logger import logger
+
+# 意圖分類：依序比對關鍵字，第一個符合的就是該訊息的意圖
+INTENT_KEYWORDS = [
+    ("crisis", ("想死", "自殺", "不想活", "活不下去", "結束生命", "傷害自己", "割腕")),
+    ("sleep", ("睡不著", "失眠", "睡不好", "做惡夢", "惡夢")),
+    ("tired", ("好累", "很累", "累了", "疲憊", "沒力")),
+    ("stress", ("壓力", "焦慮", "緊張", "煩")),
+    ("sad", ("難過", "傷心", "想哭", "低落", "孤單")),
+    ("greeting", ("你好", "哈囉", "嗨", "早安", "午安", "晚安", "hello", "hi")),
+]
+DEFAULT_INTENT = "other"
+# 一律不快取的意圖（危機訊息的回覆不能共用給其他用戶）
+ALWAYS_DISABLED_INTENTS = frozenset({"crisis"})
+
+# 正規化時移除的字元：空白、標點、符號（含 emoji）
+_NOISE_CATEGORIES = ("Z", "P", "S", "C")
+# 連續重複的字元（「好累累累」、「哈哈哈哈」）壓成兩個
+_REPEATS = re.compile(r"(.)\1{2,}")
+
+
+def normalize(text):
+    """ 正規化輸入：全形轉半形、小寫、移除空白與標點符號 """
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = "".join(ch for ch in text if not unicodedata.category(ch).startswith(_NOISE_CATEGORIES))
+    return _REPEATS.sub(r"\1\1", text)
+
+
+def classify_intent(normalized):
+    """ 依關鍵字判斷意圖 """
+    for intent, keywords in INTENT_KEYWORDS:
+        if any(keyword in normalized for keyword in keywords):
+            return intent
+    return DEFAULT_INTENT
+
+
+class CacheLookup:
+    """ 一次查詢的結果；未命中時把它交給 store() 存入回覆，不必重新計算向量 """
+
+    __slots__ = ("bucket", "normalized", "intent", "vector", "reply", "kind")
+
+    def __init__(self, bucket, normalized, intent):
+        self.bucket = bucket
+        self.normalized = normalized
+        self.intent = intent
+        self.vector = None
+        self.reply = None
+        self.kind = None  # "exact" / "semantic"，未命中時為 None
+
+
+class SemanticResponseCache:
+    """
+    以 NumPy 矩陣保存句子向量的回覆快取
+    所有向量放在一個 (max_size, dim) 的矩陣中，查詢時只比對同分組、未過期的列
+    """
+
+    def __init__(self, encode, dim, threshold=0.92, ttl=86400, max_size=5000, max_chars=30, disabled_intents=()):
+        self._encode = encode  # [text] -> (n, dim) float32 單位向量
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_chars = max_chars
+        self.disabled_intents = set(disabled_intents) | ALWAYS_DISABLED_INTENTS
+
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((max_size, dim), dtype=np.float32)
+        self._buckets = np.full(max_size, -1, dtype=np.int64)  # -1 表示空位
+        self._expires_at = np.zeros(max_size, dtype=np.float64)
+        self._last_used = np.zeros(max_size, dtype=np.float64)
+        self._replies = [None] * max_size
+        self._keys = [None] * max_size  # (bucket, normalized)
+        self._exact = {}  # (bucket, normalized) -> slot
+        self._bucket_ids = {}  # bucket -> 整數編號
+
+        self._lookups = 0
+        self._exact_hits = 0
+        self._semantic_hits = 0
+        self._skipped = 0
+        self._stores = 0
+        self._evictions = 0
+        self._intent_lookups = {}
+        self._intent_hits = {}
+
+    def _bucket_id(self, bucket):
+        """ 分組轉成整數編號，方便在矩陣上過濾（呼叫端需持有鎖） """
+        bucket_id = self._bucket_ids.get(bucket)
+        if bucket_id is None:
+            bucket_id = self._bucket_ids[bucket] = len(self._bucket_ids)
+        return bucket_id
+
+    def _cacheable(self, user_input, intent):
+        return len(user_input) <= self.max_chars and intent not in self.disabled_intents
+
+    def lookup(self, user_input, bucket=None):
+        """ 查詢快取，回傳 CacheLookup；不適合快取的訊息回傳 None（未指定分組時以意圖分組） """
+        normalized = normalize(user_input)
+        intent = classify_intent(normalized)
+        if not normalized or not self._cacheable(user_input, intent):
+            with self._lock:
+                self._skipped += 1
+            return None
+        if bucket is None:
+            bucket = intent
+
+        result = CacheLookup(bucket, normalized, intent)
+        now = time.monotonic()
+        with self._lock:
+            self._lookups += 1
+            self._intent_lookups[intent] = self._intent_lookups.get(intent, 0) + 1
+            slot = self._exact.get((bucket, normalized))
+            if slot is not None and self._expires_at[slot] > now:
+                return self._hit(result, slot, "exact", now)
+
+        # 在鎖外計算向量
+        result.vector = self._encode([normalized])[0]
+
+        with self._lock:
+            bucket_id = self._bucket_ids.get(bucket)
+            if bucket_id is None:
+                return result
+            candidates = np.flatnonzero((self._buckets == bucket_id) & (self._expires_at > now))
+            if candidates.size == 0:
+                return result
+            similarities = self._vectors[candidates] @ result.vector
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                return self._hit(result, int(candidates[best]), "semantic", now)
+        return result
+
+    def _hit(self, result, slot, kind, now):
+        """ 記錄命中（呼叫端需持有鎖） """
+        self._last_used[slot] = now
+        result.reply = self._replies[slot]
+        result.kind = kind
+        if kind == "exact":
+            self._exact_hits += 1
+        else:
+            self._semantic_hits += 1
+        self._intent_hits[result.intent] = self._intent_hits.get(result.intent, 0) + 1
+        return result
+
+    def store(self, result, reply):
+        """ 存入未命中查詢的 GPT 回覆 """
+        if result is None or result.kind is not None or not reply:
+            return
+        if result.vector is None:
+            result.vector = self._encode([result.normalized])[0]
+
+        now = time.monotonic()
+        key = (result.bucket, result.normalized)
+        with self._lock:
+            slot = self._exact.get(key)
+            if slot is None:
+                slot = self._free_slot(now)
+            self._vectors[slot] = result.vector
+            self._buckets[slot] = self._bucket_id(result.bucket)
+            self._expires_at[slot] = now + self.ttl
+            self._last_used[slot] = now
+            self._replies[slot] = reply
+            self._keys[slot] = key
+            self._exact[key] = slot
+            self._stores += 1
+
+    def _free_slot(self, now):
+        """ 找空位或過期的位置，都沒有就淘汰最久沒用到的一筆（呼叫端需持有鎖） """
+        free = np.flatnonzero((self._buckets < 0) | (self._expires_at <= now))
+        if free.size:
+            slot = int(free[0])
+        else:
+            slot = int(np.argmin(self._last_used))
+            self._evictions += 1
+        old_key = self._keys[slot]
+        if old_key is not None:
+            self._exact.pop(old_key, None)
+            self._keys[slot] = None
+            self._replies[slot] = None
+            self._buckets[slot] = -1
+        return slot
+
+    def set_intent_enabled(self, intent, enabled):
+        """ 個別開關某個意圖的快取（例如發現某類回覆不適合共用時立即關閉） """
+        if enabled and intent in ALWAYS_DISABLED_INTENTS:
+            logger.warning("回覆快取：%s 意圖不能開啟", intent)
+            return
+        with self._lock:
+            if enabled:
+                self.disabled_intents.discard(intent)
+            else:
+                self.disabled_intents.add(intent)
+                self._drop_intent(intent)
+        logger.info("回覆快取：%s 意圖已%s", intent, "開啟" if enabled else "關閉")
+
+    def set_disabled_intents(self, intents):
+        """ 以新的清單取代停用的意圖（清單檔重新載入時使用；ALWAYS_DISABLED_INTENTS 一律保留） """
+        intents = set(intents) | ALWAYS_DISABLED_INTENTS
+        with self._lock:
+            current = set(self.disabled_intents)
+        for intent in current - intents:
+            self.set_intent_enabled(intent, True)
+        for intent in intents - current:
+            self.set_intent_enabled(intent, False)
+
+    def _drop_intent(self, intent):
+        """ 清掉某個意圖已快取的回覆（呼叫端需持有鎖） """
+        for key, slot in list(self._exact.items()):
+            if classify_intent(key[1]) == intent:
+                del self._exact[key]
+                self._keys[slot] = None
+                self._replies[slot] = None
+                self._buckets[slot] = -1
+
+    def stats(self):
+        with self._lock:
+            hits = self._exact_hits + self._semantic_hits
+            return {
+                "size": len(self._exact),
+                "lookups": self._lookups,
+                "exact_hits": self._exact_hits,
+                "semantic_hits": self._semantic_hits,
+                "hit_rate": hits / self._lookups if self._lookups else 0.0,
+                "skipped": self._skipped,
+                "stores": self._stores,
+                "evictions": self._evictions,
+                "disabled_intents": sorted(self.disabled_intents),
+                "intents": {
+                    intent: {"lookups": count, "hits": self._intent_hits.get(intent, 0)}
+                    for intent, count in self._intent_lookups.items()
+                },
+            }
@@ -0,0 +1,125 @@
+"""
+基本資料填寫流程（profile wizard）的進度儲存
+
+進度只是一個小整數（目前在第幾步），每筆資料都很精簡，並在 TTL 後過期
+- memory：行程內 dict，測試或單一 worker 使用
+- mysql：存在 profile_wizard_state 表，多個 worker 與重啟後都能接續
+- shared：存在 core/cache.py 設定的共用快取後端
+"""
+import threading
+import time
+from core.cache import get_shared_backend
+from core.database import get_db_connection
+
+
+class InMemorySessionStore:
+    """ 行程內的進度儲存 """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._steps = {}  # user_id -> (step, expires_at)
+        self._lock = threading.Lock()
+        self._next_purge = time.monotonic() + ttl
+
+    def get(self, user_id):
+        with self._lock:
+            item = self._steps.get(user_id)
+            if item is None:
+                return None
+            step, expires_at = item
+            if time.monotonic() > expires_at:
+                del self._steps[user_id]
+                return None
+            return step
+
+    def set(self, user_id, step):
+        now = time.monotonic()
+        with self._lock:
+            self._steps[user_id] = (step, now + self.ttl)
+            if now > self._next_purge:
+                # 定期清掉過期的進度，避免放棄填寫的用戶一直佔記憶體
+                self._steps = {k: v for k, v in self._steps.items() if v[1] > now}
+                self._next_purge = now + self.ttl
+
+    def delete(self, user_id):
+        with self._lock:
+            self._steps.pop(user_id, None)
+
+
+class MySQLSessionStore:
+    """ 存在 MySQL 的進度儲存（profile_wizard_state 表，由 core/migrations.py 建立） """
+
+    def __init__(self, ttl):
+        self.ttl = int(ttl)
+
+    def get(self, user_id):
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT step FROM profile_wizard_state
+                WHERE user_id = %s AND expires_at > UNIX_TIMESTAMP()
+            """, (user_id,))
+            result = cursor.fetchone()
+        finally:
+            conn.close()
+        return result[0] if result else None
+
+    def set(self, user_id, step):
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO profile_wizard_state (user_id, step, expires_at)
+                VALUES (%s, %s, UNIX_TIMESTAMP() + %s)
+                ON DUPLICATE KEY UPDATE step = VALUES(step), expires_at = VALUES(expires_at)
+            """, (user_id, step, self.ttl))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def delete(self, user_id):
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM profile_wizard_state WHERE user_id = %s", (user_id,))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+class SharedCacheSessionStore:
+    """ 存在共用快取後端（Config.CACHE_SHARED_BACKEND）的進度儲存 """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._backend = get_shared_backend()
+        if self._backend is None:
+            raise ValueError("SESSION_BACKEND=shared 需要設定 CACHE_SHARED_BACKEND")
+
+    def _key(self, user_id):
+        return f"wizard:{user_id}"
+
+    def get(self, user_id):
+        found, step = self._backend.get(self._key(user_id))
+        return step if found else None
+
+    def set(self, user_id, step):
+        self._backend.set(self._key(user_id), step, self.ttl)
+
+    def delete(self, user_id):
+        self._backend.delete(self._key(user_id))
+
+
+SESSION_STORES = {
+    "memory": InMemorySessionStore,
+    "mysql": MySQLSessionStore,
+    "shared": SharedCacheSessionStore,
+}
+
+
+def create_session_store(name, ttl):
+    """ 依名稱建立進度儲存 """
+    if name not in SESSION_STORES:
+        raise ValueError(f"未知的進度儲存：{name}（可用：{', '.join(SESSION_STORES)}）")
+    return SESSION_STORES[name](ttl)
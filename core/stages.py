@@ -0,0 +1,88 @@
+"""
+每個處理階段（consent、profile、emotion、gpt、persist…）的耗時、CPU 時間與資料庫查詢次數
+
+    with stage("consent"):
+        ...
+
+CPU 時間與查詢次數只計算目前執行緒（在背景事件迴圈中的 I/O 不算在內）
+耗時同時記在累計直方圖，由 /metrics 以 Prometheus 格式輸出（見 routes/metrics.py）
+"""
+import threading
+import time
+from contextlib import contextmanager
+from core.db_pool import thread_query_count
+from utils.stats import Histogram, LatencyWindow
+
+
+class StageStats:
+    """ 單一階段的累計數據 """
+
+    def __init__(self):
+        self.latency = LatencyWindow()
+        self.histogram = Histogram()
+        self.cpu_time = 0.0
+        self.queries = 0
+        self.errors = 0
+
+    def summary(self):
+        summary = self.latency.summary()
+        count = summary["count"]
+        summary.update({
+            "cpu_ms_avg": self.cpu_time / count * 1000 if count else 0.0,
+            "queries_avg": self.queries / count if count else 0.0,
+            "queries": self.queries,
+            "errors": self.errors,
+        })
+        return summary
+
+
+_stages = {}
+_lock = threading.Lock()
+
+def _get(name):
+    stats = _stages.get(name)
+    if stats is None:
+        with _lock:
+            stats = _stages.setdefault(name, StageStats())
+    return stats
+
+@contextmanager
+def stage(name):
+    """ 記錄一個階段的耗時、CPU 時間與查詢次數 """
+    started_at = time.perf_counter()
+    cpu_started = time.thread_time()
+    queries_started = thread_query_count()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        stats = _get(name)
+        elapsed = time.perf_counter() - started_at
+        stats.latency.add(elapsed)
+        stats.histogram.observe(elapsed)
+        with _lock:
+            stats.cpu_time += time.thread_time() - cpu_started
+            stats.queries += thread_query_count() - queries_started
+            stats.errors += failed
+
+def stage_stats():
+    """ 各階段的統計摘要 """
+    with _lock:
+        stages = dict(_stages)
+    return {name: stats.summary() for name, stats in stages.items()}
+
+def stage_histograms():
+    """ 各階段的 (直方圖, CPU 秒數, 查詢次數, 錯誤次數)，輸出 /metrics 用 """
+    with _lock:
+        return {
+            name: (stats.histogram, stats.cpu_time, stats.queries, stats.errors)
+            for name, stats in _stages.items()
+        }
+
+def reset_stage_stats():
+    """ 清除統計（壓力測試每輪開始前呼叫） """
+    with _lock:
+        _stages.clear()
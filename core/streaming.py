@@ -0,0 +1,75 @@
+import re
+import time
+from core.config import Config
+from services.line import PushStream, reply_message
+from services.line_client import LineApiError
+from utils.logger import logger
+
+# 句尾符號：切段只在這些位置切，避免把一句話拆成兩則訊息
+SENTENCE_END = re.compile(r"[。！？!?…~～\n]+")
+
+def split_segments(deltas, first_min_chars, min_chars):
+    """
+    把串流進來的文字片段，在句尾切成訊息段落
+    第一段只要 `first_min_chars` 字就送出（越快回覆越好），之後每段至少 `min_chars` 字
+    """
+    buffer = ""
+    min_len = first_min_chars
+    for delta in deltas:
+        buffer += delta
+        while True:
+            cut = next((m.end() for m in SENTENCE_END.finditer(buffer) if m.end() >= min_len), None)
+            if cut is None:
+                break
+            segment, buffer = buffer[:cut].strip(), buffer[cut:]
+            if segment:
+                yield segment
+                min_len = min_chars
+    if buffer.strip():
+        yield buffer.strip()
+
+def reply_streaming(reply_token, user_id, deltas, received_at):
+    """
+    邊生成邊回覆：第一段用 reply token 回覆，之後的段落用 push 發送
+    - 超過 REPLY_LATENCY_BUDGET 秒才產生第一段時，reply token 可能已失效，直接改用 push
+    - reply token 被拒（過期或已使用）時也改用 push；其他錯誤已由用戶端以同一個 retry key 重試過，
+      仍失敗時不改用 push（回覆可能其實已送出，改用 push 會重複），直接拋出
+    - push 在背景送出，不等 LINE 回應就繼續讀 GPT 的輸出；送出期間累積的段落合併成一個請求
+    回傳完整回覆文字（用於存檔）
+    """
+    segments = []
+    first_sent_at = None
+    use_reply = True
+    pushes = PushStream(user_id)
+
+    for segment in split_segments(deltas, Config.STREAM_FIRST_MIN_CHARS, Config.STREAM_SEGMENT_MIN_CHARS):
+        segments.append(segment)
+
+        if first_sent_at is None:
+            if time.time() - received_at > Config.REPLY_LATENCY_BUDGET:
+                use_reply = False
+            if use_reply:
+                try:
+                    reply_message(reply_token, segment)
+                except LineApiError as e:
+                    if not e.invalid_reply_token:
+                        raise
+                    logger.warning("reply token 無法使用，改用 push：%s", e)
+                    use_reply = False
+            if not use_reply:
+                pushes.send(segment)
+            first_sent_at = time.time()
+        else:
+            pushes.send(segment)
+
+    pushes.close()
+
+    logger.info(
+        "回覆完成（%s）：首則訊息 %.2f 秒，總計 %.2f 秒，%d 段，%s",
+        user_id,
+        (first_sent_at or time.time()) - received_at,
+        time.time() - received_at,
+        len(segments),
+        "reply" if use_reply else "push"
+    )
+    return "\n".join(segments)
@@ -0,0 +1,66 @@
+import re
+import threading
+from utils.logger import logger
+
+# 與 GPT 呼叫相同模型的斷詞器
+TOKENIZER_MODEL = "gpt-4"
+
+# 中日韓文字與全形標點，GPT 的斷詞大約每個字一個 token
+_CJK = re.compile(r"[　-〿㐀-䶿一-鿿豈-﫿＀-￯]")
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+def _get_encoding():
+    """ 載入 tiktoken 斷詞器，沒有安裝或無法載入時回傳 None（改用估算） """
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+                except Exception:
+                    logger.warning("無法載入 tiktoken，改用估算的 token 數")
+                _encoding_loaded = True
+    return _encoding
+
+def estimate_tokens(text):
+    """
+    估算文字的 token 數：中文每字約 1 個 token，其他字元約 4 個字元 1 個 token
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    other = len(text) - cjk
+    return cjk + (other + 3) // 4
+
+def count_tokens(text):
+    """
+    計算文字的 token 數（有 tiktoken 時精確計算，否則估算）
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_tokens(text, max_tokens):
+    """
+    把文字截到 `max_tokens` 個 token 內，回傳 (截斷後的文字, token 數)
+    """
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text, tokens
+    encoding = _get_encoding()
+    if encoding is not None:
+        ids = encoding.encode(text, disallowed_special=())[:max_tokens]
+        text = encoding.decode(ids)
+        return text, count_tokens(text)
+    # 估算模式：依比例截斷後再逐步縮短
+    text = text[:len(text) * max_tokens // tokens]
+    while text and estimate_tokens(text) > max_tokens:
+        text = text[:-1]
+    return text, estimate_tokens(text)
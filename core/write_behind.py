@@ -0,0 +1,286 @@
+"""
+聊天記錄的延遲批次寫入（write-behind）
+
+- submit() 只把資料放進記憶體佇列並寫入本機日誌（append-only），不等資料庫提交
+- 背景執行緒累積到 `batch_size` 筆或每 `flush_interval` 秒，用多筆 INSERT 一次寫入
+- 佇列有上限（`max_pending`），滿了就等背景寫入騰出空間，逾時改為直接同步寫入
+- 日誌保證當機不遺失：每個 worker 寫自己的日誌檔並以 flock 鎖住，
+  啟動時把沒有被任何行程鎖住的日誌（前一次當機留下的）補寫進資料庫
+  （寫入成功但尚未刪除日誌時當機，重啟後會重複寫入該批，屬 at-least-once）
+- 只有暫時性錯誤（連線中斷、鎖等待逾時、死結）會重試；其他錯誤（資料過長、編碼錯誤）重試也不會成功，
+  把該批拆半找出寫不進去的那幾筆，寫進 dead letter 檔（journal 目錄下的 dead_letter.log），其餘照常寫入
+- 關閉時最多再重試 `stop_timeout` 秒；資料庫仍無法使用就放棄，日誌留在磁碟上，下次啟動時補寫
+"""
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from core.stages import stage
+from utils.logger import logger
+
+
+class _FlushAborted(Exception):
+    """ 關閉期間重試逾時，放棄寫入（日誌保留，下次啟動補寫） """
+
+
+class MessageWriter:
+    """ 把聊天記錄累積成批次，在背景以多筆 INSERT 寫入 """
+
+    def __init__(self, insert_rows, journal_dir, batch_size=100, flush_interval=0.5, max_pending=10000, fsync=False,
+                 is_transient=lambda error: True, stop_timeout=30):
+        self._insert_rows = insert_rows  # 一次寫入多筆：[(user_id, sender, message, emotion, timestamp)]
+        self._is_transient = is_transient  # error -> 是否值得重試
+        self.journal_dir = journal_dir
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.fsync = fsync
+        self.stop_timeout = stop_timeout
+
+        self._cond = threading.Condition()
+        self._pending = []
+        self._journal = None
+        self._journal_path = None
+        self._sequence = 0
+        self._thread = None
+        self._stopping = False
+        self._stop_deadline = None
+
+        self._submitted = 0
+        self._flushed = 0
+        self._batches = 0
+        self._sync_fallbacks = 0
+        self._replayed = 0
+        self._dead_letters = 0
+
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        """ 啟動背景寫入；前一次當機留下的日誌由背景執行緒先補寫（資料庫暫時連不上時不阻擋啟動） """
+        os.makedirs(self.journal_dir, exist_ok=True)
+        self._set_aside_stale_journals()
+        with self._cond:
+            self._stopping = False
+            self._stop_deadline = None
+            self._open_journal()
+        self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        寫完佇列中的資料後停止（FastAPI 關閉時呼叫）
+        最多等 `stop_timeout` 秒；沒寫完的資料留在日誌裡，下次啟動時補寫
+        """
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._stop_deadline = time.monotonic() + self.stop_timeout
+            self._cond.notify_all()
+        # 重試的等待不會超過期限，多留一點時間給進行中的 INSERT
+        self._thread.join(self.stop_timeout + 5)
+        finished = not self._thread.is_alive()
+        self._thread = None
+        with self._cond:
+            remove = finished and not self._pending
+            if not remove:
+                logger.warning("關閉時仍有 %d 筆聊天記錄未寫入，保留日誌 %s", len(self._pending), self._journal_path)
+            self._close_journal(remove=remove)
+
+    def _set_aside_stale_journals(self):
+        """
+        同一個 pid 留下的舊日誌（容器重啟後 pid 常常相同）改名，交給背景補寫，
+        不能讓新日誌接著寫進去（正常關閉時新日誌會被刪除）
+        """
+        for path in glob.glob(os.path.join(self.journal_dir, f"journal.{os.getpid()}.*")):
+            try:
+                journal = open(path, "r+", encoding="utf-8")
+            except FileNotFoundError:
+                continue
+            with journal:
+                try:
+                    fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # 其他行程正在使用
+                os.rename(path, f"{path}.{time.time_ns()}.stale")
+
+    def _open_journal(self):
+        """ 開新日誌並加鎖（呼叫端需持有鎖） """
+        self._journal_path = os.path.join(self.journal_dir, f"journal.{os.getpid()}.log")
+        self._journal = open(self._journal_path, "a", encoding="utf-8")
+        fcntl.flock(self._journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _close_journal(self, remove):
+        if self._journal is not None:
+            self._journal.close()
+            if remove:
+                os.remove(self._journal_path)
+            self._journal = None
+
+    def _rotate_journal(self):
+        """
+        把目前的日誌改名成待寫入批次的日誌並換一個新檔（呼叫端需持有鎖）
+        回傳舊日誌的（檔案物件, 路徑），寫入成功後再關閉並刪除
+        """
+        self._sequence += 1
+        flushing_path = os.path.join(self.journal_dir, f"journal.{os.getpid()}.{self._sequence}.flushing")
+        os.rename(self._journal_path, flushing_path)
+        old = (self._journal, flushing_path)  # 仍持有 flock，其他行程不會把它當成孤兒
+        self._open_journal()
+        return old
+
+    def submit(self, user_id, sender, message, emotion=None):
+        """ 送出一筆聊天記錄，立即返回 """
+        row = (user_id, sender, message, emotion, datetime.now().replace(microsecond=0))
+
+        with self._cond:
+            deadline = time.monotonic() + self.flush_interval * 4
+            while len(self._pending) >= self.max_pending and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            if len(self._pending) < self.max_pending and not self._stopping:
+                self._journal.write(json.dumps([*row[:4], row[4].isoformat()], ensure_ascii=False) + "\n")
+                self._journal.flush()
+                if self.fsync:
+                    os.fsync(self._journal.fileno())
+                self._pending.append(row)
+                self._submitted += 1
+                if len(self._pending) >= self.batch_size:
+                    self._cond.notify_all()
+                return
+
+            self._sync_fallbacks += 1
+
+        # 佇列一直是滿的（資料庫太慢）或已經關閉：改為直接寫入，不再累積
+        logger.warning("寫入佇列已滿，改為同步寫入")
+        try:
+            self._insert_rows([row])
+        except Exception as e:
+            # 呼叫端不處理寫入錯誤，保存到 dead letter 檔，不讓這筆遺失
+            self._dead_letter(row, e)
+
+    def _run(self):
+        # 自己的日誌已加鎖，補寫時會略過
+        if not self._replay_orphans():
+            return
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                if not self._pending:
+                    if self._stopping:
+                        return
+                    continue
+                rows, self._pending = self._pending, []
+                journal, path = self._rotate_journal()
+                self._cond.notify_all()  # 佇列騰出空間
+
+            written = self._flush(rows)
+            journal.close()
+            if not written:
+                logger.warning("關閉時資料庫仍無法寫入，保留日誌 %s", path)
+                return
+            os.remove(path)
+
+    def _flush(self, rows):
+        """
+        分批寫入；資料庫暫時無法使用時持續重試（日誌仍保留，當機也不會遺失）
+        關閉期間重試超過期限時放棄並回傳 False（已寫入的批次下次補寫時會重複，屬 at-least-once）
+        """
+        try:
+            for start in range(0, len(rows), self.batch_size):
+                self._write_chunk(rows[start:start + self.batch_size])
+        except _FlushAborted:
+            return False
+        return True
+
+    def _write_chunk(self, chunk):
+        """ 寫入一批；非暫時性錯誤時拆半重寫，最後寫不進去的單筆交給 dead letter 檔 """
+        delay = 0.5
+        while True:
+            try:
+                with stage("persist_flush"):
+                    self._insert_rows(chunk)
+                break
+            except Exception as e:
+                if self._is_transient(e):
+                    deadline = self._stop_deadline
+                    if deadline is not None and time.monotonic() + delay > deadline:
+                        raise _FlushAborted() from e
+                    logger.exception("批次寫入失敗（%d 筆），%.1f 秒後重試", len(chunk), delay)
+                    time.sleep(delay)
+                    delay = min(delay * 2, 30)
+                    continue
+                if len(chunk) == 1:
+                    self._dead_letter(chunk[0], e)
+                    return
+                # 多筆 INSERT 是單一語句，失敗時整批都沒有寫入，拆開重寫不會重複
+                logger.warning("批次寫入失敗（%d 筆）：%r，拆開重寫", len(chunk), e)
+                middle = len(chunk) // 2
+                self._write_chunk(chunk[:middle])
+                self._write_chunk(chunk[middle:])
+                return
+        with self._cond:
+            self._flushed += len(chunk)
+            self._batches += 1
+
+    def _dead_letter(self, row, error):
+        """ 保存無法寫入的一筆（保留原始內容與錯誤，修正後可手動補寫） """
+        user_id, sender, message, emotion, timestamp = row
+        with open(os.path.join(self.journal_dir, "dead_letter.log"), "a", encoding="utf-8") as f:
+            f.write(json.dumps(
+                [user_id, sender, message, emotion, timestamp.isoformat(), repr(error)], ensure_ascii=False
+            ) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        with self._cond:
+            self._dead_letters += 1
+        logger.error("聊天記錄無法寫入，已移到 dead letter 檔（%s）：%r", user_id, error)
+
+    def _replay_orphans(self):
+        """ 補寫沒有行程持有的日誌（前一次當機或未正常關閉留下的）；關閉期間放棄補寫時回傳 False """
+        for path in sorted(glob.glob(os.path.join(self.journal_dir, "journal.*"))):
+            try:
+                journal = open(path, "r+", encoding="utf-8")
+            except FileNotFoundError:
+                continue  # 剛被擁有者改名或刪除
+            with journal:
+                try:
+                    fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # 其他 worker 正在使用
+                rows = []
+                for line in journal:
+                    try:
+                        user_id, sender, message, emotion, timestamp = json.loads(line)
+                    except ValueError:
+                        continue  # 當機時寫到一半的最後一行
+                    rows.append((user_id, sender, message, emotion, datetime.fromisoformat(timestamp)))
+                if rows:
+                    if not self._flush(rows):
+                        logger.warning("關閉時資料庫仍無法寫入，保留日誌 %s", path)
+                        return False
+                    self._replayed += len(rows)
+                    logger.info("已補寫日誌 %s（%d 筆）", path, len(rows))
+                os.remove(path)
+        return True
+
+    def stats(self):
+        with self._cond:
+            return {
+                "pending": len(self._pending),
+                "submitted": self._submitted,
+                "flushed": self._flushed,
+                "batches": self._batches,
+                "avg_batch_size": self._flushed / self._batches if self._batches else 0.0,
+                "sync_fallbacks": self._sync_fallbacks,
+                "replayed": self._replayed,
+                "dead_letters": self._dead_letters,
+            }
@@ -0,0 +1,38 @@
+"""
+壓力測試用的統計端點（只在 BENCH_ENDPOINTS=1 時掛載，見 bench/load_callback.py）
+"""
+import os
+from fastapi import APIRouter
+from core.database import get_pool_stats, get_cache_stats, message_writer
+from core.gpt import gateway
+from core.stages import reset_stage_stats, stage_stats
+from routes.callback import coalescer, deduplicator, pipeline
+from services.line import line_client
+from utils.proc import cpu_seconds
+
+router = APIRouter(prefix="/_bench")
+
+
+@router.get("/stats")
+async def stats():
+    """ 本 worker 的各階段統計、CPU 時間與各元件狀態 """
+    return {
+        "pid": os.getpid(),
+        "cpu_seconds": cpu_seconds(),
+        "stages": stage_stats(),
+        "pipeline": pipeline.stats(),
+        "coalesce": coalescer.stats(),
+        "db_pool": get_pool_stats(),
+        "cache": get_cache_stats(),
+        "write_behind": message_writer.stats(),
+        "dedup": deduplicator.stats(),
+        "gpt": gateway.stats(),
+        "line": line_client.stats(),
+    }
+
+
+@router.post("/reset")
+async def reset():
+    """ 清除各階段統計，每輪壓力測試開始前呼叫 """
+    reset_stage_stats()
+    return {"pid": os.getpid()}
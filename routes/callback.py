@@ -1,34 +1,151 @@
 from fastapi import APIRouter, Request, HTTPException
 from linebot.exceptions import InvalidSignatureError
 from linebot.models import MessageEvent, TextMessage, FollowEvent
-from services.line import handler, reply_message, send_message
-from core.database import create_user_db, save_message, get_user_profile, set_user_profile
+from services.line import parser, reply_message, reply_messages, send_message
+from core.database import create_user_db, check_user_consent, get_user_profile, set_user_profile, is_profile_complete
 from core.consent import check_consent_and_respond
-from core.gpt import chat_with_gpt
+from core.gpt import chat_with_gpt, stream_chat_with_gpt, memory_store
+from core.streaming import reply_streaming
+from core.config import Config
+from core.pipeline import EventPipeline, QueueFullError
+from core.session import create_session_store
+from core.idempotency import SeenEventRing, WebhookDeduplicator, WebhookEventStore
+from core.stages import stage
+from core.profiler import SlowEventProfiler
+from core.coalesce import MessageCoalescer
+from core.crisis import CRISIS_REPLY, CrisisDetector
+import asyncio
 import re
-from core.database import save_message_with_emotion  # 引入新的存儲函數
+from utils.logger import logger
+from core.database import save_message_with_emotion, save_messages_with_emotion  # 引入新的存儲函數
 
 router = APIRouter()
 
-# 記錄用戶資料填寫進度
-user_profile_step = {}
+# 記錄用戶資料填寫進度（可跨 worker 共用，逾時自動過期）
+user_profile_step = create_session_store(Config.SESSION_BACKEND, Config.SESSION_TTL)
+
+# LINE 重送的 webhook 只處理一次
+deduplicator = WebhookDeduplicator(
+    SeenEventRing(Config.IDEMPOTENCY_RING_SIZE, Config.IDEMPOTENCY_TTL),
+    WebhookEventStore(Config.IDEMPOTENCY_TTL) if Config.IDEMPOTENCY_DB else None
+)
+
+# 危機訊號偵測（詞庫在啟動時建成比對自動機）
+crisis_detector = CrisisDetector.from_file(Config.CRISIS_LEXICON) if Config.CRISIS_DETECTION else None
+
+# 處理過慢的事件取樣記錄堆疊（PROFILE_SLOW_EVENTS=1 時啟用）
+profiler = SlowEventProfiler(
+    Config.PROFILE_SLOW_EVENTS,
+    threshold=Config.PROFILE_SLOW_THRESHOLD,
+    interval=Config.PROFILE_SAMPLE_INTERVAL
+)
+
+def _is_new(event):
+    """ 其他 worker 已處理過的重送事件，在存檔、分析、呼叫 GPT 之前就略過 """
+    if deduplicator.check_shared(event):
+        logger.info("略過其他 worker 已處理的 webhook 事件：%s", event.webhook_event_id)
+        return False
+    return True
+
+def dispatch_event(event):
+    """
+    依事件類型交給對應的處理函式（在事件管線的 worker 執行緒中執行）
+    合併後的連續文字訊息以列表送進來
+    """
+    if isinstance(event, list):
+        events = [item for item in event if _is_new(item)]
+        if events:
+            with profiler.track("message"), stage("event"):
+                handle_messages(events)
+        return
+
+    if not _is_new(event):
+        return
+
+    with profiler.track(event.type), stage("event"):
+        if isinstance(event, FollowEvent):
+            handle_follow(event)
+        elif isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
+            handle_message(event)
+
+# 事件處理管線：收到 webhook 後立即回應 LINE，事件交給背景 worker 處理
+pipeline = EventPipeline(
+    dispatch_event,
+    workers=Config.EVENT_WORKERS,
+    queue_size=Config.EVENT_QUEUE_SIZE,
+    enqueue_timeout=Config.EVENT_ENQUEUE_TIMEOUT,
+    stats_interval=Config.PIPELINE_STATS_INTERVAL
+)
+
+def reject_messages(events):
+    """
+    合併的訊息送不進管線時的備援（webhook 已回應 200，LINE 不會重送）：
+    有危機訊號時照樣回覆求助資源；否則已同意隱私政策的用戶先存檔，再回覆忙碌訊息請用戶稍後再說
+    """
+    user_id = events[0].source.user_id
+    if crisis_detector is not None and any(crisis_detector.match(event.message.text) for event in events):
+        reply_messages(events[-1].reply_token, user_id, [CRISIS_REPLY])
+        return
+    if check_user_consent(user_id):
+        save_messages_with_emotion(user_id, "user", [event.message.text.strip() for event in events])
+    reply_message(events[-1].reply_token, Config.GPT_FALLBACK_REPLY)
+
+async def _reject_coalesced(user_id, events):
+    await asyncio.get_running_loop().run_in_executor(None, reject_messages, events)
+
+# 同一用戶連續傳來的文字訊息，安靜一段時間後才合併成一輪送進管線（MESSAGE_COALESCE=1 時啟用）
+coalescer = MessageCoalescer(
+    pipeline.submit,
+    _reject_coalesced,
+    quiet_period=Config.MESSAGE_COALESCE_QUIET,
+    max_wait=Config.MESSAGE_COALESCE_MAX_WAIT,
+    max_messages=Config.MESSAGE_COALESCE_MAX_MESSAGES
+)
+
+def _is_text_message(event):
+    return isinstance(event, MessageEvent) and isinstance(event.message, TextMessage)
 
 @router.post("/callback")
 async def callback(request: Request):
     """
-    Line Webhook 接收請求
+    Line Webhook 接收請求：驗證簽章後把事件放入佇列（文字訊息先等待合併），立即回應 200
     """
     signature = request.headers.get("X-Line-Signature")
     body = await request.body()
 
     try:
-        handler.handle(body.decode(), signature)
+        events = parser.parse(body.decode(), signature)
     except InvalidSignatureError:
         raise HTTPException(status_code=400, detail="Invalid signature")
 
+    for event in events:
+        # 已處理過的重送事件不放進佇列
+        if deduplicator.check_local(event):
+            logger.info("略過已處理的 webhook 事件：%s", event.webhook_event_id)
+            continue
+        user_id = getattr(event.source, "user_id", None)
+        if Config.MESSAGE_COALESCE and user_id and _is_text_message(event):
+            if pipeline.full(user_id):
+                # 合併後才送進佇列，送不進去時已無法回應 503，所以在這裡先擋
+                deduplicator.forget(event)
+                raise HTTPException(status_code=503, detail="Server busy")
+            await coalescer.add(user_id, event)
+            if crisis_detector is not None and crisis_detector.match(event.message.text, count=False):
+                # 危機訊號不等安靜期，連同緩衝中的訊息立即送出
+                await coalescer.flush(user_id)
+            continue
+        try:
+            # 同一用戶還在等待合併的訊息先送出，保持順序
+            await coalescer.flush(user_id)
+            # 以 user_id 分配 worker，確保同一用戶的訊息依序處理
+            await pipeline.submit(user_id, event)
+        except QueueFullError:
+            # 回應 503 讓 LINE 稍後重送（這個事件沒有處理，重送時不能當成重複）
+            deduplicator.forget(event)
+            raise HTTPException(status_code=503, detail="Server busy")
+
     return {"message": "OK"}
 
-@handler.add(FollowEvent)
 def handle_follow(event):
     """
     當用戶加入好友時，建立專屬資料表，並發送隱私政策
@@ -59,77 +176,135 @@ def handle_follow(event):
     )
     send_message(user_id, welcome_text)
 
-from core.database import create_user_db, save_message, get_user_profile, set_user_profile
-import re
-
-# 用戶資料收集步驟
-user_profile_step = {}
-
-@handler.add(MessageEvent, message=TextMessage)
 def handle_message(event):
     """
     處理用戶的文字訊息，並檢查基本資料是否完整
     """
-    user_id = event.source.user_id
-    user_message = event.message.text.strip()
+    handle_messages([event])
 
-    # 確保用戶資料表已存在
-    create_user_db(user_id)
+def handle_messages(events):
+    """
+    處理同一用戶依序傳來的一則或多則文字訊息
+    - 任一則有危機訊號時，直接回覆求助資源
+    - 同意隱私政策、填寫基本資料的步驟逐則處理（每則訊息都是一個回答）
+    - 其餘的訊息合併成一輪對話：一起存檔、呼叫一次 GPT，以最後一則的 reply token 回覆
+    """
+    user_id = events[0].source.user_id
 
-    # 檢查是否已同意隱私政策
-    consent_reply = check_consent_and_respond(user_id, user_message)
-    if consent_reply:
-        reply_message(event.reply_token, consent_reply)
-        return
+    # 危機訊號優先於同意流程與其他處理：不存檔、不呼叫模型，立即回覆求助資源
+    if crisis_detector is not None:
+        with stage("crisis"):
+            crisis = next(filter(None, (crisis_detector.match(event.message.text) for event in events)), None)
+        if crisis is not None:
+            logger.warning("偵測到危機訊號（%s，分類 %s），立即回覆求助資源", user_id, crisis.category)
+            reply_messages(events[-1].reply_token, user_id, [CRISIS_REPLY])
+            return
 
-    # 檢查用戶基本資料
-    user_profile = get_user_profile(user_id)
+    remaining = list(events)
+    while remaining:
+        event = remaining[0]
+        user_message = event.message.text.strip()
 
-    if not user_profile or not user_profile.get("name") or not user_profile.get("birth_date") or not user_profile.get("interests") or not user_profile.get("mood"):
-        if user_id not in user_profile_step:
-            user_profile_step[user_id] = 1
-            reply_message(event.reply_token, "歡迎回來！為了讓我更認識你，請告訴我你的名字 😊")
-            return
+        with stage("consent"):
+            # 確保用戶資料表已存在（已知的用戶走快取）
+            create_user_db(user_id)
 
-        # 填寫名字
-        if user_profile_step[user_id] == 1:
-            set_user_profile(user_id, name=user_message)
-            user_profile_step[user_id] = 2
-            reply_message(event.reply_token, "請輸入你的出生年月日（格式：YYYY-MM-DD）")
-            return
+            # 檢查是否已同意隱私政策
+            consent_reply = check_consent_and_respond(user_id, user_message)
+            if consent_reply:
+                reply_messages(event.reply_token, user_id, consent_reply)
+                remaining.pop(0)
+                continue
 
-        # 填寫出生年月日
-        if user_profile_step[user_id] == 2:
-            if re.match(r'^\d{4}-\d{2}-\d{2}$', user_message):
-                set_user_profile(user_id, birth_date=user_message)
-                user_profile_step[user_id] = 3
-                reply_message(event.reply_token, "你有什麼興趣或喜歡的活動嗎？")
-            else:
-                reply_message(event.reply_token, "請輸入正確的出生年月日格式，例如：1999-05-20 🙏")
-            return
+        with stage("profile"):
+            if handle_profile_step(event, user_id, user_message):
+                remaining.pop(0)
+                continue
+        break
 
-        # 填寫興趣
-        if user_profile_step[user_id] == 3:
-            set_user_profile(user_id, interests=user_message)
-            user_profile_step[user_id] = 4
-            reply_message(event.reply_token, "最後，你現在的心情如何？😊")
-            return
+    if not remaining:
+        return
 
-        # 填寫心情
-        if user_profile_step[user_id] == 4:
-            set_user_profile(user_id, mood=user_message)
-            del user_profile_step[user_id]
-            reply_message(event.reply_token, "感謝你告訴我這些資訊！現在我們可以開始聊天了 😊")
-            return
+    user_messages = [event.message.text.strip() for event in remaining]
+    user_message = "\n".join(user_messages)
+    last_event = remaining[-1]
+
+    # 儲存用戶消息（情緒由背景的情緒標記批次補上）
+    with stage("persist"):
+        save_messages_with_emotion(user_id, "user", user_messages)
+        memory_store.record_writes(user_id, len(user_messages))
+
+    if Config.STREAM_REPLY:
+        # GPT-4 邊生成邊回應用戶（第一段 reply，之後的段落 push）
+        with stage("gpt"):
+            gpt_response = reply_streaming(
+                last_event.reply_token, user_id, stream_chat_with_gpt(user_id, user_message),
+                last_event.timestamp / 1000
+            )
 
-    # 儲存用戶消息並記錄情緒
-    save_message_with_emotion(user_id, "user", user_message)
+        # 儲存 GPT 回應
+        with stage("persist"):
+            save_message_with_emotion(user_id, "bot", gpt_response)
+            memory_store.record_writes(user_id)
+        return
 
     # GPT-4 回應
-    gpt_response = chat_with_gpt(user_id, user_message)
+    with stage("gpt"):
+        gpt_response = chat_with_gpt(user_id, user_message)
 
     # 儲存 GPT 回應
-    save_message_with_emotion(user_id, "bot", gpt_response)
+    with stage("persist"):
+        save_message_with_emotion(user_id, "bot", gpt_response)
+        memory_store.record_writes(user_id)
 
     # 回應用戶
-    reply_message(event.reply_token, gpt_response)
+    reply_message(last_event.reply_token, gpt_response)
+
+def handle_profile_step(event, user_id, user_message):
+    """
+    基本資料未填完時，依進度詢問下一個欄位；有回覆用戶（本則訊息已處理完）時回傳 True
+    """
+    # 檢查用戶基本資料
+    user_profile = get_user_profile(user_id)
+
+    if is_profile_complete(user_profile):
+        return False
+
+    step = user_profile_step.get(user_id)
+    if step is None:
+        user_profile_step.set(user_id, 1)
+        reply_message(event.reply_token, "歡迎回來！為了讓我更認識你，請告訴我你的名字 😊")
+        return True
+
+    # 填寫名字
+    if step == 1:
+        set_user_profile(user_id, name=user_message)
+        user_profile_step.set(user_id, 2)
+        reply_message(event.reply_token, "請輸入你的出生年月日（格式：YYYY-MM-DD）")
+        return True
+
+    # 填寫出生年月日
+    if step == 2:
+        if re.match(r'^\d{4}-\d{2}-\d{2}$', user_message):
+            set_user_profile(user_id, birth_date=user_message)
+            user_profile_step.set(user_id, 3)
+            reply_message(event.reply_token, "你有什麼興趣或喜歡的活動嗎？")
+        else:
+            reply_message(event.reply_token, "請輸入正確的出生年月日格式，例如：1999-05-20 🙏")
+        return True
+
+    # 填寫興趣
+    if step == 3:
+        set_user_profile(user_id, interests=user_message)
+        user_profile_step.set(user_id, 4)
+        reply_message(event.reply_token, "最後，你現在的心情如何？😊")
+        return True
+
+    # 填寫心情
+    if step == 4:
+        set_user_profile(user_id, mood=user_message)
+        user_profile_step.delete(user_id)
+        reply_message(event.reply_token, "感謝你告訴我這些資訊！現在我們可以開始聊天了 😊")
+        return True
+
+    return False
@@ -0,0 +1,62 @@
+"""
+健康檢查端點
+
+- /healthz（liveness）：行程還活著、event loop 沒有卡住就回 200，不碰資料庫與模型；
+  資料庫暫時連不上時不應該讓容器被重啟
+- /readyz（readiness）：可以開始接流量時才回 200，否則回 503 並列出尚未就緒的項目
+  - database：資料庫查得到，且結構已遷移到最新版本（python -m core.migrations）
+  - db_pool：連線池已預先建立連線（DB_POOL_WARM=0 時不檢查）
+  - models：情緒分析模型已載入並預熱（MODEL_WARMUP=0 時改為第一次使用才載入，不檢查）
+  - pipeline / write_behind：背景 worker 已啟動
+"""
+import asyncio
+import os
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from core.config import Config
+from core.database import is_pool_warm, message_writer
+from core.migrations import LATEST_VERSION, current_version
+from core.models import is_ready as models_ready
+from routes.callback import pipeline
+from utils.proc import process_uptime
+
+router = APIRouter()
+
+
+async def _check_database():
+    try:
+        version = await asyncio.wait_for(
+            asyncio.get_running_loop().run_in_executor(None, current_version), Config.HEALTH_CHECK_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        return False, f"超過 {Config.HEALTH_CHECK_TIMEOUT} 秒沒有回應"
+    except Exception as e:
+        return False, str(e)
+    if version < LATEST_VERSION:
+        return False, f"結構版本 {version}，需要 {LATEST_VERSION}（執行 python -m core.migrations）"
+    return True, f"結構版本 {version}"
+
+
+@router.get("/healthz")
+async def healthz():
+    return {"status": "ok", "pid": os.getpid(), "uptime_seconds": process_uptime()}
+
+
+@router.get("/readyz")
+async def readyz():
+    checks = {"database": await _check_database()}
+    if Config.DB_POOL_WARM > 0:
+        checks["db_pool"] = (is_pool_warm(), "已預熱" if is_pool_warm() else "預熱中")
+    if Config.MODEL_WARMUP:
+        checks["models"] = (models_ready(), "已載入" if models_ready() else "載入中")
+    checks["pipeline"] = (pipeline.running(), "執行中" if pipeline.running() else "未啟動")
+    if Config.WRITE_BEHIND:
+        checks["write_behind"] = (message_writer.running(), "執行中" if message_writer.running() else "未啟動")
+
+    ready = all(ok for ok, _ in checks.values())
+    body = {
+        "status": "ready" if ready else "not_ready",
+        "pid": os.getpid(),
+        "checks": {name: {"ok": ok, "detail": detail} for name, (ok, detail) in checks.items()},
+    }
+    return JSONResponse(body, status_code=200 if ready else 503)
@@ -0,0 +1,118 @@
+"""
+Prometheus 格式的 /metrics（METRICS_ENDPOINT=1 時掛載）
+
+- lume_stage_duration_seconds：各處理階段（consent、profile、persist、gpt、line_reply、emotion…）的延遲直方圖
+- lume_stage_cpu_seconds_total / lume_stage_queries_total / lume_stage_errors_total：各階段的累計 CPU 時間、查詢次數、錯誤次數
+- lume_<元件>_<欄位>：各元件 stats() 的數值（巢狀欄位以 "_" 連接，字串值輸出成 {value="..."} 1）
+
+數值只屬於本 worker 行程，多 worker 時由 Prometheus 分別抓取（或在前面加上 pid 標籤彙總）
+"""
+import os
+import re
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from core.database import get_pool_stats, get_cache_stats, message_writer
+from core.emotion import batcher as emotion_batcher
+from core.gpt import gateway, memory_store, prompt_builder, response_cache
+from core.stages import stage_histograms
+from routes.callback import coalescer, crisis_detector, deduplicator, pipeline, profiler
+from services.line import line_client
+from utils.proc import cpu_seconds, current_rss_mb
+
+router = APIRouter()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _name(*parts):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", "_".join(parts))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def _stage_lines():
+    lines = [
+        "# HELP lume_stage_duration_seconds 各處理階段的耗時",
+        "# TYPE lume_stage_duration_seconds histogram",
+    ]
+    totals = {"cpu_seconds": [], "queries": [], "errors": []}
+    for name, (histogram, cpu_time, queries, errors) in sorted(stage_histograms().items()):
+        label = _escape(name)
+        buckets, total, count = histogram.snapshot()
+        for bound, cumulative in buckets:
+            lines.append(f'lume_stage_duration_seconds_bucket{{stage="{label}",le="{_format_value(bound)}"}} {cumulative}')
+        lines.append(f'lume_stage_duration_seconds_sum{{stage="{label}"}} {_format_value(total)}')
+        lines.append(f'lume_stage_duration_seconds_count{{stage="{label}"}} {count}')
+        totals["cpu_seconds"].append((label, cpu_time))
+        totals["queries"].append((label, queries))
+        totals["errors"].append((label, errors))
+
+    for key, values in totals.items():
+        lines.append(f"# TYPE lume_stage_{key}_total counter")
+        lines.extend(f'lume_stage_{key}_total{{stage="{label}"}} {_format_value(value)}' for label, value in values)
+    return lines
+
+
+def _flatten(prefix, stats, lines):
+    """ 元件的 stats() 轉成 gauge（巢狀 dict 展開，列表略過） """
+    for key, value in stats.items():
+        name = _name(prefix, key)
+        if isinstance(value, dict):
+            _flatten(name, value, lines)
+        elif isinstance(value, bool):
+            lines.extend((f"# TYPE {name} gauge", f"{name} {int(value)}"))
+        elif isinstance(value, (int, float)):
+            lines.extend((f"# TYPE {name} gauge", f"{name} {_format_value(value)}"))
+        elif isinstance(value, str):
+            lines.extend((f"# TYPE {name} gauge", f'{name}{{value="{_escape(value)}"}} 1'))
+
+
+def _component_stats():
+    stats = {
+        "pipeline": pipeline.stats(),
+        "coalesce": coalescer.stats(),
+        "db_pool": get_pool_stats(),
+        "cache": get_cache_stats(),
+        "write_behind": message_writer.stats(),
+        "dedup": deduplicator.stats(),
+        "emotion_batcher": emotion_batcher.stats(),
+        "gpt": gateway.stats(),
+        "prompt": prompt_builder.stats(),
+        "memory": memory_store.stats(),
+        "line": line_client.stats(),
+        "profiler": profiler.stats(),
+    }
+    if response_cache is not None:
+        stats["response_cache"] = response_cache.stats()
+    if crisis_detector is not None:
+        stats["crisis"] = crisis_detector.stats()
+    return stats
+
+
+def render_metrics():
+    """ 本 worker 的所有指標（Prometheus text exposition format） """
+    lines = [
+        "# TYPE lume_process_cpu_seconds_total counter",
+        f"lume_process_cpu_seconds_total {_format_value(cpu_seconds())}",
+        "# TYPE lume_process_resident_memory_bytes gauge",
+        f"lume_process_resident_memory_bytes {_format_value(current_rss_mb() * 1024 * 1024)}",
+        "# TYPE lume_process_pid gauge",
+        f"lume_process_pid {os.getpid()}",
+    ]
+    lines.extend(_stage_lines())
+    for component, stats in _component_stats().items():
+        _flatten("lume_" + component, stats, lines)
+    return "\n".join(lines) + "\n"
+
+
+@router.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type=CONTENT_TYPE)
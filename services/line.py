@@ -1,12 +1,63 @@
-from linebot import LineBotApi, WebhookHandler
-from linebot.models import TextSendMessage
+import asyncio
+from linebot import WebhookParser
 from core.config import Config
+from core.stages import stage
+from services.line_client import LineClient, PushCoalescer
+from utils.loop import get_loop, run_sync
 
-line_bot_api = LineBotApi(Config.CHANNEL_ACCESS_TOKEN)
-handler = WebhookHandler(Config.CHANNEL_SECRET)
+# async 用戶端在背景事件迴圈中執行，所有 worker 執行緒共用同一個連線池
+line_client = LineClient(
+    Config.CHANNEL_ACCESS_TOKEN,
+    base_url=Config.LINE_API_BASE_URL,
+    max_connections=Config.LINE_MAX_CONNECTIONS,
+    timeout=Config.LINE_TIMEOUT,
+    rate_limit=Config.LINE_RATE_LIMIT,
+    multicast_rate_limit=Config.LINE_MULTICAST_RATE_LIMIT,
+    max_retries=Config.LINE_MAX_RETRIES
+)
+parser = WebhookParser(Config.CHANNEL_SECRET)
 
 def send_message(user_id, text):
-    line_bot_api.push_message(user_id, TextSendMessage(text=text))
+    send_messages(user_id, [text])
+
+def send_messages(user_id, texts):
+    """ push 多則訊息給同一用戶（每 5 則合成一個請求） """
+    with stage("line_push"):
+        run_sync(line_client.push(user_id, texts))
 
 def reply_message(reply_token, text):
-    line_bot_api.reply_message(reply_token, TextSendMessage(text=text))
+    with stage("line_reply"):
+        run_sync(line_client.reply(reply_token, None, [text]))
+
+def reply_messages(reply_token, user_id, texts):
+    """ 一次回覆多則訊息（最多 5 則，其餘 push 給 `user_id`） """
+    with stage("line_reply"):
+        run_sync(line_client.reply(reply_token, user_id, texts))
+
+def multicast_message(user_ids, text):
+    """ 同一則訊息發給多位用戶 """
+    run_sync(line_client.multicast(user_ids, [text]))
+
+
+class PushStream:
+    """
+    邊產生邊 push 的訊息（例如串流回覆的後續段落）
+    send() 立即返回；前一個 push 還在送時進來的段落會合併成同一個請求
+    """
+
+    def __init__(self, user_id):
+        self._coalescer = PushCoalescer(line_client, user_id)
+
+    def send(self, text):
+        get_loop().call_soon_threadsafe(self._coalescer.add, text)
+
+    def close(self):
+        """ 等所有段落送出，回傳失敗的錯誤列表 """
+        with stage("line_push"):
+            run_sync(self._wait())
+        return self._coalescer.errors
+
+    async def _wait(self):
+        # 先讓 call_soon_threadsafe 排入的 add() 執行
+        await asyncio.sleep(0)
+        await self._coalescer.wait()
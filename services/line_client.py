@@ -0,0 +1,225 @@
+"""
+async 的 LINE Messaging API 用戶端
+
+- httpx.AsyncClient 保持 keep-alive 連線池，不必每則訊息重新建立 TLS 連線
+- 多則文字合併成一個請求（每個請求最多 5 則訊息）；同一則訊息發給多位用戶用 multicast（每次最多 500 人）
+- 依 LINE 的速率限制以 token bucket 控制送出速度（一般訊息與 multicast 各自計算）
+- 每個請求帶 X-Line-Retry-Key，429 / 5xx / 連線錯誤以同一個 key 重試，LINE 不會重複發送
+  （重試時收到 409 代表前一次已被接受，視為成功）
+- reply token 只能使用一次，超過 5 則的部分改用 push；token 被拒（400 Invalid reply token）時由呼叫端決定是否改用 push
+
+以 LINE_API_BASE_URL 指向 bench/mock_line.py 即可在本機測試
+"""
+import asyncio
+import random
+import time
+import uuid
+from utils.logger import logger
+
+MAX_MESSAGES_PER_REQUEST = 5
+MAX_MULTICAST_RECIPIENTS = 500
+
+
+class LineApiError(Exception):
+    """ LINE API 回傳錯誤 """
+
+    def __init__(self, status_code, message, request_id=None):
+        super().__init__(f"{status_code} {message}")
+        self.status_code = status_code
+        self.message = message
+        self.request_id = request_id
+
+    @property
+    def invalid_reply_token(self):
+        """ reply token 被拒（過期或已使用），這次回覆一定沒有送出，可以安全地改用 push """
+        return self.status_code == 400 and "reply token" in str(self.message).lower()
+
+
+class TokenBucket:
+    """ 每秒補充 `rate` 個名額，最多累積 `burst` 個（只在背景事件迴圈中使用） """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._lock = None
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def _text_messages(texts):
+    return [{"type": "text", "text": text} for text in texts]
+
+
+def _chunks(items, size):
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+class LineClient:
+    """ async 的 LINE 訊息用戶端（連線池在背景事件迴圈中第一次使用時建立） """
+
+    def __init__(self, access_token, base_url="https://api.line.me", max_connections=100, timeout=10,
+                 rate_limit=1000, multicast_rate_limit=100, max_retries=3):
+        self.access_token = access_token
+        self.base_url = base_url.rstrip("/")
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._message_bucket = TokenBucket(rate_limit)
+        self._multicast_bucket = TokenBucket(multicast_rate_limit)
+        self._http = None
+
+        self._requests = 0
+        self._messages = 0
+        self._retries = 0
+        self._rate_limited = 0
+        self._errors = 0
+
+    def _get_http(self):
+        if self._http is None:
+            import httpx
+
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.access_token}"},
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections, max_keepalive_connections=self.max_connections
+                )
+            )
+        return self._http
+
+    async def _post(self, path, body, bucket, retry_key=None):
+        """ 送出請求；可重試的錯誤以 jitter 退避後重試（有 retry key 時 LINE 端不會重複發送） """
+        import httpx
+
+        headers = {"X-Line-Retry-Key": retry_key} if retry_key else {}
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire()
+            self._requests += 1
+            try:
+                response = await self._get_http().post(path, json=body, headers=headers)
+            except httpx.TransportError as e:
+                error = e
+                retryable = True
+            else:
+                if response.status_code == 200:
+                    return
+                if response.status_code == 409 and retry_key and attempt > 0:
+                    return  # 前一次重試其實已被接受
+                if response.status_code == 429:
+                    self._rate_limited += 1
+                try:
+                    message = response.json().get("message", response.text)
+                except ValueError:
+                    message = response.text
+                error = LineApiError(response.status_code, message, response.headers.get("x-line-request-id"))
+                if attempt > 0 and error.invalid_reply_token:
+                    return  # 前一次 reply 其實已送出，token 已被用掉
+                # 沒有 retry key 時不重試 429（無法確認前一次是否已送出）
+                retryable = response.status_code >= 500 or (response.status_code == 429 and retry_key is not None)
+
+            if not retryable or attempt == self.max_retries:
+                self._errors += 1
+                raise error
+            self._retries += 1
+            delay = random.uniform(0, min(8.0, 0.5 * 2 ** attempt))
+            logger.warning("LINE API %s 失敗（%s），%.2f 秒後重試", path, error, delay)
+            await asyncio.sleep(delay)
+
+    async def reply(self, reply_token, user_id, texts):
+        """ 用 reply token 一次回覆最多 5 則；其餘的部分 push 給 `user_id` """
+        texts = list(texts)
+        await self._post(
+            "/v2/bot/message/reply",
+            {"replyToken": reply_token, "messages": _text_messages(texts[:MAX_MESSAGES_PER_REQUEST])},
+            self._message_bucket,
+            retry_key=str(uuid.uuid4())
+        )
+        self._messages += len(texts[:MAX_MESSAGES_PER_REQUEST])
+        if len(texts) > MAX_MESSAGES_PER_REQUEST:
+            await self.push(user_id, texts[MAX_MESSAGES_PER_REQUEST:])
+
+    async def push(self, user_id, texts):
+        """ push 給單一用戶，每 5 則合成一個請求 """
+        for chunk in _chunks(list(texts), MAX_MESSAGES_PER_REQUEST):
+            await self._post(
+                "/v2/bot/message/push",
+                {"to": user_id, "messages": _text_messages(chunk)},
+                self._message_bucket,
+                retry_key=str(uuid.uuid4())
+            )
+            self._messages += len(chunk)
+
+    async def multicast(self, user_ids, texts):
+        """ 同樣的訊息發給多位用戶，每次最多 500 人、5 則 """
+        for recipients in _chunks(list(user_ids), MAX_MULTICAST_RECIPIENTS):
+            for chunk in _chunks(list(texts), MAX_MESSAGES_PER_REQUEST):
+                await self._post(
+                    "/v2/bot/message/multicast",
+                    {"to": recipients, "messages": _text_messages(chunk)},
+                    self._multicast_bucket,
+                    retry_key=str(uuid.uuid4())
+                )
+                self._messages += len(chunk) * len(recipients)
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def stats(self):
+        return {
+            "requests": self._requests,
+            "messages": self._messages,
+            "retries": self._retries,
+            "rate_limited": self._rate_limited,
+            "errors": self._errors,
+        }
+
+
+class PushCoalescer:
+    """
+    依序 push 給同一用戶的段落：前一個 push 還在送時進來的段落，合併到下一個請求（最多 5 則）
+    add() 與 wait() 都在背景事件迴圈中執行
+    """
+
+    def __init__(self, client, user_id):
+        self.client = client
+        self.user_id = user_id
+        self._pending = []
+        self._task = None
+        self.errors = []
+
+    def add(self, text):
+        self._pending.append(text)
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while self._pending:
+            batch = self._pending[:MAX_MESSAGES_PER_REQUEST]
+            del self._pending[:MAX_MESSAGES_PER_REQUEST]
+            try:
+                await self.client.push(self.user_id, batch)
+            except Exception as e:
+                logger.error("push 失敗（%s，%d 則）：%s", self.user_id, len(batch), e)
+                self.errors.append(e)
+        self._task = None
+
+    async def wait(self):
+        """ 等待所有段落送出 """
+        while self._task is not None:
+            await asyncio.shield(self._task)
@@ -0,0 +1,80 @@
+"""
+封存檔的讀寫（不需要資料庫）：
+
+    python -m unittest tests.test_archive
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from core.archive import PENDING_FILE, UserArchive
+
+
+def _rows(start, count):
+    base = datetime(2025, 1, 1)
+    return [
+        (i, "user" if i % 2 else "bot", f"第 {i} 則訊息", None, None, base + timedelta(minutes=i))
+        for i in range(start, start + count)
+    ]
+
+
+class UserArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.archive = UserArchive(self.root, "U123")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _append(self, rows):
+        entry = self.archive.append(rows)
+        self.archive.commit()
+        return entry
+
+    def test_batches_in_one_segment_come_back_exactly_once(self):
+        entries = [self._append(_rows(start, 10)) for start in (0, 10, 20, 30)]
+        self.assertEqual({entry["segment"] for entry in entries}, {"seg-000001.zst"})
+
+        ids = [record["id"] for record in self.archive.iter_rows()]
+        self.assertEqual(ids, list(range(40)))
+        for start, entry in zip((0, 10, 20, 30), entries):
+            frame_ids = [record["id"] for record in self.archive._read_frame(entry)]
+            self.assertEqual(frame_ids, list(range(start, start + 10)))
+
+    def test_segments_roll_over(self):
+        archive = UserArchive(self.root, "U456", segment_max_bytes=1)
+        for start in (0, 10, 20):
+            archive.append(_rows(start, 10))
+            archive.commit()
+        self.assertEqual([entry["segment"] for entry in archive.entries()],
+                         ["seg-000001.zst", "seg-000002.zst", "seg-000003.zst"])
+        self.assertEqual([record["id"] for record in archive.iter_rows()], list(range(30)))
+
+    def test_recover_deletes_indexed_batch(self):
+        self._append(_rows(0, 10))
+        entry = self.archive.append(_rows(10, 10))  # 刪除資料庫前中斷（PENDING 還在）
+        deleted = []
+        UserArchive(self.root, "U123").recover(deleted.extend)
+        self.assertEqual(deleted, list(range(10, 20)))
+        self.assertFalse(os.path.exists(os.path.join(self.archive.path, PENDING_FILE)))
+        self.assertEqual(entry["rows"], 10)
+
+    def test_recover_truncates_partial_frame(self):
+        self._append(_rows(0, 10))
+        segment_path = os.path.join(self.archive.path, "seg-000001.zst")
+        size = os.path.getsize(segment_path)
+        with open(os.path.join(self.archive.path, PENDING_FILE), "w", encoding="utf-8") as f:
+            json.dump({"segment": "seg-000001.zst", "offset": size}, f)
+        with open(segment_path, "ab") as f:
+            f.write(b"partial frame")
+
+        UserArchive(self.root, "U123").recover(lambda ids: self.fail("不應刪除資料庫"))
+        self.assertEqual(os.path.getsize(segment_path), size)
+        self.assertEqual([record["id"] for record in self.archive.iter_rows()], list(range(10)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,34 @@
+import atexit
 import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-)
+# 記錄先放進佇列，由背景執行緒格式化並寫到 stdout，處理訊息的執行緒不必等待輸出
+_handler = logging.StreamHandler()
+_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+_queue_handler = QueueHandler(queue.SimpleQueue())
+# 放進佇列前只把參數代入訊息，時間與等級由背景執行緒格式化
+_queue_handler.setFormatter(logging.Formatter("%(message)s"))
+
+logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
+
+_listener = None
+
+def _start_listener():
+    global _listener
+    _listener = QueueListener(_queue_handler.queue, _handler, respect_handler_level=True)
+    _listener.start()
+
+def _restart_after_fork():
+    # fork 後子行程沒有背景執行緒，換一個新的佇列並重新啟動
+    _queue_handler.queue = queue.SimpleQueue()
+    _start_listener()
+
+_start_listener()
+# 結束時把佇列中剩下的記錄寫完
+atexit.register(lambda: _listener.stop())
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
 
 logger = logging.getLogger("line_bot")
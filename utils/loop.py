@@ -0,0 +1,55 @@
+"""
+背景事件迴圈：讓在 worker 執行緒中執行的同步程式碼呼叫 async 的用戶端（OpenAI、LINE）
+
+- 每個行程一個迴圈，在專屬執行緒中執行，第一次使用時才啟動
+- async 用戶端的連線池、semaphore 都綁在這個迴圈上，所有 worker 執行緒共用
+- fork 後的子行程不會繼承執行緒，下次使用時重新啟動
+"""
+import asyncio
+import os
+import threading
+
+_loop = None
+_lock = threading.Lock()
+
+
+def get_loop():
+    """ 取得背景事件迴圈，尚未啟動時在此啟動 """
+    global _loop
+    if _loop is None:
+        with _lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="io-loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def _forget_loop():
+    global _loop, _lock
+    _loop = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_loop)
+
+
+def run_sync(coro, timeout=None):
+    """ 在背景迴圈執行 coroutine，等待並回傳結果（不可在背景迴圈的執行緒中呼叫） """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result(timeout)
+
+
+def iterate_sync(async_iterable):
+    """ 把 async iterator 轉成同步 generator，每取一個元素就在背景迴圈執行一次 """
+    iterator = async_iterable.__aiter__()
+    try:
+        while True:
+            try:
+                yield run_sync(iterator.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        # 呼叫端提早結束時也要關閉 async generator，釋放連線
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            run_sync(aclose())
@@ -0,0 +1,34 @@
+import os
+import resource
+import time
+
+_imported_at = time.monotonic()
+
+def process_uptime():
+    """ 本行程啟動至今的秒數（讀 /proc，無法讀取時以本模組載入時間估算） """
+    try:
+        with open("/proc/self/stat") as f:
+            # 第 22 個欄位是行程啟動時間（開機後的 clock ticks）；行程名稱可能含空白，從 ")" 之後切
+            fields = f.read().rsplit(")", 1)[1].split()
+        start_ticks = int(fields[19])
+        with open("/proc/uptime") as f:
+            system_uptime = float(f.read().split()[0])
+        return system_uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - _imported_at
+
+def current_rss_mb():
+    """ 目前的常駐記憶體（MB），無法讀取 /proc 時回傳峰值 """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def cpu_seconds():
+    """ 本行程累計的 CPU 時間（user + system 秒數） """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
@@ -0,0 +1,87 @@
+import bisect
+import threading
+from collections import deque
+
+
+class ValueWindow:
+    """ 保留最近 N 筆數值，用來計算平均值與百分位數，可跨執行緒使用 """
+
+    def __init__(self, size=1000):
+        self._values = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        with self._lock:
+            self._values.append(value)
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+
+    def percentile(self, p):
+        with self._lock:
+            ordered = sorted(self._values)
+        if not ordered:
+            return 0.0
+        index = min(len(ordered) - 1, int(len(ordered) * p))
+        return ordered[index]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
+
+
+class LatencyWindow(ValueWindow):
+    """ 保留最近 N 筆耗時（秒），摘要以毫秒表示 """
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "avg_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "p50_ms": self.percentile(0.50) * 1000,
+            "p95_ms": self.percentile(0.95) * 1000,
+            "p99_ms": self.percentile(0.99) * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+
+# Prometheus 預設的延遲分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """ 固定分桶的累計直方圖（從啟動起算，不會只保留最近 N 筆），可跨執行緒使用 """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # 最後一格是 +Inf
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.total += value
+
+    def snapshot(self):
+        """ 回傳 ([(上界, 累計筆數)...], 總和, 筆數)，最後一個上界是 +Inf """
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self.total, self.count
+        cumulative = []
+        running = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            running += bucket_count
+            cumulative.append((bound, running))
+        return cumulative, total, count